@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 __all__ = [
+  'archives',
   'compat',
   'colors',
   'config',
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# distutils: language=c++
+# -*- coding: utf-8 -*-
+
+'''Single-file binary archives of named numpy arrays, loadable via memory mapping'''
+
+# Standard libraries
+import json
+import mmap
+import os
+import shutil
+import struct
+
+# 3rd party library
+import numpy as np
+
+# Local libraries
+from lpu.common import files
+from lpu.common import logging
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'LPUARRAYS\n'
+ALIGNMENT = 64
+COPY_BUFFER_SIZE = 2 ** 24
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _check_uncompressed(path, mode):
+    # archives are seeked, truncated and mapped, which compressed streams cannot do
+    if files.get_ext(path) == '.gz' or (mode.find('r') >= 0 and files.is_gzipped(path)):
+        raise ValueError("array archive cannot be compressed: {}".format(path))
+
+class RawArrayFile(object):
+    '''raw binary file of 1-d array, copied into the archive without loading it into memory
+
+    list of paths can be given as well, to store the concatenation of the files,
+    and the array can be reshaped by giving the shape
+    '''
+    def __init__(self, path, dtype, shape=None):
+        self.paths = [path] if isinstance(path, str) else list(path)
+        self.dtype = np.dtype(dtype)
+        self.nbytes = sum([os.path.getsize(part_path) for part_path in self.paths])
+        self.shape = (self.nbytes // self.dtype.itemsize,)
+        if shape is not None:
+            if int(np.prod(shape)) != self.shape[0]:
+                raise ValueError("cannot reshape array of size {} into shape {}".format(self.shape[0], tuple(shape)))
+            self.shape = tuple(shape)
+
+    def write_to(self, fobj):
+        for path in self.paths:
+            with open(path, 'rb') as src_fobj:
+                shutil.copyfileobj(src_fobj, fobj, COPY_BUFFER_SIZE)
+
+def save_arrays(path, arrays, meta=None):
+    '''save named arrays with meta data (json serializable) into single binary file
+
+    layout: MAGIC, header length (uint64), json header, and then raw arrays
+    aligned to ALIGNMENT bytes, so every array can be mapped without copying
+
+    arrays can also be given as RawArrayFile to store arrays larger than memory
+    '''
+    # contiguous arrays are put into a copy, not to modify the given dict
+    arrays = dict(arrays)
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        if not isinstance(array, RawArrayFile):
+            array = np.ascontiguousarray(array)
+            arrays[name] = array
+        entries[name] = dict(dtype=array.dtype.str, shape=list(array.shape), offset=offset)
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps(dict(meta=meta or {}, arrays=entries)).encode('utf-8')
+    base = _aligned(len(MAGIC) + 8 + len(header))
+    _check_uncompressed(path, 'wb')
+    # writing into temporary file not to break the pages mapped from the old file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fobj:
+        fobj.write(MAGIC)
+        fobj.write(struct.pack('<Q', len(header)))
+        fobj.write(header)
+        fobj.write(b'\0' * (base - len(MAGIC) - 8 - len(header)))
+        for name, entry in entries.items():
+            fobj.seek(base + entry['offset'])
+            if isinstance(arrays[name], RawArrayFile):
+                arrays[name].write_to(fobj)
+            else:
+                fobj.write(arrays[name].tobytes())
+        # keeping the file size even if the last array is empty
+        fobj.seek(base + offset)
+        fobj.truncate()
+    os.replace(tmp_path, path)
+    return True
+
+def load_arrays(path, use_mmap=True):
+    '''load arrays saved by save_arrays, returns (dict of arrays, meta data)
+
+    memory mapped arrays are read-only and share the pages between processes
+    '''
+    _check_uncompressed(path, 'rb')
+    with open(path, 'rb') as fobj:
+        if fobj.read(len(MAGIC)) != MAGIC:
+            raise ValueError("not an array archive file: {}".format(path))
+        header_len = struct.unpack('<Q', fobj.read(8))[0]
+        header = json.loads(fobj.read(header_len).decode('utf-8'))
+        base = _aligned(len(MAGIC) + 8 + header_len)
+        if use_mmap:
+            buf = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            fobj.seek(0)
+            buf = fobj.read()
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        array = np.frombuffer(buf, dtype, count=count, offset=base + entry['offset'])
+        arrays[name] = array.reshape(entry['shape'])
+    return arrays, header['meta']
+
+def is_archive(path):
+    '''check whether given file is saved by save_arrays (also true for the compressed one, which cannot be loaded)'''
+    try:
+        with files.open(path, 'rb') as fobj:
+            return fobj.read(len(MAGIC)) == MAGIC
+    except Exception as e:
+        logger.debug(repr(e))
+        return False
@@ -653,3 +653,4 @@ CRITICAL = logging.CRITICAL
 Filter = logging.Filter
 StreamHandler = logging.StreamHandler
 FileHandler = logging.FileHandler
+disable = logging.disable
@@ -1,17 +1,49 @@
 #from libcpp cimport bool
+cimport cython
 
 #cdef class StringEnumerator:
 cdef class StringEnumerator(object):
-    cdef dict dict_str2id
-    cdef list list_id2str
+    cdef object buffer
+    cdef object offsets
+    cdef object hashes
+    cdef object table
+    cdef long size
+    cdef const unsigned char[:] buffer_view
+    cdef const long long[:] offsets_view
+    cdef const unsigned int[:] hashes_view
+    cdef const int[:] table_view
+    cdef unsigned char[:] writable_buffer
+    cdef long long[:] writable_offsets
+    cdef unsigned int[:] writable_hashes
+    cdef int[:] writable_table
 
     #cpdef bool append(self, str string)
     cpdef bint append(self, str string)
+    cpdef long find(self, str string)
     cpdef long str2id(self, str string)
     cpdef str id2str(self, long number)
+    cdef void _update_views(self)
+    @cython.locals(mask=long, slot=long, index=long, start=long, i=long)
+    cdef long _probe(self, const unsigned char* data, long begin, long length, unsigned int h) except -1
+    @cython.locals(h=cython.uint, slot=long, index=long)
+    cpdef long _key_id(self, bytes key, bint register) except? -2
+    @cython.locals(new_id=long, used=long, i=long)
+    cdef long _append(self, const unsigned char* data, long begin, long length, unsigned int h, long slot) except -1
+    cpdef _key_ids(self, bytes data, starts, ends, bint register)
+    @cython.locals(num_keys=long, i=long, begin=long, length=long, h=cython.uint, slot=long, index=long)
+    cdef void _fill_ids(self, bytes data, const long long[:] starts, const long long[:] ends, long long[:] ids, bint register) except *
+    @cython.locals(capacity=long, mask=long, index=long, slot=long)
+    cdef void _rehash(self) except *
+
+#cdef class PhraseEnumerator:
+cdef class PhraseEnumerator(object):
+    cdef StringEnumerator index
+
+@cython.locals(h=cython.uint, mask=cython.uint, i=long)
+cdef unsigned int _hash_bytes(const unsigned char* data, long begin, long end)
 
 cdef StringEnumerator word_enum
-cdef StringEnumerator phrase_enum
+cdef PhraseEnumerator phrase_enum
 
 cpdef long word2id(str word)
 cpdef str id2word(long number)
@@ -4,76 +4,371 @@
 
 '''functions mapping from words/phrases to IDs and vice versa'''
 
+# Standard libraries
+import array
+
+# 3rd party library
+import numpy as np
+
 # Local libraries
 from lpu.backends import safe_cython as cython
-from lpu.data_structs.trie import TwoWayIDMap
+from lpu.common import archives
 
 #wordMap   = TwoWayIDMap()
 #wordMap   = {}
-phraseMap = TwoWayIDMap()
+#phraseMap = TwoWayIDMap()
 #phraseMap = {}
 
+VOCAB_FORMAT = 'lpu-vocab'
+
+# initial number of slots of the hash table (power of 2)
+TABLE_SIZE = 16
+
+def _hash_bytes(data, begin, end):
+    '''32-bit FNV-1a hash of data[begin:end]'''
+    h = 2166136261
+    mask = 0xffffffff
+    i = begin
+    while i < end:
+        h = ((h ^ data[i]) * 16777619) & mask
+        i += 1
+    return h
+
+def _grow(array, capacity):
+    '''copy of the array extended to have at least given capacity (by doubling)'''
+    size = max(len(array), 1)
+    while size < capacity:
+        size *= 2
+    grown = np.zeros(size, array.dtype)
+    grown[:len(array)] = array
+    return grown
+
 #cdef class StringEnumerator:
 class StringEnumerator(object):
+    '''sequential ids of strings, storing all the strings in single utf-8 buffer with their offsets,
+    looked up by open-addressing hash table of the ids (without python objects for each string)'''
     # defined in vocab.pxd
-    # cdef dict dict_str2id
-    # cdef list list_id2str
+    # cdef object buffer
+    # cdef object offsets
+    # cdef object hashes
+    # cdef object table
+    # cdef long size
 
     #def __cinit__(self):
     def __init__(self):
-        self.dict_str2id = {}
-        self.list_id2str = []
+        # buffer and offsets have extra capacity, offsets[i]:offsets[i+1] is the range of i-th string
+        self.buffer = np.zeros(0, np.uint8)
+        self.offsets = np.zeros(1, np.int64)
+        self.hashes = np.zeros(0, np.uint32)
+        # ids of the strings (-1 for empty slots), filled up to the half at most
+        self.table = np.full(TABLE_SIZE, -1, np.int32)
+        self.size = 0
+        self._update_views()
 
     #cpdef bool append(self, str string):
     def append(self, string):
         self.str2id(string)
         return True
 
+    def _update_views(self):
+        # views of the arrays to probe the table and append the keys without python objects,
+        # writable ones are None while the arrays are read-only (loaded from memory map)
+        self.buffer_view = self.buffer
+        self.offsets_view = self.offsets
+        self.hashes_view = self.hashes
+        self.table_view = self.table
+        if self.buffer.flags.writeable and self.offsets.flags.writeable and self.hashes.flags.writeable and self.table.flags.writeable:
+            self.writable_buffer = self.buffer
+            self.writable_offsets = self.offsets
+            self.writable_hashes = self.hashes
+            self.writable_table = self.table
+        else:
+            self.writable_buffer = None
+            self.writable_offsets = None
+            self.writable_hashes = None
+            self.writable_table = None
+
+    def _probe(self, data, begin, length, h):
+        '''slot of the table holding the id of the key data[begin:begin+length], or the empty slot to put it'''
+        mask = len(self.table_view) - 1
+        slot = h & mask
+        while True:
+            index = self.table_view[slot]
+            if index < 0:
+                return slot
+            start = self.offsets_view[index]
+            if self.hashes_view[index] == h and self.offsets_view[index+1] - start == length:
+                i = 0
+                while i < length and self.buffer_view[start+i] == data[begin+i]:
+                    i += 1
+                if i == length:
+                    return slot
+            slot = (slot + 1) & mask
+
+    #cpdef long find(self, str string):
+    def find(self, string):
+        '''id of the string without registering it, -1 if not registered'''
+        return self._key_id(string.encode('utf-8'), False)
+
     #cpdef long str2id(self, str string):
-    @cython.locals(new_id = long)
     def str2id(self, string):
-        #cdef long new_id
-        if string in self.dict_str2id:
-            return self.dict_str2id[string]
+        return self._key_id(string.encode('utf-8'), True)
+
+    def _key_id(self, key, register):
+        '''id of the key (bytes), registering it if register is true, otherwise -1 if not registered'''
+        h = _hash_bytes(key, 0, len(key))
+        slot = self._probe(key, 0, len(key), h)
+        index = self.table_view[slot]
+        if index >= 0 or not register:
+            return index
+        return self._append(key, 0, len(key), h, slot)
+
+    def _append(self, data, begin, length, h, slot):
+        '''register the key data[begin:begin+length] with its hash into the empty slot given by _probe, returns the new id'''
+        new_id = self.size
+        used = self.offsets_view[new_id]
+        if self.writable_table is None or new_id + 2 > len(self.offsets_view) or new_id + 1 > len(self.hashes_view) or used + length > len(self.buffer_view):
+            self._reserve(1, length)
+        i = 0
+        while i < length:
+            self.writable_buffer[used+i] = data[begin+i]
+            i += 1
+        self.writable_offsets[new_id+1] = used + length
+        self.writable_hashes[new_id] = h
+        self.size += 1
+        if self.size * 2 > len(self.table_view):
+            self._rehash()
         else:
-            new_id = len(self.list_id2str)
-            self.list_id2str.append(string)
-            self.dict_str2id[string] = new_id
-            return new_id
+            self.writable_table[slot] = new_id
+        return new_id
 
     #cpdef str id2str(self, long number):
     def id2str(self, number):
-        if 0 <= number and number < len(self.list_id2str):
-            return self.list_id2str[number]
+        if 0 <= number and number < self.size:
+            return self.buffer[self.offsets_view[number]:self.offsets_view[number+1]].tobytes().decode('utf-8')
         else:
             raise IndexError("id %s is not registered in vocabulary set" % (number,))
 
+    def encode(self, strings, register=True):
+        '''ids of the list of strings (e.g. tokens of a line or a batch of lines) at once,
+        registering new strings if register is true, otherwise giving -1 for them'''
+        data = str.join('\n', strings).encode('utf-8')
+        separators = np.flatnonzero(np.frombuffer(data, np.uint8) == ord('\n'))
+        if len(separators) == len(strings) - 1:
+            # strings are found between the new lines of the joined buffer
+            starts = np.zeros(len(strings), np.int64)
+            starts[1:] = separators + 1
+            ends = np.full(len(strings), len(data), np.int64)
+            ends[:-1] = separators
+            return self._key_ids(data, starts, ends, register)
+        # some strings have new lines by themselves
+        keys = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(keys) + 1, np.int64)
+        offsets[1:] = np.cumsum(np.fromiter(map(len, keys), np.int64, len(keys)))
+        return self._key_ids(b''.join(keys), offsets[:-1], offsets[1:], register)
+
+    def decode(self, ids):
+        '''list of the strings of given ids'''
+        ids = np.asarray(ids, np.int64)
+        if len(ids) > 0 and (ids.min() < 0 or ids.max() >= self.size):
+            raise IndexError("ids out of range [0, %s) are not registered in vocabulary set" % (self.size,))
+        return [self.buffer[begin:end].tobytes().decode('utf-8') for begin, end in zip(self.offsets[ids].tolist(), self.offsets[ids+1].tolist())]
+
+    def _key_ids(self, data, starts, ends, register):
+        '''ids of the keys data[starts[i]:ends[i]] (which may be repeated), registering new keys in order of first occurrence
+        if register is true, otherwise giving -1 for them'''
+        starts = np.ascontiguousarray(starts, np.int64)
+        ends = np.ascontiguousarray(ends, np.int64)
+        if len(starts) != len(ends) or (len(starts) > 0 and (starts.min() < 0 or ends.max() > len(data) or (ends < starts).any())):
+            raise ValueError("key ranges out of the buffer of {} bytes".format(len(data)))
+        ids = np.empty(len(starts), np.int64)
+        self._fill_ids(data, starts, ends, ids, register)
+        return ids
+
+    def _fill_ids(self, data, starts, ends, ids, register):
+        # probing the table for each key in typed loop (the ranges are checked by _key_ids)
+        num_keys = len(ids)
+        i = 0
+        while i < num_keys:
+            begin = starts[i]
+            length = ends[i] - begin
+            h = _hash_bytes(data, begin, begin + length)
+            slot = self._probe(data, begin, length, h)
+            index = self.table_view[slot]
+            if index < 0 and register:
+                index = self._append(data, begin, length, h, slot)
+            ids[i] = index
+            i += 1
+
+    def _reserve(self, num_strings, num_bytes):
+        '''extend the capacities (by doubling) to append given number of strings and bytes'''
+        used = self.offsets[self.size]
+        if not self.table.flags.writeable:
+            # arrays loaded from read-only memory map are copied before modified
+            self.buffer = self.buffer.copy()
+            self.offsets = self.offsets.copy()
+            self.hashes = self.hashes.copy()
+            self.table = self.table.copy()
+        if self.size + num_strings + 1 > len(self.offsets):
+            self.offsets = _grow(self.offsets, self.size + num_strings + 1)
+        if self.size + num_strings > len(self.hashes):
+            self.hashes = _grow(self.hashes, self.size + num_strings)
+        if used + num_bytes > len(self.buffer):
+            self.buffer = _grow(self.buffer, used + num_bytes)
+        self._update_views()
+
+    def _rehash(self):
+        '''rebuild the hash table with the capacity of at least twice the number of strings'''
+        capacity = TABLE_SIZE
+        while capacity < self.size * 2:
+            capacity *= 2
+        self.table = np.full(capacity, -1, np.int32)
+        self._update_views()
+        mask = capacity - 1
+        index = 0
+        while index < self.size:
+            slot = self.hashes_view[index] & mask
+            while self.table_view[slot] >= 0:
+                slot = (slot + 1) & mask
+            self.writable_table[slot] = index
+            index += 1
+
     @cython.locals(i = long)
     @cython.locals(length = long)
     def ids(self):
         #cdef long i = 0, length = len(self.list_id2str)
         i = 0
-        length = len(self.list_id2str)
+        length = self.size
         while i < length:
             yield i
             i += 1
 
-    @cython.locals(string = str)
     def strings(self):
-        #cdef str string
-        for string in self.list_id2str:
-            yield string
+        data = self.buffer.tobytes()
+        offsets = self.offsets[:self.size+1].tolist()
+        for i in range(self.size):
+            yield data[offsets[i]:offsets[i+1]].decode('utf-8')
 
     def __iter__(self):
         return self.strings()
 
     def __len__(self):
-        return len(self.list_id2str)
+        return self.size
+
+    def __reduce__(self):
+        return (_from_arrays, self.to_arrays())
+
+    def to_arrays(self):
+        '''return (utf-8 buffer of all the strings, offsets of each string) to store in binary form'''
+        return self.buffer[:self.offsets[self.size]], self.offsets[:self.size+1]
+
+    def load_arrays(self, buf, offsets):
+        '''register strings stored by to_arrays in the order of stored ids, returns their ids in this set'''
+        offsets = np.asarray(offsets, np.int64)
+        return self._key_ids(np.asarray(buf, np.uint8).tobytes(), offsets[:-1], offsets[1:], True)
+
+    def save(self, path):
+        '''save the strings with the hash table into binary file (loadable by load without rehashing)'''
+        buf, offsets = self.to_arrays()
+        arrays = dict(buffer=buf, offsets=offsets, hashes=self.hashes[:self.size], table=self.table)
+        return archives.save_arrays(path, arrays, dict(format=VOCAB_FORMAT, size=self.size))
+
+    def load(self, path):
+        '''replace the strings with those saved by save (memory mapped until new strings are appended)'''
+        arrays, meta = archives.load_arrays(path)
+        if meta.get('format') != VOCAB_FORMAT:
+            raise ValueError("not a vocabulary file: {}".format(path))
+        self.buffer = arrays['buffer']
+        self.offsets = arrays['offsets']
+        self.hashes = arrays['hashes']
+        self.table = arrays['table']
+        self.size = meta['size']
+        self._update_views()
+        return self
+
+def _from_arrays(buf, offsets):
+    enumerator = StringEnumerator()
+    enumerator.load_arrays(buf, offsets)
+    return enumerator
+
+def _pack(word_ids):
+    '''word ids packed into int32 bytes (key of the phrase), the only object allocated for a single lookup'''
+    if isinstance(word_ids, np.ndarray):
+        return np.ascontiguousarray(word_ids, np.int32).tobytes()
+    return array.array('i', word_ids).tobytes()
+
+#cdef class PhraseEnumerator:
+class PhraseEnumerator(object):
+    '''sequential ids of phrases (starting from 1) given as sequences of word ids, keyed on the packed int32 word ids
+    stored in the arena (buffer with offsets) and the hash table of StringEnumerator (i-th key of the index is the phrase i+1)'''
+    # defined in vocab.pxd
+    # cdef StringEnumerator index
+
+    #def __cinit__(self):
+    def __init__(self):
+        self.index = StringEnumerator()
+
+    def find(self, word_ids):
+        '''id of the phrase without registering it, -1 if not registered'''
+        index = self.index._key_id(_pack(word_ids), False)
+        if index < 0:
+            return -1
+        return index + 1
+
+    def ids2id(self, word_ids):
+        return self.index._key_id(_pack(word_ids), True) + 1
+
+    def id2ids(self, number):
+        '''word ids of the phrase (read-only view of the arena, not copied)'''
+        if 1 <= number and number <= len(self.index):
+            ids = self.index.buffer[self.index.offsets[number-1]:self.index.offsets[number]].view(np.int32)
+            ids.flags.writeable = False
+            return ids
+        else:
+            raise IndexError("id %s is not registered in phrase set" % (number,))
+
+    def encode(self, word_ids, offsets, register=True):
+        '''ids of the phrases packed into the word ids with offsets (e.g. all the phrases of a table) at once,
+        registering new phrases if register is true, otherwise giving -1 for them'''
+        data = np.ascontiguousarray(word_ids, np.int32).tobytes()
+        bounds = np.asarray(offsets, np.int64) * 4
+        ids = self.index._key_ids(data, bounds[:-1], bounds[1:], register)
+        return np.where(ids >= 0, ids + 1, -1)
+
+    def decode(self, ids):
+        '''word ids of given phrases packed with their offsets, as (word ids, offsets)'''
+        ids = np.asarray(ids, np.int64) - 1
+        if len(ids) > 0 and (ids.min() < 0 or ids.max() >= len(self.index)):
+            raise IndexError("ids out of range [1, %s] are not registered in phrase set" % (len(self.index),))
+        starts = self.index.offsets[ids] // 4
+        lengths = self.index.offsets[ids+1] // 4 - starts
+        offsets = np.zeros(len(ids) + 1, np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        arena = self.index.buffer[:self.index.offsets[len(self.index)]].view(np.int32)
+        return arena[np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])], offsets
+
+    def __len__(self):
+        return len(self.index)
+
+    def to_arrays(self):
+        '''return (word ids of all the phrases, offsets of each phrase) to store in binary form'''
+        return self.decode(np.arange(1, len(self.index) + 1))
+
+    def load_arrays(self, word_ids, offsets):
+        '''register phrases stored by to_arrays in the order of stored ids, returns their ids in this set'''
+        return self.encode(word_ids, offsets)
+
+    def save(self, path):
+        return self.index.save(path)
+
+    def load(self, path):
+        self.index.load(path)
+        return self
 
 #cdef StringEnumerator word_enum   = StringEnumerator()
-#cdef StringEnumerator phrase_enum = StringEnumerator()
+#cdef PhraseEnumerator phrase_enum = PhraseEnumerator()
 word_enum   = StringEnumerator()
-phrase_enum = StringEnumerator()
+phrase_enum = PhraseEnumerator()
 
 #cpdef long word2id(str word):
 def word2id(word):
@@ -100,15 +395,22 @@ def idvec2phrase(idvec):
     return str.join(' ', map(id2word, map(int, idvec.split(','))))
 
 #cpdef long phrase2id(str phrase):
-@cython.locals(idvec = str)
 def phrase2id(phrase):
-    #cdef str idvec = str.join(',', map(str, map(word2id, phrase.split(' '))))
-    idvec = str.join(',', map(str, map(word2id, phrase.split(' '))))
-    return phraseMap[idvec]
+    return phrase_enum.ids2id([word_enum.str2id(word) for word in phrase.split(' ')])
 
 #cpdef str id2phrase(long number):
-@cython.locals(idvec = str)
 def id2phrase(number):
-    #cdef str idvec = phraseMap.id2str(number)
-    idvec = phraseMap.id2str(number)
-    return str.join(' ', map(id2word, map(int, idvec.split(','))))
+    return str.join(' ', [word_enum.id2str(word_id) for word_id in phrase_enum.id2ids(number).tolist()])
+
+def phrases2ids(phrases):
+    '''ids of the list of phrases at once (e.g. all the phrases of a table)'''
+    words = [phrase.split(' ') for phrase in phrases]
+    offsets = np.zeros(len(words) + 1, np.int64)
+    offsets[1:] = np.cumsum([len(phrase_words) for phrase_words in words])
+    return phrase_enum.encode(word_enum.encode([word for phrase_words in words for word in phrase_words]), offsets)
+
+def ids2phrases(ids):
+    '''list of the phrases of given ids'''
+    word_ids, offsets = phrase_enum.decode(ids)
+    words = word_enum.decode(word_ids)
+    return [str.join(' ', words[begin:end]) for begin, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
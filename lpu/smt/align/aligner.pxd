@@ -0,0 +1,19 @@
+# C++ set-up
+from libcpp cimport bool
+
+# 3-rd party library
+cimport numpy as np
+from numpy cimport ndarray
+
+# local library
+from . corpus cimport ParallelCorpus
+from . ibm_models cimport Model
+
+cdef class Aligner:
+    cdef readonly Model model
+    cdef readonly bool character_based
+
+    cpdef ParallelCorpus encode(self, list src_sents, list trg_sents)
+    cpdef ndarray entropies(self, ParallelCorpus sent_pairs)
+    cpdef list viterbi(self, ParallelCorpus sent_pairs)
+    cpdef list posteriors(self, ParallelCorpus sent_pairs, double threshold=*)
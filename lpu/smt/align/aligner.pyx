@@ -0,0 +1,96 @@
+# distutils: language=c++
+# -*- coding: utf-8 -*-
+
+'''in-process alignment of sentence pairs in batches, without going through files
+
+    >>> aligner = Aligner('model.bin')
+    >>> entropies, alignments = aligner.align(['das haus'], ['the house'])
+'''
+
+# C++ set-up
+from libcpp cimport bool
+
+# 3-rd party library
+import numpy as np
+cimport numpy as np
+from numpy cimport ndarray
+
+# Local libraries
+from lpu.common import logging
+
+from . corpus cimport ParallelCorpus
+from . ibm_models cimport Model
+from . ibm_models cimport batch_step
+from . ibm_models cimport length_buckets
+from . ibm_models cimport load_model_file
+from . sparse cimport SparseMatrix
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+# minimum posterior probability of the alignment links kept in the posterior matrices
+POSTERIOR_THRESHOLD = 0.01
+
+cdef class Aligner:
+    '''aligner holding the binary model saved by "lpu-word-align-train --save-model"
+
+    sentences are given as lines (words separated by spaces, or characters in character based mode)
+    or lists of words; packed word ids can be given as ParallelCorpus as well, whose source sentences
+    begin with NULL word (id 0) as returned by encode
+    '''
+    # defined in aligner.pxd
+    #cdef readonly Model model
+    #cdef readonly bool character_based
+
+    def __init__(self, str model_path, character_based=False):
+        self.model = load_model_file(model_path)
+        self.character_based = character_based
+
+    cpdef ParallelCorpus encode(self, list src_sents, list trg_sents):
+        '''sentence pairs of word ids, unknown words are replaced with their classes or the unknown symbol'''
+        if len(src_sents) != len(trg_sents):
+            raise ValueError("numbers of source and target sentences are different: {} != {}".format(len(src_sents), len(trg_sents)))
+        return self.model.vocab.encode_sent_pairs(src_sents, trg_sents, self.character_based)
+
+    cpdef ndarray entropies(self, ParallelCorpus sent_pairs):
+        '''entropy of each sentence pair normalized by the target length (as given by lpu-word-align-score)'''
+        self.model.fit_lengths(sent_pairs)
+        return self.model.calc_scores(sent_pairs, 0, len(sent_pairs))
+
+    cpdef list viterbi(self, ParallelCorpus sent_pairs):
+        '''Viterbi alignment of each sentence pair, as array of the best source index (0 for NULL) of each target word'''
+        cdef ndarray offsets = sent_pairs.trg_offsets - sent_pairs.trg_offsets[0]
+        if len(sent_pairs) == 0:
+            return []
+        self.model.fit_lengths(sent_pairs)
+        return np.split(self.model.decode(sent_pairs, 0, len(sent_pairs)), offsets[1:-1])
+
+    cpdef list posteriors(self, ParallelCorpus sent_pairs, double threshold=POSTERIOR_THRESHOLD):
+        '''posterior probabilities of alignment links of each sentence pair, as SparseMatrix of
+        (source length with NULL x target length) keeping the links with probabilities not less than threshold'''
+        cdef list matrices = [None] * len(sent_pairs)
+        cdef ndarray indices, src_sents, trg_sents, probs, keys
+        cdef int len_src, len_trg
+        cdef long i, j, k, step
+        self.model.fit_lengths(sent_pairs)
+        for len_src, len_trg, indices, src_sents, trg_sents in length_buckets(sent_pairs):
+            step = batch_step(len_src * len_trg)
+            for i in range(0, len(indices), step):
+                j = min(i + step, len(indices))
+                probs = self.model.posterior_bucket(len_src, len_trg, src_sents[i:j], trg_sents[i:j]).reshape(j - i, -1)
+                for k in range(j - i):
+                    keys = np.flatnonzero(probs[k] >= threshold)
+                    matrices[indices[i+k]] = SparseMatrix((len_src, len_trg), keys, probs[k][keys])
+        return matrices
+
+    def align(self, src_sents, trg_sents=None, posteriors=False, threshold=POSTERIOR_THRESHOLD):
+        '''align sentence pairs given as lists of sentences (or ParallelCorpus as src_sents with trg_sents=None),
+        returns (entropies, Viterbi alignments), or (entropies, Viterbi alignments, posterior matrices) with posteriors=True'''
+        cdef ParallelCorpus sent_pairs
+        if isinstance(src_sents, ParallelCorpus):
+            sent_pairs = src_sents
+        else:
+            sent_pairs = self.encode(list(src_sents), list(trg_sents))
+        if posteriors:
+            return self.entropies(sent_pairs), self.viterbi(sent_pairs), self.posteriors(sent_pairs, threshold)
+        return self.entropies(sent_pairs), self.viterbi(sent_pairs)
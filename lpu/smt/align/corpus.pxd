@@ -0,0 +1,45 @@
+
+# 3-rd party library
+cimport numpy as np
+from numpy cimport ndarray
+
+cdef class ParallelCorpus:
+    cdef readonly ndarray src_tokens
+    cdef readonly ndarray src_offsets
+    cdef readonly ndarray trg_tokens
+    cdef readonly ndarray trg_offsets
+
+    cpdef tuple pair(self, long index)
+    cpdef ndarray src_lengths(self)
+    cpdef ndarray trg_lengths(self)
+    cpdef tuple pack(self, long begin, long end)
+    cpdef ndarray pair_costs(self, long begin, long end)
+    cpdef list chunk_bounds(self, long begin, long end, long chunk_size)
+    cpdef tuple max_lengths(self)
+    cpdef ndarray length_counts(self)
+    cpdef ParallelCorpus slice(self, long begin, long end)
+    cpdef save(self, str path, dict vocab_arrays, dict meta)
+
+cdef class CorpusBuilder:
+    cdef object src_tokens
+    cdef object src_offsets
+    cdef object trg_tokens
+    cdef object trg_offsets
+
+    cpdef append(self, src_ids, trg_ids)
+    cpdef ParallelCorpus build(self)
+
+cdef class CorpusWriter:
+    cdef long chunk_size
+    cdef str tmp_dir
+    cdef CorpusBuilder builder
+    cdef long num_src_tokens
+    cdef long num_trg_tokens
+    cdef dict fobjs
+
+    cpdef append(self, src_ids, trg_ids)
+    cpdef flush(self)
+    cpdef save(self, str path, dict vocab_arrays, dict meta)
+    cpdef close(self)
+
+cpdef tuple load_corpus(str path)
@@ -0,0 +1,239 @@
+# distutils: language=c++
+# -*- coding: utf-8 -*-
+
+'''parallel corpus packed into flat token id arrays with sentence offsets (CSR layout)'''
+
+# Standard libraries
+import os
+import shutil
+import tempfile
+from array import array
+
+# 3-rd party library
+import numpy as np
+cimport numpy as np
+from numpy cimport ndarray
+
+# Local libraries
+from lpu.common import archives
+from lpu.common import logging
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+CORPUS_FORMAT = 'lpu-parallel-corpus'
+TOKEN_DTYPE = np.int32
+
+# number of sentence pairs scanned at once to compute statistics of whole corpus
+SCAN_CHUNK = 2 ** 20
+
+cdef class ParallelCorpus:
+    '''sentence pairs of token ids
+
+    tokens of the i-th pair are src_tokens[src_offsets[i]:src_offsets[i+1]]
+    and trg_tokens[trg_offsets[i]:trg_offsets[i+1]]
+    '''
+    # defined in corpus.pxd
+    #cdef readonly ndarray src_tokens
+    #cdef readonly ndarray src_offsets
+    #cdef readonly ndarray trg_tokens
+    #cdef readonly ndarray trg_offsets
+
+    def __init__(self, src_tokens, src_offsets, trg_tokens, trg_offsets):
+        self.src_tokens = np.asarray(src_tokens, TOKEN_DTYPE)
+        self.src_offsets = np.asarray(src_offsets, np.int64)
+        self.trg_tokens = np.asarray(trg_tokens, TOKEN_DTYPE)
+        self.trg_offsets = np.asarray(trg_offsets, np.int64)
+
+    def __len__(self):
+        return len(self.src_offsets) - 1
+
+    def __getitem__(self, long index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("sentence pair index out of range: {}".format(index))
+        return self.pair(index)
+
+    def __iter__(self):
+        cdef long i
+        for i in range(len(self)):
+            yield self.pair(i)
+
+    def __repr__(self):
+        return "ParallelCorpus(pairs={:,d}, src_tokens={:,d}, trg_tokens={:,d})".format(len(self), len(self.src_tokens), len(self.trg_tokens))
+
+    property nbytes:
+        def __get__(self):
+            return self.src_tokens.nbytes + self.src_offsets.nbytes + self.trg_tokens.nbytes + self.trg_offsets.nbytes
+
+    cpdef tuple pair(self, long index):
+        '''return token ids of index-th sentence pair as (list, list)'''
+        return (
+            self.src_tokens[self.src_offsets[index]:self.src_offsets[index+1]].tolist(),
+            self.trg_tokens[self.trg_offsets[index]:self.trg_offsets[index+1]].tolist(),
+        )
+
+    cpdef ndarray src_lengths(self):
+        return np.diff(self.src_offsets)
+
+    cpdef ndarray trg_lengths(self):
+        return np.diff(self.trg_offsets)
+
+    cpdef tuple pack(self, long begin, long end):
+        '''return (src_ids, src_offsets, trg_ids, trg_offsets) of pairs in range [begin, end), offsets starting from 0'''
+        cdef ndarray src_offsets = self.src_offsets[begin:end+1]
+        cdef ndarray trg_offsets = self.trg_offsets[begin:end+1]
+        return (
+            self.src_tokens[src_offsets[0]:src_offsets[-1]].astype(np.int64),
+            src_offsets - src_offsets[0],
+            self.trg_tokens[trg_offsets[0]:trg_offsets[-1]].astype(np.int64),
+            trg_offsets - trg_offsets[0],
+        )
+
+    cpdef ndarray pair_costs(self, long begin, long end):
+        '''number of word pairs (len_src * len_trg) of each sentence pair in range [begin, end)'''
+        return np.diff(self.src_offsets[begin:end+1]) * np.diff(self.trg_offsets[begin:end+1])
+
+    cpdef list chunk_bounds(self, long begin, long end, long chunk_size):
+        '''split range [begin, end) into (begin, end) pairs of at most chunk_size sentence pairs (whole range if chunk_size <= 0)'''
+        if chunk_size <= 0:
+            chunk_size = max(end - begin, 1)
+        return [(lower, min(lower + chunk_size, end)) for lower in range(begin, end, chunk_size)]
+
+    cpdef tuple max_lengths(self):
+        '''(max source length, max target length), scanning the corpus chunk by chunk'''
+        cdef long max_len_src = 0
+        cdef long max_len_trg = 0
+        cdef long begin, end
+        for begin, end in self.chunk_bounds(0, len(self), SCAN_CHUNK):
+            max_len_src = max(max_len_src, np.diff(self.src_offsets[begin:end+1]).max())
+            max_len_trg = max(max_len_trg, np.diff(self.trg_offsets[begin:end+1]).max())
+        return max_len_src, max_len_trg
+
+    cpdef ndarray length_counts(self):
+        '''number of sentence pairs for each (len_src, len_trg) as rows of [len_src, len_trg, count], sorted by lengths'''
+        cdef ndarray keys = np.zeros(0, np.int64)
+        cdef ndarray counts = np.zeros(0, np.int64)
+        cdef ndarray chunk_keys, chunk_counts, inverse
+        cdef long begin, end
+        for begin, end in self.chunk_bounds(0, len(self), SCAN_CHUNK):
+            chunk_keys = (np.diff(self.src_offsets[begin:end+1]) << 32) + np.diff(self.trg_offsets[begin:end+1])
+            chunk_keys, chunk_counts = np.unique(chunk_keys, return_counts=True)
+            keys, inverse = np.unique(np.concatenate([keys, chunk_keys]), return_inverse=True)
+            counts = np.bincount(inverse, np.concatenate([counts, chunk_counts]), minlength=len(keys)).astype(np.int64)
+        return np.stack([keys >> 32, keys & 0xffffffff, counts], axis=1)
+
+    cpdef ParallelCorpus slice(self, long begin, long end):
+        '''return sub corpus of pairs in range [begin, end), sharing the token arrays'''
+        return ParallelCorpus(self.src_tokens, self.src_offsets[begin:end+1], self.trg_tokens, self.trg_offsets[begin:end+1])
+
+    cpdef save(self, str path, dict vocab_arrays, dict meta):
+        '''save corpus with vocabulary arrays (as given by StringEnumerator.to_arrays) into binary file'''
+        cdef dict arrays = dict(
+            src_tokens = self.src_tokens,
+            src_offsets = self.src_offsets,
+            trg_tokens = self.trg_tokens,
+            trg_offsets = self.trg_offsets,
+        )
+        arrays.update(vocab_arrays)
+        meta = dict(meta, format=CORPUS_FORMAT)
+        return archives.save_arrays(path, arrays, meta)
+
+cdef class CorpusBuilder:
+    '''incremental builder of ParallelCorpus, holding tokens in compact arrays'''
+    # defined in corpus.pxd
+    #cdef object src_tokens
+    #cdef object src_offsets
+    #cdef object trg_tokens
+    #cdef object trg_offsets
+
+    def __init__(self):
+        self.src_tokens = array('i')
+        self.src_offsets = array('q', [0])
+        self.trg_tokens = array('i')
+        self.trg_offsets = array('q', [0])
+
+    cpdef append(self, src_ids, trg_ids):
+        self.src_tokens.extend(src_ids)
+        self.src_offsets.append(len(self.src_tokens))
+        self.trg_tokens.extend(trg_ids)
+        self.trg_offsets.append(len(self.trg_tokens))
+
+    cpdef ParallelCorpus build(self):
+        return ParallelCorpus(
+            np.frombuffer(self.src_tokens, TOKEN_DTYPE) if self.src_tokens else np.zeros(0, TOKEN_DTYPE),
+            np.frombuffer(self.src_offsets, np.int64),
+            np.frombuffer(self.trg_tokens, TOKEN_DTYPE) if self.trg_tokens else np.zeros(0, TOKEN_DTYPE),
+            np.frombuffer(self.trg_offsets, np.int64),
+        )
+
+cdef class CorpusWriter:
+    '''builder of ParallelCorpus flushing the tokens into temporary files every chunk_size pairs,
+    to pack corpus larger than memory'''
+    # defined in corpus.pxd
+    #cdef long chunk_size
+    #cdef str tmp_dir
+    #cdef CorpusBuilder builder
+    #cdef long num_src_tokens
+    #cdef long num_trg_tokens
+    #cdef dict fobjs
+
+    def __init__(self, long chunk_size, str tmp_dir=None):
+        self.chunk_size = chunk_size
+        self.tmp_dir = tempfile.mkdtemp(prefix='lpu-corpus-', dir=tmp_dir)
+        self.builder = CorpusBuilder()
+        self.num_src_tokens = 0
+        self.num_trg_tokens = 0
+        self.fobjs = {}
+        for name in ['src_tokens', 'src_offsets', 'trg_tokens', 'trg_offsets']:
+            self.fobjs[name] = open(os.path.join(self.tmp_dir, name), 'wb')
+        self.fobjs['src_offsets'].write(array('q', [0]).tobytes())
+        self.fobjs['trg_offsets'].write(array('q', [0]).tobytes())
+
+    cpdef append(self, src_ids, trg_ids):
+        self.builder.append(src_ids, trg_ids)
+        if len(self.builder.src_offsets) > self.chunk_size:
+            self.flush()
+
+    cpdef flush(self):
+        cdef CorpusBuilder builder = self.builder
+        cdef ndarray src_offsets = np.frombuffer(builder.src_offsets, np.int64)[1:] + self.num_src_tokens
+        cdef ndarray trg_offsets = np.frombuffer(builder.trg_offsets, np.int64)[1:] + self.num_trg_tokens
+        self.fobjs['src_tokens'].write(builder.src_tokens.tobytes())
+        self.fobjs['trg_tokens'].write(builder.trg_tokens.tobytes())
+        self.fobjs['src_offsets'].write(src_offsets.tobytes())
+        self.fobjs['trg_offsets'].write(trg_offsets.tobytes())
+        self.num_src_tokens += len(builder.src_tokens)
+        self.num_trg_tokens += len(builder.trg_tokens)
+        self.builder = CorpusBuilder()
+
+    cpdef save(self, str path, dict vocab_arrays, dict meta):
+        '''store all the written pairs with vocabulary arrays in the format of ParallelCorpus.save'''
+        cdef dict arrays = {}
+        self.flush()
+        for name, fobj in self.fobjs.items():
+            fobj.close()
+            arrays[name] = archives.RawArrayFile(fobj.name, np.int64 if name.endswith('offsets') else TOKEN_DTYPE)
+        arrays.update(vocab_arrays)
+        meta = dict(meta, format=CORPUS_FORMAT)
+        archives.save_arrays(path, arrays, meta)
+        self.close()
+        return True
+
+    cpdef close(self):
+        if self.fobjs:
+            for fobj in self.fobjs.values():
+                fobj.close()
+            self.fobjs = {}
+        if self.tmp_dir and os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+
+cpdef tuple load_corpus(str path):
+    '''load corpus saved by ParallelCorpus.save with memory mapping, returns (corpus, arrays, meta)'''
+    cdef dict arrays, meta
+    arrays, meta = archives.load_arrays(path)
+    if meta.get('format') != CORPUS_FORMAT:
+        raise ValueError("not a corpus file: {}".format(path))
+    corpus = ParallelCorpus(arrays['src_tokens'], arrays['src_offsets'], arrays['trg_tokens'], arrays['trg_offsets'])
+    return corpus, arrays, meta
@@ -0,0 +1,20 @@
+
+# 3-rd party library
+cimport numpy as np
+from numpy cimport ndarray
+
+# local
+from . ibm_model1 cimport Model1
+from . ibm_model1 cimport Model1Trainer
+
+cdef class HMMModel(Model1):
+    cdef tuple transitions(self, int num_src)
+
+cdef class HMMTrainer(Model1Trainer):
+    pass
+
+cdef tuple jump_transitions(ndarray jump_dist, int num_src, double null_prob)
+cdef ndarray state_emissions(ndarray trans_tensor)
+cdef tuple forward(ndarray init, ndarray transition, ndarray emission)
+cdef ndarray backward(ndarray transition, ndarray emission, ndarray scale)
+cdef ndarray viterbi(ndarray init, ndarray transition, ndarray emission)
@@ -0,0 +1,289 @@
+# distutils: language=c++
+# -*- coding: utf-8 -*-
+
+'''HMM alignment model with jump-width distortion (as in Vogel et al., 1996)
+
+hidden states of a sentence with num_src source words (excluding NULL) are
+num_src real positions followed by num_src NULL states, where the i-th NULL
+state remembers the last real position i, so jumps are always measured from
+a real position
+'''
+
+# C++ set-up
+from libcpp cimport bool
+
+# 3-rd party library
+import numpy as np
+cimport numpy as np
+from numpy cimport ndarray
+from numpy cimport float64_t
+
+# Local libraries
+
+from lpu.common import progress
+from lpu.common import logging
+
+from . ibm_models cimport gather_entries
+from . ibm_models cimport lookup_entries
+from . ibm_models cimport accumulate
+from . ibm_models cimport batch_step
+from . ibm_models cimport length_buckets
+from . ibm_models cimport flat_data
+from . ibm_models cimport zeros_like
+from . ibm_models cimport normalize
+from . ibm_models cimport run_expectation
+from . ibm_models cimport Trainer
+from . ibm_model1 cimport Model1Trainer
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+cdef tuple jump_transitions(ndarray jump_dist, int num_src, double null_prob):
+    '''initial probabilities (2*num_src) and transition matrix (2*num_src x 2*num_src) of hidden states
+
+    jump_dist[d + max_jump] is the unnormalized probability of jump width d,
+    jumps wider than max_jump are regarded as max_jump
+    '''
+    cdef long max_jump = (len(jump_dist) - 1) // 2
+    cdef ndarray positions = np.arange(num_src)
+    cdef ndarray real, init, transition, denom
+    if num_src == 0:
+        # only NULL state
+        return np.ones(1), np.ones([1, 1])
+    real = jump_dist[np.clip(positions[None,:] - positions[:,None], -max_jump, max_jump) + max_jump]
+    denom = real.sum(axis=1, keepdims=True)
+    real = np.divide(real, denom, out=np.full_like(real, 1.0 / num_src), where=(denom > 0))
+    transition = np.zeros([2 * num_src, 2 * num_src], np.float64)
+    transition[:num_src,:num_src] = (1 - null_prob) * real
+    transition[num_src:,:num_src] = (1 - null_prob) * real
+    transition[positions, num_src + positions] = null_prob
+    transition[num_src + positions, num_src + positions] = null_prob
+    # initial state is reached by jumping from the virtual position -1
+    init = jump_dist[np.clip(positions + 1, -max_jump, max_jump) + max_jump]
+    if init.sum() > 0:
+        init = init / init.sum()
+    else:
+        init = np.full(num_src, 1.0 / num_src)
+    init = np.concatenate([(1 - null_prob) * init, np.full(num_src, null_prob / num_src)])
+    return init, transition
+
+cdef ndarray state_emissions(ndarray trans_tensor):
+    '''emission probabilities (sentence x trg x state) from p(trg|src) tensor (sentence x src with NULL x trg)'''
+    cdef int num_src = np.shape(trans_tensor)[1] - 1
+    cdef ndarray emission
+    emission = np.concatenate([trans_tensor[:,1:,:], np.repeat(trans_tensor[:,:1,:], max(num_src, 1), axis=1)], axis=1)
+    # forward-backward runs in double precision even for single precision distributions
+    return emission.transpose(0, 2, 1).astype(np.float64, copy=False)
+
+cdef tuple forward(ndarray init, ndarray transition, ndarray emission):
+    '''scaled forward probabilities of stacked sentences (sentence x trg x state) and the scaling factors (sentence x trg)'''
+    cdef long num_trg = np.shape(emission)[1]
+    cdef ndarray alpha = np.zeros_like(emission)
+    cdef ndarray scale = np.zeros(np.shape(emission)[0:2], np.float64)
+    cdef ndarray current
+    cdef long t
+    for t in range(num_trg):
+        if t == 0:
+            current = init[None,:] * emission[:,0]
+        else:
+            current = alpha[:,t-1].dot(transition) * emission[:,t]
+        scale[:,t] = current.sum(axis=1)
+        np.divide(current, scale[:,t,None], out=alpha[:,t], where=(scale[:,t,None] > 0))
+    return alpha, scale
+
+cdef ndarray backward(ndarray transition, ndarray emission, ndarray scale):
+    '''scaled backward probabilities (sentence x trg x state), using the scaling factors of forward'''
+    cdef long num_trg = np.shape(emission)[1]
+    cdef ndarray beta = np.zeros_like(emission)
+    cdef long t
+    if num_trg > 0:
+        beta[:,num_trg-1] = 1
+    for t in range(num_trg-2, -1, -1):
+        np.divide((emission[:,t+1] * beta[:,t+1]).dot(transition.T), scale[:,t+1,None], out=beta[:,t], where=(scale[:,t+1,None] > 0))
+    return beta
+
+cdef ndarray viterbi(ndarray init, ndarray transition, ndarray emission):
+    '''most probable state sequences of stacked sentences (sentence x trg)'''
+    cdef long num_sents = np.shape(emission)[0]
+    cdef long num_trg = np.shape(emission)[1]
+    cdef ndarray log_transition, log_emission, delta, candidates
+    cdef ndarray pointers = np.zeros([num_sents, num_trg, len(init)], np.int64)
+    cdef ndarray states = np.zeros([num_sents, num_trg], np.int64)
+    cdef ndarray sent_range = np.arange(num_sents)
+    cdef long t
+    if num_trg == 0:
+        return states
+    with np.errstate(divide='ignore'):
+        log_transition = np.log(transition)
+        log_emission = np.log(emission)
+        delta = np.log(init)[None,:] + log_emission[:,0]
+    for t in range(1, num_trg):
+        candidates = delta[:,:,None] + log_transition[None,:,:]
+        pointers[:,t] = candidates.argmax(axis=1)
+        delta = candidates.max(axis=1) + log_emission[:,t]
+    states[:,num_trg-1] = delta.argmax(axis=1)
+    for t in range(num_trg-1, 0, -1):
+        states[:,t-1] = pointers[sent_range, t, states[:,t]]
+    return states
+
+cdef void expect_buckets(Trainer trainer, object buckets, long begin, long end, ndarray count_cooc, ndarray count_jump, ndarray entropy) except *:
+    '''accumulate expected co-occurrence and jump counts of sentence pairs in range [begin, end) grouped into length buckets
+
+    forward-backward runs over stacked sentences of the same lengths,
+    vectorized across the source positions (hidden states)
+    '''
+    cdef HMMModel model = <HMMModel>trainer.model
+    cdef int len_src, len_trg, num_src
+    cdef long lower, upper, i, j, step
+    cdef long max_jump = (len(count_jump) - 1) // 2
+    cdef ndarray indices, src_sents, trg_sents
+    cdef ndarray init, transition, emission
+    cdef ndarray cooc, probs, alpha, beta, scale, gamma, weights, xi
+    cdef ndarray jumps = None
+    for len_src, len_trg, indices, src_sents, trg_sents in buckets:
+        lower, upper = np.searchsorted(indices, [begin, end])
+        if lower >= upper or len_trg == 0:
+            continue
+        num_src = len_src - 1
+        init, transition = model.transitions(num_src)
+        if num_src > 0:
+            jumps = np.clip(np.arange(num_src)[None,:] - np.arange(num_src)[:,None], -max_jump, max_jump) + max_jump
+        step = batch_step(4 * len_src * len_trg)
+        for i in range(lower, upper, step):
+            j = min(i + step, upper)
+            cooc, probs = gather_entries(trainer.model.trans_dist, src_sents[i:j,:,None], trg_sents[i:j,None,:])
+            emission = state_emissions(probs)
+            alpha, scale = forward(init, transition, emission)
+            beta = backward(transition, emission, scale)
+            gamma = alpha * beta
+            with np.errstate(divide='ignore'):
+                entropy[0] += -np.log(scale).sum() / len_trg
+            # posteriors of (src with NULL x trg), NULL states are merged into position 0
+            weights = np.concatenate([gamma[:,:,num_src:].sum(axis=2)[:,None,:], gamma[:,:,:num_src].transpose(0,2,1)], axis=1)
+            accumulate(count_cooc, cooc.reshape(-1), weights.reshape(-1))
+            if num_src == 0:
+                continue
+            # expected transitions summed over sentences and target positions
+            xi = transition * np.einsum('nti,ntj->ij', alpha[:,:-1], np.divide(emission[:,1:] * beta[:,1:], scale[:,1:,None], out=np.zeros_like(beta[:,1:]), where=(scale[:,1:,None] > 0)))
+            count_jump += np.bincount(jumps.reshape(-1), (xi[:num_src,:num_src] + xi[num_src:,:num_src]).reshape(-1), minlength=len(count_jump))
+            count_jump += np.bincount(np.clip(np.arange(num_src) + 1, -max_jump, max_jump) + max_jump, gamma[:,0,:num_src].sum(axis=0), minlength=len(count_jump))
+
+cdef void expect_hmm(Trainer trainer, long begin, long end, ndarray count_cooc, ndarray count_align, ndarray entropy, bool verbose) except *:
+    '''accumulate expected co-occurrence and jump counts of sentence pairs in range [begin, end)
+
+    in streaming mode, length buckets are made for each chunk instead of the whole corpus
+    '''
+    cdef object buckets = trainer.length_buckets
+    cdef object chunks
+    cdef long chunk_begin, chunk_end
+    if buckets is not None:
+        if verbose:
+            buckets = progress.view(buckets, 'processing length buckets')
+        expect_buckets(trainer, buckets, begin, end, count_cooc, count_align, entropy)
+        return
+    chunks = trainer.sent_pairs.chunk_bounds(begin, end, trainer.chunk_size)
+    if verbose:
+        chunks = progress.view(chunks, 'processing chunks')
+    for chunk_begin, chunk_end in chunks:
+        buckets = length_buckets(trainer.sent_pairs.slice(chunk_begin, chunk_end))
+        expect_buckets(trainer, buckets, 0, chunk_end - chunk_begin, count_cooc, count_align, entropy)
+
+cdef class HMMModel:
+    cdef tuple transitions(self, int num_src):
+        return jump_transitions(self.jump_dist, num_src, self.null_prob)
+
+    cdef double calc_pair_entropy(self, list src_sent, list trg_sent, bool normalize) except *:
+        cdef ndarray init, transition, emission, alpha, scale
+        cdef ndarray trans_tensor = lookup_entries(self.trans_dist, np.array(src_sent)[None,:,None], np.array(trg_sent, np.int64)[None,None,:])
+        init, transition = self.transitions(len(src_sent) - 1)
+        emission = state_emissions(trans_tensor)
+        alpha, scale = forward(init, transition, emission)
+        if normalize:
+            return -np.log(scale).sum() / len(trg_sent)
+        else:
+            return -np.log(scale).sum()
+
+    cdef ndarray posterior_bucket(self, int len_src, int len_trg, ndarray src_sents, ndarray trg_sents):
+        cdef ndarray init, transition, emission, alpha, scale, gamma
+        cdef int num_src = len_src - 1
+        init, transition = self.transitions(num_src)
+        emission = state_emissions(lookup_entries(self.trans_dist, src_sents[:,:,None], trg_sents[:,None,:]))
+        alpha, scale = forward(init, transition, emission)
+        gamma = alpha * backward(transition, emission, scale)
+        # NULL states are merged into position 0
+        return np.concatenate([gamma[:,:,num_src:].sum(axis=2)[:,None,:], gamma[:,:,:num_src].transpose(0,2,1)], axis=1)
+
+    cdef ndarray decode_bucket(self, int len_src, int len_trg, ndarray src_sents, ndarray trg_sents):
+        cdef ndarray init, transition, states
+        cdef int num_src = len_src - 1
+        init, transition = self.transitions(num_src)
+        states = viterbi(init, transition, state_emissions(lookup_entries(self.trans_dist, src_sents[:,:,None], trg_sents[:,None,:])))
+        # real positions are shifted by NULL, NULL states are mapped into 0
+        return np.where(states < num_src, states + 1, 0)
+
+cdef class HMMTrainer:
+    cdef void init(self) except *:
+        dprint("hmm model")
+        self.model = HMMModel()
+
+    cdef void init_align_dist(self) except *:
+        cdef int max_len_src = self.model.vocab.max_len_src
+        logger.info("initializing jump width probabilities as uniform distribution")
+        # jumps from -max_len_src to max_len_src
+        self.model.jump_dist = np.ones(2 * max_len_src + 1, np.float64) / (2 * max_len_src + 1)
+        logger.info("jump width distribution size: {} [jumps] (null_prob={})".format(len(self.model.jump_dist), self.model.null_prob))
+
+    cdef void expect_step(self) except *:
+        self.count_cooc_src2trg = zeros_like(self.model.trans_dist)
+        self.count_align_trg2src = np.zeros_like(self.model.jump_dist)
+        if self.length_buckets is None and self.chunk_size <= 0:
+            logger.info('grouping sentence pairs by their lengths')
+            self.length_buckets = length_buckets(self.sent_pairs)
+            logger.info('number of length buckets: {:,d}'.format(len(self.length_buckets)))
+        logger.info('computing:')
+        logger.info('* expected co-occurrence counts of source word and target word')
+        logger.info('* expected counts of jump widths')
+        self.entropy = run_expectation(self, expect_hmm, flat_data(self.count_cooc_src2trg), self.count_align_trg2src) / len(self.sent_pairs)
+
+    cdef void maximize_step(self) except *:
+        logger.info("estimating word translation distribution")
+        normalize(self.count_cooc_src2trg, 1, self.model.trans_dist)
+        logger.info("estimating jump width distribution")
+        if self.count_align_trg2src.sum() > 0:
+            self.model.jump_dist = self.count_align_trg2src / self.count_align_trg2src.sum()
+
+    cdef void setup(self) except *:
+        Model1Trainer.setup(self)
+        if self.model.jump_dist is None:
+            self.init_align_dist()
+
+    cdef void train(self, int iteration_limit) except *:
+        cdef double last_entropy
+        cdef int first_step
+        cdef tuple last_counts
+        self.setup()
+        first_step, last_entropy = self.resume_state('hmm', iteration_limit)
+        logger.info("----")
+        logger.info("start training HMM alignment model")
+        for step in range(first_step, iteration_limit):
+            logger.info("--")
+            logger.info("step: {} / {}".format(step+1, iteration_limit))
+            # expectation step also gives the entropy of the current parameters
+            last_counts = (self.count_cooc_src2trg, self.count_align_trg2src)
+            HMMTrainer.expect_step(self)
+            logger.info("{}entropy: {}".format('initial ' if step == 0 else '', self.entropy))
+            if self.entropy >= last_entropy:
+                # keeping the counts which gave the current parameters, to be saved with them
+                self.count_cooc_src2trg, self.count_align_trg2src = last_counts
+                break
+            last_entropy = self.entropy
+            HMMTrainer.maximize_step(self)
+            self.prune_step()
+            self.save_checkpoint(dict(phase='hmm', step=step+1, entropy=last_entropy))
+
+    cdef void train_step(self) except *:
+        if self.model.trans_dist is None:
+            self.setup()
+        else:
+            HMMTrainer.expect_step(self)
+            HMMTrainer.maximize_step(self)
@@ -5,5 +5,5 @@ cdef class Model1(Model):
     pass
 
 cdef class Model1Trainer(Trainer):
-    pass
+    cdef void init_sparse_trans_dist(self) except *
 
@@ -17,19 +17,77 @@ from lpu.common import logging
 
 from . ibm_models cimport sub_matrix
 from . ibm_models cimport grid_indices
+from . ibm_models cimport gather_entries
+from . ibm_models cimport accumulate
+from . ibm_models cimport batch_bounds
+from . ibm_models cimport pack_sent_pairs
+from . ibm_models cimport batch_grid
+from . ibm_models cimport flat_data
+from . ibm_models cimport zeros_like
 from . ibm_models cimport normalize
+from . ibm_models cimport run_expectation
+from . ibm_models cimport Trainer
+from . sparse cimport SparseMatrix
+from . sparse cimport KeyCollector
+from . shards cimport Shard
+from . kernels cimport expect_model1_threads
 
 logger = logging.getColorLogger(__name__)
 dprint = logger.debug_print
 
+cdef void expect_model1(Trainer trainer, long begin, long end, ndarray count_cooc, ndarray count_align, ndarray entropy, bool verbose) except *:
+    '''accumulate expected co-occurrence counts of sentence pairs in range [begin, end)
+
+    sentence pairs are processed in batches, concatenating all the word pairs
+    into flat arrays to gather, normalize and scatter them at once,
+    and the normalizing factors give the entropy of each sentence pair as well
+    '''
+    cdef ndarray src_ids, src_offsets, trg_ids, trg_offsets
+    cdef ndarray pair_src, pair_trg
+    cdef ndarray rows, owned
+    cdef ndarray cooc, probs, denom
+    cdef ndarray token_sent, len_src, len_trg
+    cdef object chunks = trainer.sent_pairs.chunk_bounds(begin, end, trainer.chunk_size)
+    cdef object batches
+    cdef long chunk_begin, chunk_end
+    cdef long batch_begin, batch_end
+    cdef Shard shard = trainer.shard
+    if verbose and trainer.chunk_size > 0:
+        chunks = progress.view(chunks, 'processing chunks')
+    for chunk_begin, chunk_end in chunks:
+        batches = batch_bounds(trainer.sent_pairs, chunk_begin, chunk_end)
+        if verbose and trainer.chunk_size <= 0:
+            batches = progress.view(batches, 'processing batches')
+        for batch_begin, batch_end in batches:
+            src_ids, src_offsets, trg_ids, trg_offsets = pack_sent_pairs(trainer.sent_pairs, batch_begin, batch_end)
+            pair_src, pair_trg = batch_grid(src_offsets, trg_offsets)
+            rows = src_ids[pair_src]
+            if shard is not None:
+                # only the pairs of the source words owned by this process
+                owned = shard.owns(rows)
+                rows = rows[owned] - shard.begin
+                pair_trg = pair_trg[owned]
+            cooc, probs = gather_entries(trainer.model.trans_dist, rows, trg_ids[pair_trg])
+            ## normalizing factor of each target token
+            denom = np.bincount(pair_trg, probs, minlength=len(trg_ids))
+            if shard is not None:
+                denom = shard.allreduce(denom)
+            len_src = np.diff(src_offsets)
+            len_trg = np.diff(trg_offsets)
+            token_sent = np.repeat(np.arange(len(len_trg)), len_trg)
+            entropy[0] += (-np.log(denom / len_src[token_sent]) / len_trg[token_sent]).sum()
+            denom = denom[pair_trg]
+            probs = np.divide(probs, denom, out=np.zeros_like(probs), where=(denom > 0))
+            accumulate(count_cooc, cooc, probs)
+
 cdef class Model1:
     cdef double calc_pair_entropy(self, list src_sent, list trg_sent, bool normalize) except *:
         cdef np.ndarray trans_matrix
         trans_matrix = sub_matrix(self.trans_dist, src_sent, trg_sent)
         if normalize:
-            return (-np.log(trans_matrix.sum(axis=0) / len(src_sent)).sum()) / len(trg_sent)
+            return (-np.log(trans_matrix.sum(axis=0, dtype=np.float64) / len(src_sent)).sum()) / len(trg_sent)
         else:
-            return -np.log(trans_matrix.sum(axis=0) / len(src_sent)).sum()
+            return -np.log(trans_matrix.sum(axis=0, dtype=np.float64) / len(src_sent)).sum()
 
 cdef class Model1Trainer:
     cdef void init(self) except *:
@@ -38,38 +96,66 @@ cdef class Model1Trainer:
         dprint(self.model)
 
     cdef void init_trans_dist(self) except *:
-        cdef int len_src = len(self.model.vocab.src)
+        cdef long begin = self.owned_range()[0]
+        cdef int len_src = self.owned_range()[1] - begin
         cdef int len_trg = len(self.model.vocab.trg)
-        #cdef np.ndarray uniform_dist
-        cdef ndarray[float64_t, ndim=2] uniform_dist
+        cdef np.ndarray uniform_dist
+        if self.sparse:
+            self.init_sparse_trans_dist()
+            return
         logger.info("initializing word translation probabilities as uniform distribution")
-        uniform_dist = np.ones([len_src, len_trg], np.float64) / len_trg
+        uniform_dist = np.full([len_src, len_trg], 1.0 / len_trg, self.dtype)
         msg = "word translation distribution matrix size: {} [src words] x {} [trg words] x {} [bytes] = {:,d} [bytes]"
         #logger.info(msg.format(len_src,len_trg,uniform_dist.itemsize,len(uniform_dist.data)))
         logger.info(msg.format(len_src,len_trg,uniform_dist.itemsize,uniform_dist.nbytes))
         #return uniform_dist
         self.model.trans_dist = uniform_dist
 
-    cdef void expect_step(self) except *:
-        cdef int len_src = len(self.model.vocab.src)
+    cdef void init_sparse_trans_dist(self) except *:
+        cdef long begin = self.owned_range()[0]
+        cdef int len_src = self.owned_range()[1] - begin
         cdef int len_trg = len(self.model.vocab.trg)
-        cdef list src_sent, trg_sent
-        cdef tuple cooc
-        cdef np.ndarray cooc_trans_dist
-        self.count_cooc_src2trg = np.zeros([len_src, len_trg], np.float64)
+        cdef KeyCollector collector = KeyCollector([len_src, len_trg])
+        cdef SparseMatrix uniform_dist
+        cdef SparseMatrix loaded = None
+        cdef ndarray src_ids, src_offsets, trg_ids, trg_offsets
+        cdef ndarray pair_src, pair_trg
+        cdef ndarray rows, owned
+        cdef long chunk_begin, chunk_end
+        cdef long batch_begin, batch_end
+        if isinstance(self.model.trans_dist, SparseMatrix):
+            # extending the loaded distribution with the pairs of the given corpus
+            loaded = self.model.trans_dist
+            collector.add_keys(loaded.keys)
+        logger.info("collecting co-occurring word pairs")
+        for chunk_begin, chunk_end in progress.view(self.sent_pairs.chunk_bounds(0, len(self.sent_pairs), self.chunk_size), 'collecting'):
+            for batch_begin, batch_end in batch_bounds(self.sent_pairs, chunk_begin, chunk_end):
+                src_ids, src_offsets, trg_ids, trg_offsets = pack_sent_pairs(self.sent_pairs, batch_begin, batch_end)
+                pair_src, pair_trg = batch_grid(src_offsets, trg_offsets)
+                rows = src_ids[pair_src]
+                if self.shard is not None:
+                    owned = self.shard.owns(rows)
+                    rows = rows[owned] - begin
+                    pair_trg = pair_trg[owned]
+                collector.add_keys(rows * len_trg + trg_ids[pair_trg])
+        logger.info("initializing sparse word translation probabilities as uniform distribution")
+        uniform_dist = collector.build(1.0 / len_trg, self.dtype)
+        if loaded is not None:
+            uniform_dist.assign(loaded.row_ids(), loaded.col_ids(), loaded.data)
+        msg = "word translation distribution sparse matrix size: {:,d} [co-occurring pairs] of {} [src words] x {} [trg words] = {:,d} [bytes]"
+        logger.info(msg.format(uniform_dist.nnz,len_src,len_trg,uniform_dist.nbytes))
+        self.model.trans_dist = uniform_dist
+
+    cdef void expect_step(self) except *:
+        self.count_cooc_src2trg = zeros_like(self.model.trans_dist)
         logger.info('computing expected co-occurrence counts of source word and target word')
-        for i, (src_sent, trg_sent) in enumerate(progress.view(self.sent_pairs, 'processing')):
-            cooc = grid_indices(src_sent, trg_sent)
-            cooc_trans_dist = sub_matrix(self.model.trans_dist, src_sent, trg_sent)
-            ## normalizing factor
-            normalize(cooc_trans_dist, 0, cooc_trans_dist)
-            np.add.at(self.count_cooc_src2trg, cooc, cooc_trans_dist)
+        if self.threads > 1:
+            self.entropy = run_expectation(self, expect_model1_threads, flat_data(self.count_cooc_src2trg), None) / len(self.sent_pairs)
+        else:
+            self.entropy = run_expectation(self, expect_model1, flat_data(self.count_cooc_src2trg), None) / len(self.sent_pairs)
 
     cdef void maximize_step(self) except *:
-        cdef ndarray[float64_t, ndim=2] total_src
         logger.info("estimating word translation distribution")
-        #total_src = self.count_cooc_src2trg.sum(axis=1).reshape(-1,1)
-        #self.model.trans_dist = self.count_cooc_src2trg / total_src
         normalize(self.count_cooc_src2trg, 1, self.model.trans_dist)
 
     cdef void setup(self) except *:
@@ -81,23 +167,27 @@ cdef class Model1Trainer:
 
     cdef void train(self, int iteration_limit) except *:
         cdef double last_entropy
+        cdef int first_step
+        cdef object last_counts
         self.setup()
+        first_step, last_entropy = self.resume_state('model1', iteration_limit)
         logger.info("----")
         logger.info("start training IBM Model 1")
-        last_entropy = self.model.calc_entropy(self.sent_pairs)
-        logger.info("initial entropy: %s" % last_entropy)
-        for step in range(iteration_limit):
+        for step in range(first_step, iteration_limit):
             logger.info("--")
             logger.info("step: {} / {}".format(step+1, iteration_limit))
-            # train 1 step
-            Model1Trainer.train_step(self)
-            # calculate entropy
-            entropy = self.model.calc_entropy(self.sent_pairs)
-            logger.info("entropy: %s" % entropy)
-            if entropy >= last_entropy:
+            # expectation step also gives the entropy of the current parameters
+            last_counts = self.count_cooc_src2trg
+            Model1Trainer.expect_step(self)
+            logger.info("{}entropy: {}".format('initial ' if step == 0 else '', self.entropy))
+            if self.entropy >= last_entropy:
+                # keeping the counts which gave the current parameters, to be saved with them
+                self.count_cooc_src2trg = last_counts
                 break
-            else:
-                last_entropy = entropy
+            last_entropy = self.entropy
+            Model1Trainer.maximize_step(self)
+            self.prune_step()
+            self.save_checkpoint(dict(phase='model1', step=step+1, entropy=last_entropy))
 
     cdef void train_step(self) except *:
         if self.model.trans_dist is None:
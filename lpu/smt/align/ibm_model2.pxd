@@ -10,5 +10,5 @@ cdef class Model2(Model1):
     pass
 
 cdef class Model2Trainer(Model1Trainer):
-    pass
+    cdef void update_tension(self) except *
 
@@ -17,12 +17,107 @@ from lpu.common import logging
 
 from . ibm_models cimport sub_matrix
 from . ibm_models cimport grid_indices
+from . ibm_models cimport gather_entries
+from . ibm_models cimport accumulate
+from . ibm_models cimport batch_step
+from . ibm_models cimport length_buckets
+from . ibm_models cimport diagonal_features
+from . ibm_models cimport flat_data
+from . ibm_models cimport zeros_like
 from . ibm_models cimport normalize
+from . ibm_models cimport run_expectation
+from . ibm_models cimport Trainer
 from . ibm_model1 cimport Model1Trainer
+from . shards cimport Shard
+from . kernels cimport expect_model2_threads
 
 logger = logging.getColorLogger(__name__)
 dprint = logger.debug_print
 
+# gradient steps to optimize diagonal tension at each maximization step
+TENSION_STEPS = 8
+TENSION_LEARNING_RATE = 20.0
+MIN_TENSION = 0.1
+MAX_TENSION = 14.0
+
+cdef void expect_buckets(Trainer trainer, object buckets, long begin, long end, ndarray count_cooc, ndarray count_align, ndarray entropy) except *:
+    '''accumulate expected counts of sentence pairs in range [begin, end) grouped into length buckets
+
+    sentence pairs of the same lengths share the alignment distribution,
+    so each length bucket is processed as stacked (sentence x src x trg) tensors
+    '''
+    cdef int len_src, len_trg
+    cdef long lower, upper, i, j, step
+    cdef ndarray indices, src_sents, trg_sents
+    cdef ndarray cooc, probs, align_trans_dist, denom
+    cdef ndarray sent_align_dist
+    cdef ndarray count_align_dist
+    cdef ndarray post_sum
+    cdef ndarray owned, rows
+    cdef Shard shard = trainer.shard
+    cdef bool diagonal = (trainer.model.distortion == 'diagonal')
+    if not diagonal:
+        count_align_dist = count_align.reshape(np.shape(trainer.model.align_dist))
+    for len_src, len_trg, indices, src_sents, trg_sents in buckets:
+        lower, upper = np.searchsorted(indices, [begin, end])
+        if lower >= upper:
+            continue
+        sent_align_dist = trainer.model.align_matrix(len_src, len_trg)
+        step = batch_step(len_src * len_trg)
+        for i in range(lower, upper, step):
+            j = min(i + step, upper)
+            if shard is None:
+                cooc, probs = gather_entries(trainer.model.trans_dist, src_sents[i:j,:,None], trg_sents[i:j,None,:])
+            else:
+                # source words not owned by this process are masked out, leaving their positions to the others
+                owned = shard.owns(src_sents[i:j])
+                rows = np.where(owned, src_sents[i:j] - shard.begin, 0)
+                cooc, probs = gather_entries(trainer.model.trans_dist, rows[:,:,None], trg_sents[i:j,None,:])
+                owned = np.broadcast_to(owned[:,:,None], np.shape(probs))
+                cooc = np.where(owned, cooc, -1)
+                probs = np.where(owned, probs, 0)
+            # posteriors are computed in double precision even for single precision distributions
+            align_trans_dist = np.multiply(probs, sent_align_dist[None,:,:], dtype=np.float64)
+            # normalizing factor
+            denom = align_trans_dist.sum(axis=1, keepdims=True)
+            if shard is not None:
+                denom = shard.allreduce(denom)
+            if len_trg > 0:
+                entropy[0] += -np.log(denom).sum() / len_trg
+            denom = np.broadcast_to(denom, np.shape(align_trans_dist))
+            align_trans_dist = np.divide(align_trans_dist, denom, out=np.zeros_like(align_trans_dist), where=(denom > 0))
+            accumulate(count_cooc, cooc.reshape(-1), align_trans_dist.reshape(-1))
+            post_sum = align_trans_dist.sum(axis=0)
+            if diagonal:
+                # sufficient statistics: [expected diagonal feature, expected NULL alignments, target tokens]
+                count_align[0] += (post_sum[1:] * diagonal_features(len_src, len_trg)).sum()
+                count_align[1] += post_sum[0].sum()
+                if shard is None or shard.rank == 0:
+                    # posteriors of the other positions are summed up across the shards, but not the tokens
+                    count_align[2] += (j - i) * len_trg
+            else:
+                count_align_dist[len_src-2,len_trg-1,:len_trg,:len_src] += post_sum.T
+
+cdef void expect_model2(Trainer trainer, long begin, long end, ndarray count_cooc, ndarray count_align, ndarray entropy, bool verbose) except *:
+    '''accumulate expected co-occurrence and alignment counts of sentence pairs in range [begin, end)
+
+    in streaming mode, length buckets are made for each chunk instead of the whole corpus
+    '''
+    cdef object buckets = trainer.length_buckets
+    cdef object chunks
+    cdef long chunk_begin, chunk_end
+    if buckets is not None:
+        if verbose:
+            buckets = progress.view(buckets, 'processing length buckets')
+        expect_buckets(trainer, buckets, begin, end, count_cooc, count_align, entropy)
+        return
+    chunks = trainer.sent_pairs.chunk_bounds(begin, end, trainer.chunk_size)
+    if verbose:
+        chunks = progress.view(chunks, 'processing chunks')
+    for chunk_begin, chunk_end in chunks:
+        buckets = length_buckets(trainer.sent_pairs.slice(chunk_begin, chunk_end))
+        expect_buckets(trainer, buckets, 0, chunk_end - chunk_begin, count_cooc, count_align, entropy)
+
 cdef class Model2:
     cdef double calc_pair_entropy(self, list src_sent, list trg_sent, bool normalize) except *:
         cdef int len_src = len(src_sent)
@@ -31,12 +126,12 @@ cdef class Model2:
         cdef list trg_range = list(range(len_trg))
         cdef np.ndarray trans_matrix, align_matrix, align_trans_matrix
         trans_matrix = sub_matrix(self.trans_dist, src_sent, trg_sent)
-        align_matrix = self.align_dist[len_src-2, len_trg-1][:len_trg,:len_src].T
+        align_matrix = self.align_matrix(len_src, len_trg)
         align_trans_matrix = align_matrix * trans_matrix
         if normalize:
-            return -np.log(align_trans_matrix.sum(axis=0)).sum() / len(trg_sent)
+            return -np.log(align_trans_matrix.sum(axis=0, dtype=np.float64)).sum() / len(trg_sent)
         else:
-            return -np.log(align_trans_matrix.sum(axis=0)).sum()
+            return -np.log(align_trans_matrix.sum(axis=0, dtype=np.float64)).sum()
 
 cdef class Model2Trainer:
     cdef void init(self) except *:
@@ -44,13 +139,15 @@ cdef class Model2Trainer:
         self.model = Model2()
 
     cdef void init_align_dist(self) except *:
-        #cdef np.ndarray uniform_dist
-        cdef ndarray[float64_t, ndim=4] uniform_dist
+        cdef np.ndarray uniform_dist
         cdef int max_len_src = self.model.vocab.max_len_src
         cdef int max_len_trg = self.model.vocab.max_len_trg
+        if self.model.distortion == 'diagonal':
+            logger.info("using diagonal alignment distribution (tension={}, null_prob={})".format(self.model.tension, self.model.null_prob))
+            return
         logger.info("initializing index alignment probabilities as uniform distribution")
         #uniform_dist = np.zeros([max_len_src-1, max_len_trg, max_len_src, max_len_trg], np.float64)
-        uniform_dist = np.zeros([max_len_src-1, max_len_trg, max_len_trg, max_len_src], np.float64)
+        uniform_dist = np.zeros([max_len_src-1, max_len_trg, max_len_trg, max_len_src], self.dtype)
         indices = list( np.ndindex(max_len_src-1, max_len_trg) )
         for index_src, index_trg in progress.view(indices, header='initializing'):
             len_src = index_src + 2
@@ -61,68 +158,86 @@ cdef class Model2Trainer:
         self.model.align_dist = uniform_dist
 
     cdef void expect_step(self) except *:
-        cdef int vocab_size_src = len(self.model.vocab.src)
-        cdef int vocab_size_trg = len(self.model.vocab.trg)
-        cdef int max_len_src = self.model.vocab.max_len_src
-        cdef int max_len_trg = self.model.vocab.max_len_trg
-        cdef int len_src, len_trg
-        cdef list src_sent, trg_sent
-        cdef list src_range, trg_range
-        cdef tuple cooc, align
-        cdef ndarray[float64_t,ndim=2] cooc_trans_dist
-        cdef ndarray[float64_t,ndim=2] sent_align_dist
-        cdef ndarray[float64_t,ndim=2] align_trans_dist, sum_trg
-        self.count_cooc_src2trg  = self.model.trans_dist * 0
-        self.count_align_trg2src = self.model.align_dist * 0
+        self.count_cooc_src2trg  = zeros_like(self.model.trans_dist)
+        if self.model.distortion == 'diagonal':
+            self.count_align_trg2src = np.zeros(3, np.float64)
+        else:
+            self.count_align_trg2src = self.model.align_dist * 0
+        if self.length_buckets is None and self.chunk_size <= 0 and self.threads <= 1:
+            logger.info('grouping sentence pairs by their lengths')
+            self.length_buckets = length_buckets(self.sent_pairs)
+            logger.info('number of length buckets: {:,d}'.format(len(self.length_buckets)))
         logger.info('computing:')
         logger.info('* expected co-occurrence counts of source word and target word')
         logger.info('* expected alignment counts of source index and target index')
-        for i, (src_sent, trg_sent) in enumerate(progress.view(self.sent_pairs, 'processing')):
-            len_src = len(src_sent)
-            len_trg = len(trg_sent)
-            src_range = list(range(len_src))
-            trg_range = list(range(len_trg))
-            cooc = grid_indices(src_sent, trg_sent)
-            align = grid_indices(trg_range, src_range)
-            cooc_trans_dist = sub_matrix(self.model.trans_dist, src_sent, trg_sent)
-            sent_align_dist = self.model.align_dist[len_src-2,len_trg-1][:len_trg,:len_src].T
-            align_trans_dist = cooc_trans_dist * sent_align_dist
-            # normalizing factor
-            sum_trg = align_trans_dist.sum(axis=0)[None,:]
-            align_trans_dist = align_trans_dist / sum_trg
-            np.add.at(self.count_cooc_src2trg, cooc, align_trans_dist)
-            np.add.at(self.count_align_trg2src[len_src-2,len_trg-1], align, align_trans_dist.T)
+        if self.threads > 1:
+            self.entropy = run_expectation(self, expect_model2_threads, flat_data(self.count_cooc_src2trg), self.count_align_trg2src.reshape(-1)) / len(self.sent_pairs)
+        else:
+            self.entropy = run_expectation(self, expect_model2, flat_data(self.count_cooc_src2trg), self.count_align_trg2src.reshape(-1)) / len(self.sent_pairs)
 
     cdef void maximize_step(self) except *:
         logger.info("estimating word translation distribution")
         normalize(self.count_cooc_src2trg,  1, self.model.trans_dist)
-        normalize(self.count_align_trg2src, 3, self.model.align_dist)
+        if self.model.distortion == 'diagonal':
+            self.update_tension()
+        else:
+            normalize(self.count_align_trg2src, 3, self.model.align_dist)
+
+    cdef void update_tension(self) except *:
+        '''gradient steps of diagonal tension, matching the expected feature to the posterior one'''
+        cdef double emp_feat, null_count, num_tokens, mod_feat, tension
+        cdef ndarray features, unnormalized
+        cdef int len_src, len_trg
+        cdef long count
+        emp_feat, null_count, num_tokens = self.count_align_trg2src
+        if num_tokens <= 0:
+            return
+        logger.info("optimizing tension of diagonal alignment distribution")
+        if self.length_counts is None:
+            self.length_counts = self.sent_pairs.length_counts()
+        emp_feat /= num_tokens
+        tension = self.model.tension
+        for step in range(TENSION_STEPS):
+            mod_feat = 0
+            for len_src, len_trg, count in self.length_counts:
+                features = diagonal_features(len_src, len_trg)
+                unnormalized = np.exp(tension * features)
+                mod_feat += count * ((unnormalized * features).sum(axis=0) / unnormalized.sum(axis=0)).sum()
+            mod_feat *= (1 - null_count / num_tokens) / num_tokens
+            tension += (emp_feat - mod_feat) * TENSION_LEARNING_RATE
+            tension = min(max(tension, MIN_TENSION), MAX_TENSION)
+        self.model.tension = tension
+        logger.info("tension: {}".format(tension))
 
     cdef void setup(self) except *:
         #logger.debug("self => %r"%self)
         Model1Trainer.setup(self)
-        if self.model.align_dist is None:
+        if self.model.align_dist is None and self.model.distortion != 'diagonal':
             self.init_align_dist()
 
     cdef void train(self, int iteration_limit) except *:
         cdef double last_entropy
+        cdef int first_step
+        cdef tuple last_counts
         self.setup()
+        first_step, last_entropy = self.resume_state('model2', iteration_limit)
         logger.info("----")
         logger.info("start training IBM Model 2")
-        last_entropy = self.model.calc_entropy(self.sent_pairs)
-        logger.info("initial entropy: %s" % last_entropy)
-        for step in range(iteration_limit):
+        for step in range(first_step, iteration_limit):
             logger.info("--")
             logger.info("step: {} / {}".format(step+1, iteration_limit))
-            # train 1 step
-            Model2Trainer.train_step(self)
-            # calculate entropy
-            entropy = self.model.calc_entropy(self.sent_pairs)
-            logger.info("entropy: %s" % entropy)
-            if entropy >= last_entropy:
+            # expectation step also gives the entropy of the current parameters
+            last_counts = (self.count_cooc_src2trg, self.count_align_trg2src)
+            Model2Trainer.expect_step(self)
+            logger.info("{}entropy: {}".format('initial ' if step == 0 else '', self.entropy))
+            if self.entropy >= last_entropy:
+                # keeping the counts which gave the current parameters, to be saved with them
+                self.count_cooc_src2trg, self.count_align_trg2src = last_counts
                 break
-            else:
-                last_entropy = entropy
+            last_entropy = self.entropy
+            Model2Trainer.maximize_step(self)
+            self.prune_step()
+            self.save_checkpoint(dict(phase='model2', step=step+1, entropy=last_entropy))
 
     cdef void train_step(self) except *:
         if self.model.trans_dist is None:
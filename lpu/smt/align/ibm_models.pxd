@@ -8,38 +8,83 @@ from numpy cimport float64_t
 
 # local library
 from lpu.common.vocab cimport StringEnumerator
+from . corpus cimport ParallelCorpus
+from . shards cimport Shard
 
 cdef class Vocab:
     cdef StringEnumerator src
     cdef StringEnumerator trg
     cdef int max_len_src
     cdef int max_len_trg
+    cdef str rare_class
 
     cdef void init(self)
-    cdef tuple ids_pair_to_str_pair(self, src_ids, trg_ids, bool character_based)
-    cdef list load_sent_pairs(self, str src_path, str trg_path, bool character_based)
+    cdef ParallelCorpus encode_sent_pairs(self, list src_sents, list trg_sents, bool character_based)
+    cdef ParallelCorpus load_sent_pairs(self, str src_path, str trg_path, bool character_based)
+    cdef void set_max_lengths(self, ParallelCorpus sent_pairs) except *
+    cdef void read_sent_pairs(self, str src_path, str trg_path, bool character_based, object builder) except *
+    cdef ParallelCorpus load_cached_sent_pairs(self, str src_path, str trg_path, bool character_based, str cache_path, long chunk_size)
+    cdef ParallelCorpus replace_words(self, ParallelCorpus sent_pairs, ndarray src_keep, ndarray trg_keep, str method)
+    cdef tuple reverse(self)
+    cdef dict to_arrays(self)
 
 cdef class Model:
     cdef Vocab vocab
-    cdef np.ndarray trans_dist
+    cdef object trans_dist
     cdef np.ndarray align_dist
+    cdef np.ndarray jump_dist
+    cdef str distortion
+    cdef double tension
+    cdef double null_prob
 
     cdef void init(self)
+    cdef ndarray align_matrix(self, int len_src, int len_trg)
     cdef double calc_pair_entropy(self, list src_sent, list trg_sent, bool normalize) except *
-    cdef double calc_entropy(self, list sent_pairs) except *
-    cdef void calc_and_save_scores(self, out_path, list sent_pairs, bool character_based)
-    cdef void decode_and_save_align(self, out_path, list sent_pairs, bool character_based)
-    cdef void save_align_dist(self, out_path, threshold)
+    cdef ndarray calc_scores(self, ParallelCorpus sent_pairs, long begin, long end)
+    cdef void calc_and_save_scores(self, out_path, ParallelCorpus sent_pairs, bool character_based, int workers=*)
+    cdef ndarray decode_bucket(self, int len_src, int len_trg, ndarray src_sents, ndarray trg_sents)
+    cdef ndarray posterior_bucket(self, int len_src, int len_trg, ndarray src_sents, ndarray trg_sents)
+    cdef ndarray decode(self, ParallelCorpus sent_pairs, long begin, long end)
+    cdef void decode_and_save_align(self, out_path, ParallelCorpus sent_pairs, bool character_based)
+    cdef void add_unknown_word(self) except *
+    cdef void fit_lengths(self, ParallelCorpus sent_pairs) except *
+    cdef tuple to_arrays(self, dict state=*)
+    cdef void save_model(self, out_path, dict state=*) except *
+    cdef dict load_model(self, path)
+    cdef void save_align_dist(self, out_path, threshold, ndarray counts=*) except *
     cdef void save_trans_dist(self, out_path, threshold, nbest)
 
 cdef class Trainer:
     cdef Model model
     cdef str src_path
     cdef str trg_path
-    cdef list sent_pairs
+    cdef ParallelCorpus sent_pairs
+    cdef str corpus_cache
+    cdef str init_model
+    cdef str checkpoint
+    cdef bool resume
+    cdef dict resumed
+    cdef long batch_size
+    cdef double step_decay
+    cdef double step_offset
+    cdef long chunk_size
+    cdef ndarray length_counts
+    cdef list length_buckets
     cdef bool character_based
-    cdef np.ndarray count_cooc_src2trg
+    cdef bool sparse
+    cdef int workers
+    cdef int threads
+    cdef int shards
+    cdef Shard shard
+    cdef object dtype
+    cdef double prune_threshold
+    cdef long prune_nbest
+    cdef long min_count
+    cdef long vocab_limit
+    cdef str rare_class
+    cdef object count_cooc_src2trg
     cdef np.ndarray count_align_trg2src
+    cdef double entropy
 
     cdef void init(self) except *
 
@@ -49,11 +94,52 @@ cdef class Trainer:
     cdef void maximize_step(self) except *
     cdef void save_align_dist(self, out_path, threshold) except *
     cdef void save_trans_dist(self, out_path, threshold, nbest) except *
+    cdef tuple owned_range(self)
+    cdef void load_corpus(self) except *
+    cdef void replace_unknown_words(self, src_buf, src_offsets, trg_buf, trg_offsets, str method) except *
+    cdef dict load_init_model(self, str path)
     cdef void setup(self) except *
     cdef void train(self, int iteration_limit) except *
+    cdef tuple resume_state(self, str phase, int iteration_limit)
+    cdef void prune_step(self) except *
+    cdef object restrict_stats(self, object stats)
+    cdef void save_checkpoint(self, dict state) except *
+    cdef void train_online(self, int iteration_limit) except *
     cdef void train_step(self) except *
 
+ctypedef void (*expect_func)(Trainer trainer, long begin, long end, ndarray count_cooc, ndarray count_align, ndarray entropy, bool verbose) except *
+
+cdef double run_expectation(Trainer trainer, expect_func func, ndarray count_cooc, ndarray count_align) except *
+
+cdef list split_words(str line, bool character_based)
+cdef tuple flatten_sents(list sents)
+cdef ndarray word_ids(StringEnumerator vocab, list words, str rare_class)
+cdef list format_alignment(ndarray trg_offsets, ndarray aligned)
+cpdef Model load_model_file(str path)
+cdef list process_lines(Model model, list lines, str output, bool character_based, object lock)
+cpdef void serve_stream(Model model, object reader, object writer, str output, bool character_based, long batch_size, object lock) except *
+
+cpdef str rare_word_class(str word, str method)
+cdef ndarray frequent_words(ndarray tokens, long vocab_size, long min_count, long limit, long num_reserved)
+cdef ndarray known_words(StringEnumerator vocab, buf, offsets)
+cdef tuple replace_enumerator(StringEnumerator vocab, ndarray keep, str method)
+
+cdef ndarray diagonal_features(int len_src, int len_trg)
+cdef ndarray diagonal_align_matrix(int len_src, int len_trg, double tension, double null_prob)
+
 cdef tuple grid_indices(list x_indices, list y_indices)
-cdef ndarray[float64_t,ndim=2] sub_matrix(ndarray[float64_t,ndim=2] matrix, list x_indices, list y_indices)
-cdef ndarray normalize(ndarray tensor, int axis, ndarray target)
+cdef ndarray flat_positions(object matrix, ndarray rows, ndarray cols)
+cdef tuple gather_entries(object matrix, ndarray rows, ndarray cols)
+cdef void accumulate(ndarray target, ndarray positions, ndarray weights) except *
+cdef list batch_bounds(ParallelCorpus sent_pairs, long begin, long end)
+cdef long batch_step(long pairs_per_sent)
+cdef list length_buckets(ParallelCorpus sent_pairs)
+cdef tuple pack_sent_pairs(ParallelCorpus sent_pairs, long begin, long end)
+cdef tuple batch_grid(ndarray src_offsets, ndarray trg_offsets)
+cdef ndarray flat_data(object matrix)
+cdef object zeros_like(object matrix)
+cdef object set_entries(object matrix, rows, cols, values)
+cdef ndarray lookup_entries(object matrix, ndarray rows, ndarray cols)
+cdef ndarray sub_matrix(object matrix, list x_indices, list y_indices)
+cdef object normalize(object tensor, int axis, object target)
 
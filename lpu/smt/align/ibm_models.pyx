@@ -6,6 +6,17 @@ from libcpp cimport bool
 
 # Standard libraries
 import argparse
+import io
+import itertools
+import mmap
+import os
+import multiprocessing
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import zlib
 
 # 3-rd party library
 import numpy as np
@@ -16,6 +27,7 @@ from numpy cimport int64_t
 
 # Local libraries
 
+from lpu.common import archives
 from lpu.common import compat
 from lpu.common import environ
 from lpu.common import files
@@ -30,6 +42,19 @@ dprint = logger.debug_print
 
 from . ibm_model1 cimport Model1, Model1Trainer
 from . ibm_model2 cimport Model2, Model2Trainer
+from . hmm_model cimport HMMModel, HMMTrainer
+from . sparse cimport SparseMatrix
+from . corpus cimport CorpusBuilder
+from . corpus cimport CorpusWriter
+from . corpus cimport load_corpus
+from . corpus import SCAN_CHUNK
+from . shards cimport Shard
+from . shards cimport create_shards
+from . shards cimport vocab_bounds
+from . symmetrize cimport AlignPoints
+from . symmetrize cimport symmetrize
+from . symmetrize import SYMMETRIZE_METHOD
+from . symmetrize import SYMMETRIZE_METHODS
 
 ITERATION_LIMIT = 5
 THRESHOLD = 0.001
@@ -37,29 +62,630 @@ NBEST = 100
 
 NULL_SYMBOL = '__NULL__'
 
+# symbol standing for the words unknown to the model when aligning given sentences (e.g. in service mode)
+UNKNOWN_SYMBOL = '__UNK__'
+
+# maximum number of word pairs processed in one batch of expectation step
+BATCH_PAIRS = 2 ** 20
+
+# number of sentence pairs held in memory at once in streaming mode
+CHUNK_SIZE = 100000
+
+# number of sentence pairs scored at once (by each worker process)
+SCORE_BATCH = 10000
+
+# number of lines of the text files encoded into word ids at once
+ENCODE_LINES = 10000
+
+# service mode: outputs for each sentence pair, and maximum number of lines processed at once
+SERVE_OUTPUTS = ['score', 'align', 'both']
+SERVE_OUTPUT = 'score'
+SERVE_BATCH = 1000
+
+# probability of the word pairs pruned from translation distribution during training
+PRUNED_PROB = 1e-7
+
+# floating point type of the distributions and the expected counts
+DTYPES = ['float64', 'float32']
+DTYPE = 'float64'
+
+# order of training phases, to skip the finished ones when resuming from checkpoint
+TRAIN_PHASES = dict(model1=0, model2=1, hmm=1, online=1)
+
+# online (stepwise) EM: number of sentence pairs of each mini-batch,
+# and step size (k + STEP_OFFSET) ** -STEP_DECAY of the k-th update
+BATCH_SIZE = 10000
+STEP_DECAY = 0.7
+STEP_OFFSET = 2.0
+
+MODEL_FORMAT = 'lpu-ibm-model'
+
+# classes replacing rare words (below --min-count or outside --vocab-limit) to shrink the vocabularies
+#   shape: sequence of character types (e.g. "__RARE_Aa0__" for "Tokyo2020")
+#   prefix: first characters of the word
+#   hash: hash bucket of the word
+RARE_CLASSES = ['shape', 'prefix', 'hash']
+RARE_CLASS = 'shape'
+RARE_SYMBOL = '__RARE_{}__'
+RARE_PREFIX_LENGTH = 3
+RARE_HASH_BUCKETS = 64
+
+# suffix of the output files of reverse (target-to-source) direction in bidirectional training
+REVERSE_SUFFIX = '.rev'
+
+# parameterization of alignment (distortion) distribution
+#   absolute: table of p(src index | trg index, src length, trg length)
+#   diagonal: favoring alignments near the diagonal (as in fast_align)
+#   hmm: HMM alignment model with jump width distribution, trained instead of Model 2
+DISTORTION_TYPES = ['absolute', 'diagonal', 'hmm']
+DISTORTION = 'absolute'
+DIAGONAL_TENSION = 4.0
+NULL_PROB = 0.08
+
 cdef tuple grid_indices(list x_indices, list y_indices):
     cdef ndarray[int64_t,ndim=2] indices1, indices2
     indices1, indices2 = np.meshgrid(x_indices, y_indices, sparse=True)
     return indices1.T, indices2.T
 
-cdef ndarray[float64_t,ndim=2] sub_matrix(ndarray[float64_t,ndim=2] matrix, list x_indices, list y_indices):
-    return matrix[grid_indices(x_indices, y_indices)]
+cdef ndarray flat_positions(object matrix, ndarray rows, ndarray cols):
+    '''positions of the (rows, cols) elements in the flattened storage of given matrix'''
+    if isinstance(matrix, SparseMatrix):
+        return (<SparseMatrix>matrix).positions(rows, cols)
+    return np.asarray(rows, np.int64) * matrix.shape[1] + cols
+
+cdef tuple gather_entries(object matrix, ndarray rows, ndarray cols):
+    '''(positions in the flattened storage, values) of the (rows, cols) elements (broadcasted)
+
+    pruned (unregistered) pairs of sparse matrix get the default value of the matrix
+    at position -1, which is skipped by accumulate
+    '''
+    cdef SparseMatrix sparse
+    cdef ndarray positions, found
+    if isinstance(matrix, SparseMatrix):
+        sparse = matrix
+        positions, found = sparse.find(rows, cols)
+        if found.all():
+            return positions, sparse.data[positions]
+        positions[~found] = -1
+        return positions, np.where(found, sparse.data[positions], sparse.data.dtype.type(sparse.default_value))
+    positions = flat_positions(matrix, rows, cols)
+    return positions, matrix.reshape(-1)[positions]
+
+cdef void accumulate(ndarray target, ndarray positions, ndarray weights) except *:
+    '''add weights into flat target array at positions (summing duplicates) in one bincount pass'''
+    cdef ndarray unique_positions, inverse
+    cdef ndarray valid = (positions >= 0)
+    if not valid.all():
+        # pruned pairs given by gather_entries
+        positions = positions[valid]
+        weights = weights[valid]
+    if len(positions) == 0:
+        return
+    if len(target) <= 4 * len(positions):
+        target += np.bincount(positions, weights, minlength=len(target))
+    else:
+        # avoiding to allocate the whole target size
+        unique_positions, inverse = np.unique(positions, return_inverse=True)
+        target[unique_positions] += np.bincount(inverse.reshape(-1), weights)
+
+cdef object interpolate_stats(object stats, object counts, object params, int axis, double rate):
+    '''stepwise EM update of sufficient statistics: (1 - rate) * stats + rate * counts
+
+    distributions without statistics yet (at the first update, or never observed before)
+    start from the current parameters weighted by the mass of the new counts,
+    not to discard the starting model (e.g. loaded from file)
+    '''
+    cdef ndarray stats_data, counts_data, mass, empty, rows
+    if stats is None:
+        stats = zeros_like(counts)
+    stats_data = flat_data(stats)
+    counts_data = flat_data(counts)
+    if params is not None:
+        if isinstance(counts, SparseMatrix):
+            rows = (<SparseMatrix>counts).row_ids()
+            mass = (<SparseMatrix>counts).sum(1)[rows]
+            empty = ((<SparseMatrix>stats).sum(1) <= 0)[rows]
+        else:
+            mass = np.broadcast_to(counts.sum(axis=axis, keepdims=True), np.shape(counts)).reshape(-1)
+            empty = np.broadcast_to(stats.sum(axis=axis, keepdims=True) <= 0, np.shape(counts)).reshape(-1)
+        stats_data[empty] = flat_data(params)[empty] * mass[empty]
+    stats_data *= (1 - rate)
+    stats_data += rate * counts_data
+    return stats
+
+cdef list batch_bounds(ParallelCorpus sent_pairs, long begin, long end):
+    '''split range of sentence pairs into batches having about BATCH_PAIRS word pairs'''
+    cdef ndarray costs = np.diff(sent_pairs.src_offsets[begin:end+1]) * np.diff(sent_pairs.trg_offsets[begin:end+1])
+    cdef ndarray groups = (np.cumsum(costs) - costs) // BATCH_PAIRS
+    cdef list bounds = [begin] + (begin + np.flatnonzero(np.diff(groups)) + 1).tolist() + [end]
+    if begin >= end:
+        return []
+    return list(zip(bounds[:-1], bounds[1:]))
+
+cdef long batch_step(long pairs_per_sent):
+    '''number of sentences processed at once for given number of word pairs per sentence'''
+    return max(1, BATCH_PAIRS // max(1, pairs_per_sent))
+
+cdef list length_buckets(ParallelCorpus sent_pairs):
+    '''group sentence pairs by (len_src, len_trg), stacking the ids of each group into 2-d arrays
+
+    returns list of (len_src, len_trg, sentence indices, source ids, target ids)
+    '''
+    cdef ndarray src_lens = sent_pairs.src_lengths()
+    cdef ndarray trg_lens = sent_pairs.trg_lengths()
+    cdef ndarray keys = src_lens * (trg_lens.max() + 1) + trg_lens
+    cdef ndarray order = np.argsort(keys, kind='stable')
+    cdef ndarray sorted_keys = keys[order]
+    cdef ndarray starts = np.flatnonzero(np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]]))
+    cdef ndarray ends = np.concatenate([starts[1:], [len(order)]])
+    cdef ndarray indices
+    cdef list buckets = []
+    cdef long begin, end
+    cdef int len_src, len_trg
+    for begin, end in zip(starts, ends):
+        indices = order[begin:end]
+        len_src = src_lens[indices[0]]
+        len_trg = trg_lens[indices[0]]
+        buckets.append((
+            len_src, len_trg, indices,
+            sent_pairs.src_tokens[sent_pairs.src_offsets[indices][:,None] + np.arange(len_src)],
+            sent_pairs.trg_tokens[sent_pairs.trg_offsets[indices][:,None] + np.arange(len_trg)],
+        ))
+    return buckets
+
+cdef tuple pack_sent_pairs(ParallelCorpus sent_pairs, long begin, long end):
+    '''flat token id arrays of sentence pairs in range [begin, end) with offsets of each sentence'''
+    return sent_pairs.pack(begin, end)
+
+cdef tuple batch_grid(ndarray src_offsets, ndarray trg_offsets):
+    '''indices of all the (src, trg) token pairs in packed sentence pairs
+
+    returns (pair_src, pair_trg), indices into the packed source/target tokens,
+    ordered by target token and then by source token
+    '''
+    cdef ndarray src_lens = np.diff(src_offsets)
+    cdef ndarray trg_lens = np.diff(trg_offsets)
+    # sentence index of each target token
+    cdef ndarray trg_sents = np.repeat(np.arange(len(trg_lens)), trg_lens)
+    # number of source tokens paired with each target token
+    cdef ndarray repeats = src_lens[trg_sents]
+    cdef ndarray starts = np.cumsum(repeats) - repeats
+    cdef ndarray pair_trg = np.repeat(np.arange(len(trg_sents)), repeats)
+    cdef ndarray pair_src = np.arange(repeats.sum()) - np.repeat(starts - src_offsets[trg_sents], repeats)
+    return pair_src, pair_trg
 
-cdef ndarray normalize(ndarray tensor, int axis, ndarray target):
+cdef ndarray flat_data(object matrix):
+    '''flattened view of the values stored in given (dense or sparse) matrix'''
+    if isinstance(matrix, SparseMatrix):
+        return (<SparseMatrix>matrix).data
+    return matrix.reshape(-1)
+
+cdef object zeros_like(object matrix):
+    if isinstance(matrix, SparseMatrix):
+        return (<SparseMatrix>matrix).zeros_like()
+    return np.zeros_like(matrix)
+
+cdef object set_entries(object matrix, rows, cols, values):
+    '''assign values into (dense or sparse) matrix, sparse matrix ignores unregistered pairs'''
+    if isinstance(matrix, SparseMatrix):
+        (<SparseMatrix>matrix).assign(rows, cols, values)
+    else:
+        matrix[rows, cols] = values
+    return matrix
+
+cdef ndarray lookup_entries(object matrix, ndarray rows, ndarray cols):
+    '''values of the (rows, cols) elements (broadcasted), unregistered entries of sparse matrix are regarded as its default value'''
+    if isinstance(matrix, SparseMatrix):
+        return (<SparseMatrix>matrix).lookup(rows, cols)
+    return matrix[rows, cols]
+
+cdef ndarray sub_matrix(object matrix, list x_indices, list y_indices):
+    cdef tuple grid = grid_indices(x_indices, y_indices)
+    if isinstance(matrix, SparseMatrix):
+        return (<SparseMatrix>matrix).lookup(grid[0], grid[1])
+    return matrix[grid]
+
+cdef SparseMatrix normalize_sparse(SparseMatrix matrix, int axis, SparseMatrix target):
+    cdef ndarray denom = matrix.sum(axis=axis)
     cdef ndarray positive_indices
-    cdef ndarray denom = tensor.sum(axis=axis)
+    if axis == 0:
+        denom = denom[matrix.col_ids()]
+    else:
+        denom = denom[matrix.row_ids()]
+    positive_indices = (denom > 0)
+    target.data[positive_indices] = matrix.data[positive_indices] / denom[positive_indices]
+    return target
+
+cdef object normalize(object tensor, int axis, object target):
+    cdef ndarray positive_indices
+    cdef ndarray denom
+    if isinstance(tensor, SparseMatrix):
+        return normalize_sparse(tensor, axis, target)
+    # summing in double precision even for single precision tensor
+    denom = tensor.sum(axis=axis, dtype=np.float64)
     denom = np.expand_dims(denom, axis=axis)
     denom = np.broadcast_to(denom, tensor[:].shape)
     positive_indices = (denom > 0)
     target[positive_indices] = tensor[positive_indices] / denom[positive_indices]
     return target
 
+cdef ndarray diagonal_features(int len_src, int len_trg):
+    '''negative distances from the diagonal, as (len_src-1 x len_trg) matrix excluding NULL'''
+    cdef ndarray src_pos = np.arange(1, len_src, dtype=np.float64)[:,None] / (len_src - 1)
+    cdef ndarray trg_pos = np.arange(1, len_trg+1, dtype=np.float64)[None,:] / len_trg
+    return -np.abs(src_pos - trg_pos)
+
+cdef ndarray diagonal_align_matrix(int len_src, int len_trg, double tension, double null_prob):
+    '''alignment probabilities with diagonal distortion, as (len_src x len_trg) matrix'''
+    cdef ndarray unnormalized = np.exp(tension * diagonal_features(len_src, len_trg))
+    cdef ndarray align_matrix = np.empty([len_src, len_trg], np.float64)
+    align_matrix[0] = null_prob
+    align_matrix[1:] = (1 - null_prob) * unnormalized / unnormalized.sum(axis=0)
+    return align_matrix
+
+cdef dict read_distortion_params(str path):
+    '''read the parameter records ("key\tvalue") put on the head of alignment distribution file'''
+    cdef dict params = {}
+    cdef list fields
+    with files.open(path, 'rt') as fobj:
+        for line in fobj:
+            fields = line.strip().split('\t')
+            if len(fields) != 2:
+                break
+            params[fields[0]] = fields[1]
+    return params
+
+cdef void write_distortion_params(object fobj, Model model) except *:
+    fobj.write("distortion\t%s\n" % (model.distortion,))
+    fobj.write("tension\t%s\n" % (model.tension,))
+    fobj.write("null_prob\t%s\n" % (model.null_prob,))
+
+cdef void write_jump_dist(object fobj, ndarray jump_dist, ndarray counts) except *:
+    '''write records of jump width distribution ("jump\twidth\tprob[\tcount]") following the parameters'''
+    cdef long max_jump = (len(jump_dist) - 1) // 2
+    cdef long index
+    for index in range(len(jump_dist)):
+        if counts is None:
+            fobj.write("jump\t%s\t%s\n" % (index - max_jump, jump_dist[index]))
+        else:
+            fobj.write("jump\t%s\t%.8f\t%.2f\n" % (index - max_jump, jump_dist[index], counts[index]))
+
+cdef void read_jump_dist(str path, ndarray jump_dist) except *:
+    '''fill jump width distribution by the records in the file, jumps wider than given distribution are ignored'''
+    cdef long max_jump = (len(jump_dist) - 1) // 2
+    cdef long width
+    cdef list fields
+    with files.open(path, 'rt') as fobj:
+        for line in fobj:
+            fields = line.strip().split('\t')
+            if len(fields) >= 3 and fields[0] == 'jump':
+                width = int(fields[1])
+                if -max_jump <= width <= max_jump:
+                    jump_dist[width + max_jump] = float(fields[2])
+
+cdef list row_blocks(object matrix, long begin, long end):
+    '''split range of rows of (dense or sparse) matrix into blocks having about BATCH_PAIRS entries'''
+    cdef ndarray sizes
+    cdef ndarray groups
+    cdef list bounds
+    if begin >= end:
+        return []
+    if isinstance(matrix, SparseMatrix):
+        sizes = np.diff((<SparseMatrix>matrix).indptr[begin:end+1])
+    else:
+        sizes = np.full(end - begin, np.shape(matrix)[1], np.int64)
+    groups = (np.cumsum(sizes) - sizes) // BATCH_PAIRS
+    bounds = [begin] + (begin + np.flatnonzero(np.diff(groups)) + 1).tolist() + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+cdef object row_limits(object counts, object nbest):
+    '''number of entries left by slicing rows having given counts of entries with [:nbest]'''
+    if nbest is None:
+        return counts
+    elif nbest < 0:
+        return np.maximum(counts + nbest, 0)
+    return np.minimum(counts, nbest)
+
+cdef ndarray above_threshold(ndarray probs, object threshold):
+    # rounded into single precision before comparison, as the probabilities are written
+    return probs.astype(np.float32).astype(np.float64) > threshold
+
+cdef tuple top_entries(object matrix, long begin, long end, object threshold, object nbest):
+    '''(rows, cols, probs) of the top-n entries above the threshold in rows [begin, end) of (dense or sparse) matrix,
+    in descending order of probability within each row (ties in ascending order of cols),
+    with the probabilities rounded into single precision'''
+    cdef SparseMatrix sparse
+    cdef ndarray probs, rows, cols
+    cdef ndarray kth, greater, ties, keep, order, ranks
+    cdef long lower, upper, limit
+    if isinstance(matrix, SparseMatrix):
+        # entries of the rows are sorted directly in the sparse storage
+        sparse = matrix
+        lower = sparse.indptr[begin]
+        upper = sparse.indptr[end]
+        probs = sparse.data[lower:upper]
+        rows = np.repeat(np.arange(begin, end, dtype=np.int64), np.diff(sparse.indptr[begin:end+1]))
+        cols = sparse.keys[lower:upper] % sparse.shape[1]
+        order = np.lexsort((-probs, rows))
+        ranks = np.arange(len(order)) - (sparse.indptr[rows[order]] - lower)
+        order = order[ranks < row_limits(np.diff(sparse.indptr[begin:end+1]), nbest)[rows[order] - begin]]
+        order = order[above_threshold(probs[order], threshold)]
+        return rows[order], cols[order], probs[order].astype(np.float32).astype(np.float64)
+    probs = np.asarray(matrix[begin:end])
+    keep = above_threshold(probs, threshold)
+    limit = row_limits(np.shape(probs)[1], nbest)
+    if limit <= 0:
+        keep[:] = False
+    elif limit < np.shape(probs)[1]:
+        # n-th largest value of each row, taking the tied values from the smallest col as many as needed
+        kth = -np.partition(-probs, limit-1, axis=1)[:,limit-1:limit]
+        greater = (probs > kth)
+        ties = (probs == kth)
+        keep &= greater | (ties & (np.cumsum(ties, axis=1) <= limit - greater.sum(axis=1, keepdims=True)))
+    rows, cols = np.nonzero(keep)
+    probs = probs[rows, cols]
+    order = np.lexsort((-probs, rows))
+    return rows[order] + begin, cols[order], probs[order].astype(np.float32).astype(np.float64)
+
+cdef void write_records(object fobj, str fmt, list columns) except *:
+    '''write records formatting the lists of column values, CHUNK_SIZE records at once'''
+    cdef long num_columns = len(columns)
+    cdef long num_records = len(columns[0])
+    cdef long begin, end, index
+    cdef list values
+    for begin in range(0, num_records, CHUNK_SIZE):
+        end = min(begin + CHUNK_SIZE, num_records)
+        values = [None] * ((end - begin) * num_columns)
+        for index in range(num_columns):
+            values[index::num_columns] = columns[index][begin:end]
+        fobj.write((fmt * (end - begin)) % tuple(values))
+
+cdef void write_trans_dist(object fobj, Model model, object counts, long offset, object threshold, object nbest) except *:
+    '''write records of top-n translation probabilities above the threshold ("src\ttrg\tprob[\tcount]"),
+    rows of the distribution (and counts) start from the source word id "offset"'''
+    cdef ndarray src_words = np.array(list(model.vocab.src), dtype=object)
+    cdef ndarray trg_words = np.array(list(model.vocab.trg), dtype=object)
+    cdef ndarray rows, cols, probs
+    cdef long lower, upper
+    for lower, upper in progress.view(row_blocks(model.trans_dist, 0, np.shape(model.trans_dist)[0]), 'storing'):
+        rows, cols, probs = top_entries(model.trans_dist, lower, upper, threshold, nbest)
+        if counts is None:
+            write_records(fobj, "%s\t%s\t%s\n", [src_words[rows + offset].tolist(), trg_words[cols].tolist(), probs.tolist()])
+        else:
+            write_records(fobj, "%s\t%s\t%.8f\t%.2f\n", [
+                src_words[rows + offset].tolist(), trg_words[cols].tolist(), probs.tolist(),
+                lookup_entries(counts, rows, cols).tolist(),
+            ])
+
+cdef void write_align_dist(object fobj, ndarray align_dist, ndarray counts, object threshold) except *:
+    '''write records of trained alignment probabilities above the threshold ("len_src\tlen_trg\ttrg\tsrc\tprob[\tcount]")'''
+    cdef ndarray trained = (align_dist.max(axis=3) != align_dist.min(axis=3))
+    cdef ndarray keep, probs
+    cdef tuple indices
+    cdef long len_src
+    for len_src in progress.view(range(np.shape(align_dist)[0]), 'storing'):
+        # masked one source length at a time, not to round the whole array at once
+        keep = trained[len_src,:,:,None] & above_threshold(align_dist[len_src], threshold)
+        indices = np.nonzero(keep)
+        probs = align_dist[len_src][indices].astype(np.float32).astype(np.float64)
+        columns = [[len_src+1] * len(probs), (indices[0]+1).tolist(), (indices[1]+1).tolist(), indices[2].tolist(), probs.tolist()]
+        if counts is None:
+            write_records(fobj, "%s\t%s\t%s\t%s\t%s\n", columns)
+        else:
+            write_records(fobj, "%s\t%s\t%s\t%s\t%.8f\t%.2f\n", columns + [counts[len_src][indices].tolist()])
+
+cdef expect_func _worker_func = NULL
+
+cdef ndarray shared_zeros_like(ndarray array):
+    '''zero-filled array on anonymous shared memory, visible from forked processes'''
+    cdef object buf = mmap.mmap(-1, max(array.nbytes, 1))
+    return np.frombuffer(buf, array.dtype, count=array.size)
+
+cdef ndarray shard_bounds(ParallelCorpus sent_pairs, int num_shards):
+    '''split sentence pairs into contiguous shards with balanced number of word pairs'''
+    cdef list chunks = sent_pairs.chunk_bounds(0, len(sent_pairs), SCAN_CHUNK)
+    cdef ndarray targets, cumsum, found
+    cdef list bounds = []
+    cdef long total = 0
+    cdef long begin, end
+    for begin, end in chunks:
+        total += sent_pairs.pair_costs(begin, end).sum()
+    targets = total * np.arange(1, num_shards) / float(num_shards)
+    # scanning cumulative costs chunk by chunk, not to hold the costs of whole corpus
+    total = 0
+    for begin, end in chunks:
+        cumsum = total + np.cumsum(sent_pairs.pair_costs(begin, end))
+        found = np.searchsorted(cumsum, targets[len(bounds):])
+        bounds.extend( (begin + found[found < len(cumsum)]).tolist() )
+        total = cumsum[-1]
+    return np.array([0] + bounds + [len(sent_pairs)] * (num_shards - len(bounds)), np.int64)
+
+def _expect_worker(Trainer trainer, long begin, long end, ndarray count_cooc, ndarray count_align, ndarray entropy, bool verbose):
+    # running in forked process, calling the kernel inherited from the parent
+    _worker_func(trainer, begin, end, count_cooc, count_align, entropy, verbose)
+
+cdef double run_expectation(Trainer trainer, expect_func func, ndarray count_cooc, ndarray count_align) except *:
+    '''run the expectation kernel over all the sentence pairs, sharding them into worker processes if enabled
+
+    returns the sum of the entropies of sentence pairs under the current parameters,
+    accumulated by the kernel as a by-product
+    '''
+    global _worker_func
+    cdef int num_workers = min(trainer.workers, len(trainer.sent_pairs))
+    cdef ndarray entropy = np.zeros(1, np.float64)
+    cdef ndarray bounds
+    cdef list buffers, procs
+    if trainer.shard is not None:
+        # every shard goes through all the sentence pairs, and the alignment counts are summed up
+        func(trainer, 0, len(trainer.sent_pairs), count_cooc, count_align, entropy, trainer.shard.rank == 0)
+        if count_align is not None:
+            count_align[:] = trainer.shard.allreduce(count_align)
+        return entropy[0]
+    if num_workers <= 1:
+        func(trainer, 0, len(trainer.sent_pairs), count_cooc, count_align, entropy, True)
+        return entropy[0]
+    logger.info("sharding sentence pairs into {} worker processes".format(num_workers))
+    bounds = shard_bounds(trainer.sent_pairs, num_workers)
+    buffers = []
+    for i in range(num_workers):
+        if count_align is None:
+            buffers.append( (shared_zeros_like(count_cooc), None, shared_zeros_like(entropy)) )
+        else:
+            buffers.append( (shared_zeros_like(count_cooc), shared_zeros_like(count_align), shared_zeros_like(entropy)) )
+    _worker_func = func
+    context = multiprocessing.get_context('fork')
+    procs = []
+    for i in range(num_workers):
+        args = (trainer, bounds[i], bounds[i+1], buffers[i][0], buffers[i][1], buffers[i][2], i == 0)
+        procs.append( context.Process(target=_expect_worker, args=args) )
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    if any([proc.exitcode != 0 for proc in procs]):
+        raise RuntimeError("worker process of expectation step failed")
+    # reducing partial counts
+    for partial_cooc, partial_align, partial_entropy in buffers:
+        count_cooc += partial_cooc
+        if count_align is not None:
+            count_align += partial_align
+        entropy += partial_entropy
+    return entropy[0]
+
+# model and corpus shared (read-only) with the forked worker processes of scoring
+cdef Model _score_model = None
+cdef ParallelCorpus _score_pairs = None
+
+def _score_worker(tuple bounds):
+    return _score_model.calc_scores(_score_pairs, bounds[0], bounds[1])
+
+cdef ParallelCorpus reverse_sent_pairs(ParallelCorpus sent_pairs, ndarray src_map, ndarray trg_map):
+    '''swap the sides of sentence pairs, moving NULL word (leading source token) to the head of the new source side,
+    with the ids mapped as given by Vocab.reverse'''
+    cdef ndarray indices = np.arange(len(sent_pairs) + 1)
+    return ParallelCorpus(
+        np.insert(trg_map[sent_pairs.trg_tokens], sent_pairs.trg_offsets[:-1], 0),
+        sent_pairs.trg_offsets + indices,
+        src_map[np.delete(sent_pairs.src_tokens, sent_pairs.src_offsets[:-1])],
+        sent_pairs.src_offsets - indices,
+    )
+
+cdef dict get_text_meta(str src_path, str trg_path, bool character_based):
+    '''properties of parallel text files to check the validity of cached corpus'''
+    cdef dict meta = dict(character=character_based)
+    for side, path in [('src', src_path), ('trg', trg_path)]:
+        if path and os.path.exists(path):
+            meta[side+'_path'] = os.path.abspath(path)
+            meta[side+'_size'] = os.path.getsize(path)
+            meta[side+'_mtime'] = os.path.getmtime(path)
+    return meta
+
+cdef bool is_valid_cache(dict cached_meta, dict text_meta):
+    # text files not found are regarded as replaced by the cache
+    return all([cached_meta.get(key) == val for key, val in text_meta.items()])
+
+cdef ndarray fit_align_dist(ndarray align_dist, int max_len_src, int max_len_trg):
+    '''fit stored alignment distribution into the shape for given max lengths (as-is if not given),
+    regarding the distributions of unseen lengths as uniform'''
+    cdef tuple shape = (max_len_src-1, max_len_trg, max_len_trg, max_len_src)
+    cdef ndarray fitted
+    if max_len_src <= 0 or np.shape(align_dist) == shape:
+        return align_dist
+    fitted = (np.ones(shape, np.float64) / (np.arange(max_len_src-1) + 2)[:,None,None,None]).astype(align_dist.dtype)
+    overlap = tuple([slice(0, min(stored, given)) for stored, given in zip(np.shape(align_dist), shape)])
+    fitted[overlap] = align_dist[overlap]
+    return fitted
+
+cpdef str rare_word_class(str word, str method):
+    '''class token replacing the rare word'''
+    cdef list kinds = []
+    cdef str char, kind
+    if method == 'shape':
+        for char in word:
+            if char.isdigit():
+                kind = '0'
+            elif char.isupper():
+                kind = 'A'
+            elif char.isalpha():
+                kind = 'a'
+            else:
+                kind = '.'
+            if not kinds or kinds[-1] != kind:
+                kinds.append(kind)
+        return RARE_SYMBOL.format(str.join('', kinds))
+    elif method == 'prefix':
+        return RARE_SYMBOL.format(word[:RARE_PREFIX_LENGTH])
+    elif method == 'hash':
+        return RARE_SYMBOL.format(zlib.crc32(word.encode('utf-8')) % RARE_HASH_BUCKETS)
+    raise ValueError("unknown rare word class: {}".format(method))
+
+cdef ndarray frequent_words(ndarray tokens, long vocab_size, long min_count, long limit, long num_reserved):
+    '''mask of the word ids appearing at least min_count times, and within the top-n frequent ones if limit > 0,
+    the first num_reserved ids (e.g. NULL word) are always kept without taking the places of the top-n'''
+    cdef ndarray counts = np.bincount(tokens, minlength=vocab_size)
+    cdef ndarray keep
+    counts[:num_reserved] = 0
+    keep = (counts >= min_count)
+    if 0 < limit < vocab_size - num_reserved:
+        keep[np.argsort(-counts, kind='stable')[limit:]] = False
+    keep[:num_reserved] = True
+    return keep
+
+cdef ndarray known_words(StringEnumerator vocab, buf, offsets):
+    '''mask of the word ids registered in the vocabulary stored by StringEnumerator.to_arrays'''
+    cdef StringEnumerator known = StringEnumerator()
+    known.load_arrays(buf, offsets)
+    return known.encode(list(vocab), False) >= 0
+
+cdef tuple replace_enumerator(StringEnumerator vocab, ndarray keep, str method):
+    '''vocabulary of the kept words (in the same order) followed by the classes of the others,
+    returns (new vocabulary, new id of each word)'''
+    cdef StringEnumerator replaced = StringEnumerator()
+    cdef ndarray id_map = np.zeros(len(vocab), np.int32)
+    cdef ndarray kept = np.flatnonzero(keep)
+    cdef ndarray others = np.flatnonzero(~keep)
+    id_map[kept] = replaced.encode(vocab.decode(kept))
+    id_map[others] = replaced.encode([rare_word_class(word, method) for word in vocab.decode(others)])
+    return replaced, id_map
+
+cdef list split_words(str line, bool character_based):
+    if character_based:
+        return list( map(compat.to_str, compat.to_unicode(line.strip("\n"))) )
+    return line.strip("\n").split(' ')
+
+cdef tuple flatten_sents(list sents):
+    '''concatenated words of the sentences (lists of words) with the offsets of each sentence'''
+    cdef list offsets = [0] + np.cumsum([len(sent) for sent in sents], dtype=np.int64).tolist()
+    return list(itertools.chain.from_iterable(sents)), offsets
+
+cdef ndarray word_ids(StringEnumerator vocab, list words, str rare_class):
+    '''ids of the words without registering them, falling back to their rare word classes and then the unknown symbol'''
+    cdef ndarray ids = vocab.encode(words, False)
+    cdef ndarray unknown = np.flatnonzero(ids < 0)
+    if rare_class and len(unknown) > 0:
+        ids[unknown] = vocab.encode([rare_word_class(words[i], rare_class) for i in unknown.tolist()], False)
+        unknown = np.flatnonzero(ids < 0)
+    if len(unknown) > 0:
+        if vocab.find(UNKNOWN_SYMBOL) < 0:
+            raise KeyError(UNKNOWN_SYMBOL)
+        ids[unknown] = vocab.find(UNKNOWN_SYMBOL)
+    return ids
+
+cdef list format_alignment(ndarray trg_offsets, ndarray aligned):
+    '''lines of links "trg_index-src_index" (as stored by decode_and_save_align) from the Viterbi alignment
+    given by Model.decode, with target offsets of the sentence pairs (starting from 0)'''
+    cdef ndarray positions = np.arange(len(aligned)) - np.repeat(trg_offsets[:-1], np.diff(trg_offsets)) + 1
+    cdef list records = np.char.add(np.char.add(positions.astype(str), '-'), aligned.astype(str)).tolist()
+    cdef list bounds = trg_offsets.tolist()
+    return [str.join(' ', records[bounds[k]:bounds[k+1]]) for k in range(len(bounds) - 1)]
+
 cdef class Vocab:
     # imported from "ibm_model1.pxd"
     #cdef StringEnumerator src
     #cdef StringEnumerator trg
     #cdef int max_len_src
     #cdef int max_len_trg
+    #cdef str rare_class
 
     def __cinit__(self):
         self.init()
@@ -67,44 +693,135 @@ cdef class Vocab:
         self.src = StringEnumerator()
         self.trg = StringEnumerator()
 
-    cdef tuple ids_pair_to_str_pair(self, src_ids, trg_ids, bool character_based):
-        cdef src_str, trg_str
-        if character_based:
-            src_str = str.join('', [self.src.id2str(i) for i in src_ids[:-1]])
-            trg_str = str.join('', [self.trg.id2str(i) for i in trg_ids])
-        else:
-            src_str = str.join(' ', [self.src.id2str(i) for i in src_ids[:-1]])
-            trg_str = str.join(' ', [self.trg.id2str(i) for i in trg_ids])
-        return src_str, trg_str
-
-    cdef list load_sent_pairs(self, str src_path, str trg_path, bool character_based):
-        cdef str src_line, trg_line
+    cdef void read_sent_pairs(self, str src_path, str trg_path, bool character_based, object builder) except *:
+        '''read parallel text files, appending id sequences of each sentence pair into the builder
+        (words of ENCODE_LINES lines are encoded at once)'''
+        cdef list lines
         cdef list src_words, trg_words
         cdef list src_ids, trg_ids
-        cdef list sent_pairs
-        cdef str word
+        cdef list src_offsets, trg_offsets
+        cdef long i
         logger.info("loading files: %s %s" % (src_path,trg_path))
         self.src.append(NULL_SYMBOL)
         src_file = progress.FileReader(src_path, 'loading')
         trg_file = files.open(trg_path)
-        sent_pairs = []
-        for src_line, trg_line in zip(src_file, trg_file):
-            if character_based:
-                src_words = list( compat.to_unicode(src_line.strip("\n")) )
-                trg_words = list( compat.to_unicode(trg_line.strip("\n")) )
-                src_words = list( map(compat.to_str, src_words) )
-                trg_words = list( map(compat.to_str, trg_words) )
-            else:
-                src_words = src_line.strip("\n").split(' ')
-                trg_words = trg_line.strip("\n").split(' ')
-            src_words = [NULL_SYMBOL] + src_words
-            src_ids = [self.src.str2id(word) for word in src_words]
-            trg_ids = [self.trg.str2id(word) for word in trg_words]
-            sent_pairs.append( (src_ids, trg_ids) )
-            self.max_len_src = max(self.max_len_src, len(src_ids))
-            self.max_len_trg = max(self.max_len_src, len(trg_ids))
+        line_pairs = zip(src_file, trg_file)
+        while True:
+            lines = list(itertools.islice(line_pairs, ENCODE_LINES))
+            if not lines:
+                break
+            src_words, src_offsets = flatten_sents([[NULL_SYMBOL] + split_words(src_line, character_based) for src_line, trg_line in lines])
+            trg_words, trg_offsets = flatten_sents([split_words(trg_line, character_based) for src_line, trg_line in lines])
+            src_ids = self.src.encode(src_words).tolist()
+            trg_ids = self.trg.encode(trg_words).tolist()
+            for i in range(len(lines)):
+                builder.append(src_ids[src_offsets[i]:src_offsets[i+1]], trg_ids[trg_offsets[i]:trg_offsets[i+1]])
+
+    cdef ParallelCorpus encode_sent_pairs(self, list src_sents, list trg_sents, bool character_based):
+        '''corpus of given sentences (lines or lists of words) without registering new words into the vocabularies,
+        unknown words are replaced with their rare word classes (if trained so) or the unknown symbol'''
+        cdef CorpusBuilder builder = CorpusBuilder()
+        cdef list src_words, trg_words
+        cdef list src_ids, trg_ids
+        cdef list src_offsets, trg_offsets
+        cdef long num_pairs = min(len(src_sents), len(trg_sents))
+        cdef long i
+        src_words, src_offsets = flatten_sents([split_words(sent, character_based) if isinstance(sent, str) else list(sent) for sent in src_sents[:num_pairs]])
+        trg_words, trg_offsets = flatten_sents([split_words(sent, character_based) if isinstance(sent, str) else list(sent) for sent in trg_sents[:num_pairs]])
+        src_ids = word_ids(self.src, src_words, self.rare_class).tolist()
+        trg_ids = word_ids(self.trg, trg_words, self.rare_class).tolist()
+        for i in range(num_pairs):
+            builder.append([0] + src_ids[src_offsets[i]:src_offsets[i+1]], trg_ids[trg_offsets[i]:trg_offsets[i+1]])
+        return builder.build()
+
+    cdef ParallelCorpus load_sent_pairs(self, str src_path, str trg_path, bool character_based):
+        cdef CorpusBuilder builder = CorpusBuilder()
+        cdef ParallelCorpus sent_pairs
+        self.read_sent_pairs(src_path, trg_path, character_based, builder)
+        sent_pairs = builder.build()
+        self.set_max_lengths(sent_pairs)
         return sent_pairs
 
+    cdef void set_max_lengths(self, ParallelCorpus sent_pairs) except *:
+        cdef long max_len_src, max_len_trg
+        if len(sent_pairs) > 0:
+            max_len_src, max_len_trg = sent_pairs.max_lengths()
+            self.max_len_src = max(self.max_len_src, max_len_src)
+            self.max_len_trg = max(self.max_len_trg, max_len_trg)
+
+    cdef ParallelCorpus load_cached_sent_pairs(self, str src_path, str trg_path, bool character_based, str cache_path, long chunk_size):
+        '''load packed corpus with vocabularies from the cache file if it is valid for given texts,
+        otherwise load the texts and store them into the cache file
+
+        if chunk_size > 0 (streaming mode), the texts are packed into the cache file chunk by chunk
+        and the corpus is memory-mapped from it, not to hold the whole corpus in memory
+        '''
+        cdef ParallelCorpus sent_pairs
+        cdef CorpusWriter writer
+        cdef dict arrays, meta
+        cdef dict text_meta = get_text_meta(src_path, trg_path, character_based)
+        if cache_path and os.path.exists(cache_path):
+            logger.info("loading cached corpus: %s" % (cache_path,))
+            sent_pairs, arrays, meta = load_corpus(cache_path)
+            if is_valid_cache(meta, text_meta):
+                self.src = StringEnumerator()
+                self.trg = StringEnumerator()
+                self.src.load_arrays(arrays['src_vocab'], arrays['src_vocab_offsets'])
+                self.trg.load_arrays(arrays['trg_vocab'], arrays['trg_vocab_offsets'])
+                self.set_max_lengths(sent_pairs)
+                return sent_pairs
+            logger.warning("cached corpus does not match given text files, reloading them")
+        if chunk_size > 0 and cache_path:
+            writer = CorpusWriter(chunk_size, os.path.dirname(os.path.abspath(cache_path)))
+            try:
+                self.read_sent_pairs(src_path, trg_path, character_based, writer)
+                logger.info("storing packed corpus into cache file: %s" % (cache_path,))
+                writer.save(cache_path, self.to_arrays(), text_meta)
+            finally:
+                writer.close()
+            sent_pairs, arrays, meta = load_corpus(cache_path)
+            self.set_max_lengths(sent_pairs)
+            return sent_pairs
+        sent_pairs = self.load_sent_pairs(src_path, trg_path, character_based)
+        if cache_path:
+            logger.info("storing packed corpus into cache file: %s" % (cache_path,))
+            sent_pairs.save(cache_path, self.to_arrays(), text_meta)
+        return sent_pairs
+
+    cdef ParallelCorpus replace_words(self, ParallelCorpus sent_pairs, ndarray src_keep, ndarray trg_keep, str method):
+        '''replace the words not to keep (masks over the ids) with their rare word classes,
+        returns the corpus of the new ids (the same sentence pairs and positions)'''
+        cdef long len_src = len(self.src)
+        cdef long len_trg = len(self.trg)
+        cdef ndarray src_map, trg_map
+        # NULL word is never replaced
+        src_keep[0] = True
+        self.src, src_map = replace_enumerator(self.src, src_keep, method)
+        self.trg, trg_map = replace_enumerator(self.trg, trg_keep, method)
+        self.rare_class = method
+        logger.info("replaced rare words with classes ({}): source vocabulary {:,d} -> {:,d}, target vocabulary {:,d} -> {:,d}".format(method, len_src, len(self.src), len_trg, len(self.trg)))
+        return ParallelCorpus(src_map[sent_pairs.src_tokens], sent_pairs.src_offsets, trg_map[sent_pairs.trg_tokens], sent_pairs.trg_offsets)
+
+    cdef tuple reverse(self):
+        '''vocabularies of the reverse direction (target-to-source), returns (reversed vocab,
+        ids of the source words in the reversed target vocabulary, ids of the target words in the reversed source vocabulary)'''
+        cdef Vocab reversed_vocab = Vocab()
+        cdef ndarray src_buf, src_offsets
+        cdef ndarray src_map, trg_map
+        reversed_vocab.src.append(NULL_SYMBOL)
+        reversed_vocab.rare_class = self.rare_class
+        trg_map = reversed_vocab.src.load_arrays(*self.trg.to_arrays())
+        src_buf, src_offsets = self.src.to_arrays()
+        # NULL word (id 0) is not a target word
+        src_map = np.concatenate([[-1], reversed_vocab.trg.load_arrays(src_buf, src_offsets[1:])])
+        return reversed_vocab, src_map, trg_map
+
+    cdef dict to_arrays(self):
+        cdef dict arrays = {}
+        arrays['src_vocab'], arrays['src_vocab_offsets'] = self.src.to_arrays()
+        arrays['trg_vocab'], arrays['trg_vocab_offsets'] = self.trg.to_arrays()
+        return arrays
+
 cdef class Model:
     # imported from "ibm_model1.pxd"
     #cdef np.ndarray trans_dist
@@ -115,103 +832,236 @@ cdef class Model:
         self.init()
     cdef inline void init(self):
         self.vocab = Vocab()
+        self.distortion = DISTORTION
+        self.tension = DIAGONAL_TENSION
+        self.null_prob = NULL_PROB
+
+    cdef ndarray align_matrix(self, int len_src, int len_trg):
+        '''alignment probabilities p(src index | trg index, lengths) as (len_src x len_trg) matrix'''
+        if self.distortion == 'diagonal':
+            return diagonal_align_matrix(len_src, len_trg, self.tension, self.null_prob)
+        return self.align_dist[len_src-2,len_trg-1][:len_trg,:len_src].T
 
     cdef double calc_pair_entropy(self, list src_sent, list trg_sent, bool normalize) except *:
         raise NotImplementedError()
 
-    cdef double calc_entropy(self, list sent_pairs) except *:
-        cdef float total_entropy = 0
-        logger.info('calculating entropy')
-        for i, (src_sent, trg_sent) in enumerate(progress.view(sent_pairs, 'progress')):
-            total_entropy += self.calc_pair_entropy(src_sent, trg_sent, True)
-        return total_entropy / len(sent_pairs)
-
-    cdef void calc_and_save_scores(self, out_path, list sent_pairs, bool character_based):
-        cdef double entropy = 0
-        cdef str src_string, trg_string
+    cdef ndarray calc_scores(self, ParallelCorpus sent_pairs, long begin, long end):
+        '''normalized entropy of each sentence pair in range [begin, end)'''
+        cdef ndarray scores = np.zeros(end - begin, np.float64)
         cdef list src_ids, trg_ids
-        cdef str record
-        cdef int i
+        cdef long i
+        for i in range(begin, end):
+            src_ids, trg_ids = sent_pairs.pair(i)
+            scores[i - begin] = self.calc_pair_entropy(src_ids, trg_ids, True)
+        return scores
+
+    cdef void calc_and_save_scores(self, out_path, ParallelCorpus sent_pairs, bool character_based, int workers=1):
+        '''store the entropy of each sentence pair in the order of the corpus,
+        scoring batches of the pairs in the pool of worker processes if workers > 1'''
+        global _score_model, _score_pairs
+        cdef list bounds = sent_pairs.chunk_bounds(0, len(sent_pairs), SCORE_BATCH)
+        cdef ndarray scores
         logger.info("calculating and storing alignment scores into file: %s"  % (out_path))
-        with files.open(out_path, 'wt') as fobj:
-            for i, (src_ids, trg_ids) in enumerate(progress.view(sent_pairs, 'progress')):
-                entropy = self.calc_pair_entropy(src_ids, trg_ids, True)
-                src_string, trg_string = self.vocab.ids_pair_to_str_pair(src_ids, trg_ids, character_based)
-                #record = "%s\t%s\t%s\n" % (entropy, src_string, trg_string)
-                record = "{}\n".format(entropy)
-                fobj.write(record)
-
-    cdef void decode_and_save_align(self, out_path, list sent_pairs, bool character_based):
-        cdef double entropy = 0
-        cdef str src_string, trg_string
-        cdef list src_ids, trg_ids
-        cdef str record
-        cdef int i
-        cdef ndarray trans_matrix
+        pool = None
+        if workers > 1 and len(bounds) > 1:
+            logger.info("scoring in {} worker processes".format(workers))
+            _score_model, _score_pairs = self, sent_pairs
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            results = pool.imap(_score_worker, bounds)
+        else:
+            results = (self.calc_scores(sent_pairs, begin, end) for begin, end in bounds)
+        try:
+            with files.open(out_path, 'wt') as fobj:
+                for _, scores in zip(progress.view(bounds, 'scoring'), results):
+                    fobj.write(str.join('', ['{}\n'.format(entropy) for entropy in scores.tolist()]))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            _score_model, _score_pairs = None, None
+
+    cdef ndarray decode_bucket(self, int len_src, int len_trg, ndarray src_sents, ndarray trg_sents):
+        '''Viterbi alignment of stacked sentence pairs of the same lengths, as the best source index of each target position'''
+        cdef ndarray trans_tensor = lookup_entries(self.trans_dist, src_sents[:,:,None], trg_sents[:,None,:])
+        return (trans_tensor * self.align_matrix(len_src, len_trg)[None,:,:]).argmax(axis=1)
+
+    cdef ndarray posterior_bucket(self, int len_src, int len_trg, ndarray src_sents, ndarray trg_sents):
+        '''posterior probabilities of alignments of stacked sentence pairs of the same lengths,
+        as (pairs x len_src x len_trg) tensor of p(src index | trg index, sentence pair)'''
+        cdef ndarray probs = lookup_entries(self.trans_dist, src_sents[:,:,None], trg_sents[:,None,:]) * self.align_matrix(len_src, len_trg)[None,:,:]
+        cdef ndarray denom = probs.sum(axis=1, keepdims=True, dtype=np.float64)
+        return np.divide(probs, denom, out=np.zeros(np.shape(probs), np.float64), where=(denom > 0))
+
+    cdef ndarray decode(self, ParallelCorpus sent_pairs, long begin, long end):
+        '''Viterbi alignment of sentence pairs in range [begin, end),
+        as flat array of the best source index (0 for NULL) of every target token'''
+        cdef ParallelCorpus chunk = sent_pairs.slice(begin, end)
+        cdef ndarray offsets = chunk.trg_offsets - chunk.trg_offsets[0]
+        cdef ndarray aligned = np.zeros(offsets[-1], np.int32)
+        cdef ndarray indices, src_sents, trg_sents
+        cdef int len_src, len_trg
+        cdef long i, j, step
+        for len_src, len_trg, indices, src_sents, trg_sents in length_buckets(chunk):
+            step = batch_step(len_src * len_trg)
+            for i in range(0, len(indices), step):
+                j = min(i + step, len(indices))
+                best = self.decode_bucket(len_src, len_trg, src_sents[i:j], trg_sents[i:j])
+                aligned[offsets[indices[i:j]][:,None] + np.arange(len_trg)] = best
+        return aligned
+
+    cdef void decode_and_save_align(self, out_path, ParallelCorpus sent_pairs, bool character_based):
+        cdef long begin, end
+        cdef ndarray aligned
+        cdef list lines
         logger.info("decoding and storing alignment into file: %s"  % (out_path))
         with files.open(out_path, 'wt') as fobj:
-            for i, (src_ids, trg_ids) in enumerate(progress.view(sent_pairs, 'progress')):
-                len_src = len(src_ids)
-                len_trg = len(trg_ids)
-                src_range = list(range(len_src))
-                trg_range = list(range(len_trg))
-                trans_matrix = sub_matrix(self.trans_dist, src_ids, trg_ids)
-                align_matrix = self.align_dist[len_src-2,len_trg-1][:len_trg,:len_src].T
-                align_trans_matrix = align_matrix * trans_matrix
-                align = []
-                #indices = np.where(align_trans_matrix > 0)
-                #for index_src, index_trg in zip(*indices):
-                #    prob = align_trans_matrix[index_src, index_trg]
-                #    if prob > 0.01:
-                #        align.append('{}-{}'.format(index_src,index_trg+1))
-                for index_trg in range(len_trg):
-                    index_src = np.argpartition(-align_trans_matrix[:,index_trg], 1)[0]
-                    prob = align_trans_matrix[index_src, index_trg]
-                    #dprint([index_src, index_trg, prob])
-                    #if prob > 0.01:
-                    #    align.append('{}-{}'.format(index_src,index_trg+1))
-                    align.append('{}-{}'.format(index_trg+1,index_src))
-                record = "{}\n".format(str.join(' ', align))
-                fobj.write(record)
-
-    cdef void save_align_dist(self, out_path, threshold):
-        cdef tuple indices
-        cdef int len_src, len_trg
-        cdef int src, trg
-        cdef float prob
-        cdef str record
-        cdef ndarray[float64_t, ndim=3] max_prob = self.align_dist.max(axis=3)
-        cdef ndarray[float64_t, ndim=3] min_prob = self.align_dist.min(axis=3)
-        cdef ndarray trained = (max_prob != min_prob)
+            for begin, end in progress.view(sent_pairs.chunk_bounds(0, len(sent_pairs), CHUNK_SIZE), 'decoding'):
+                aligned = self.decode(sent_pairs, begin, end)
+                lines = format_alignment(sent_pairs.trg_offsets[begin:end+1] - sent_pairs.trg_offsets[begin], aligned)
+                fobj.write(str.join('', [line + '\n' for line in lines]))
+
+    cdef void save_align_dist(self, out_path, threshold, ndarray counts=None) except *:
+        '''store the alignment distribution (or the parameters of the distortion) into the text file,
+        with the expected counts of the last step if given'''
+        if self.distortion in ('diagonal', 'hmm'):
+            with files.open(out_path, 'wt') as fobj:
+                logger.info("storing alignment parameters into file: %s" % (out_path,))
+                write_distortion_params(fobj, self)
+                if self.distortion == 'hmm':
+                    write_jump_dist(fobj, self.jump_dist, counts)
+            return
         with files.open(out_path, 'wt') as fobj:
             logger.info("storing alignment probabilities into file: %s" % (out_path,))
-            indices = np.where(np.broadcast_to(trained[:,:,:,None], self.align_dist[:].shape))
-            for len_src, len_trg, trg, src in progress.view(zip(*indices), 'storing', max_count=len(indices[0])):
-                prob = self.align_dist[len_src, len_trg, trg, src]
-                if prob > threshold:
-                    record = "%s\t%s\t%s\t%s\t%s\n" % (len_src+1, len_trg+1, trg+1, src, prob)
-                    fobj.write(record)
+            write_align_dist(fobj, self.align_dist, counts, threshold)
+
+    cdef void add_unknown_word(self) except *:
+        '''register the symbol standing for unknown words into both vocabularies,
+        growing translation distribution (by copying) with uniform probabilities for the symbol'''
+        cdef long len_src = len(self.vocab.src)
+        cdef long len_trg = len(self.vocab.trg)
+        cdef long new_src, new_trg
+        cdef double uniform
+        cdef SparseMatrix sparse
+        cdef ndarray dense, rows, cols, keys, data, first
+        self.vocab.src.append(UNKNOWN_SYMBOL)
+        self.vocab.trg.append(UNKNOWN_SYMBOL)
+        new_src = len(self.vocab.src)
+        new_trg = len(self.vocab.trg)
+        if (new_src, new_trg) == (len_src, len_trg):
+            return
+        uniform = 1.0 / new_trg
+        if isinstance(self.trans_dist, SparseMatrix):
+            sparse = self.trans_dist
+            rows = np.concatenate([sparse.row_ids(), np.repeat(np.arange(len_src, new_src), new_trg), np.tile(np.arange(new_src), new_trg - len_trg)])
+            cols = np.concatenate([sparse.col_ids(), np.tile(np.arange(new_trg), new_src - len_src), np.repeat(np.arange(len_trg, new_trg), new_src)])
+            data = np.concatenate([sparse.data, np.full(len(rows) - len(sparse.data), uniform, sparse.data.dtype)])
+            keys, first = np.unique(rows * new_trg + cols, return_index=True)
+            self.trans_dist = SparseMatrix((new_src, new_trg), keys, data[first], dtype=sparse.data.dtype, default_value=sparse.default_value)
+        else:
+            dense = np.full((new_src, new_trg), uniform, self.trans_dist.dtype)
+            dense[:len_src,:len_trg] = self.trans_dist
+            self.trans_dist = dense
+
+    cdef void fit_lengths(self, ParallelCorpus sent_pairs) except *:
+        '''extend alignment distribution for the sentence pairs longer than trained ones (regarded as uniform)'''
+        cdef long max_len_src, max_len_trg
+        if self.distortion != 'absolute' or self.align_dist is None or len(sent_pairs) == 0:
+            return
+        max_len_src, max_len_trg = sent_pairs.max_lengths()
+        if max_len_src - 1 > np.shape(self.align_dist)[0] or max_len_trg > np.shape(self.align_dist)[1]:
+            self.vocab.max_len_src = max(max_len_src, np.shape(self.align_dist)[0] + 1)
+            self.vocab.max_len_trg = max(max_len_trg, np.shape(self.align_dist)[1])
+            self.align_dist = fit_align_dist(self.align_dist, self.vocab.max_len_src, self.vocab.max_len_trg)
+
+    cdef tuple to_arrays(self, dict state=None):
+        '''(arrays, meta data) of vocabularies and distributions to store by save_model'''
+        cdef dict arrays = self.vocab.to_arrays()
+        cdef dict meta = dict(format=MODEL_FORMAT, distortion=self.distortion, tension=self.tension, null_prob=self.null_prob)
+        if state is not None:
+            meta['state'] = state
+        if self.vocab.rare_class:
+            meta['rare_class'] = self.vocab.rare_class
+        cdef SparseMatrix trans_dist
+        if isinstance(self.trans_dist, SparseMatrix):
+            trans_dist = self.trans_dist
+            meta['trans_shape'] = list(trans_dist.shape)
+            meta['trans_default'] = trans_dist.default_value
+            arrays['trans_keys'] = trans_dist.keys
+            arrays['trans_data'] = trans_dist.data
+        else:
+            arrays['trans_dist'] = self.trans_dist
+        if self.distortion == 'absolute' and self.align_dist is not None:
+            arrays['align_dist'] = self.align_dist
+        if self.distortion == 'hmm':
+            arrays['jump_dist'] = self.jump_dist
+        return arrays, meta
+
+    cdef void save_model(self, out_path, dict state=None) except *:
+        '''store vocabularies and distributions into a binary file, which is memory-mapped by load_model
+
+        state of the training (json serializable) is stored as well for checkpoints
+        '''
+        cdef dict arrays, meta
+        arrays, meta = self.to_arrays(state)
+        logger.info("storing model into binary file: %s" % (out_path,))
+        archives.save_arrays(out_path, arrays, meta)
+
+    cdef dict load_model(self, path):
+        '''load model stored by save_model, returns the meta data
+
+        words of the model are registered into the current vocabularies, and the tables
+        are mapped from the file without copying if their ids and sizes are unchanged
+        '''
+        cdef dict arrays, meta
+        cdef ndarray src_map, trg_map
+        cdef ndarray rows, cols, keys, order
+        cdef tuple shape
+        cdef int len_src, len_trg
+        logger.info("loading model file: %s" % (path,))
+        arrays, meta = archives.load_arrays(path)
+        if meta.get('format') != MODEL_FORMAT:
+            raise ValueError("not a model file of IBM models: {}".format(path))
+        self.distortion = meta.get('distortion', DISTORTION)
+        self.tension = meta.get('tension', DIAGONAL_TENSION)
+        self.null_prob = meta.get('null_prob', NULL_PROB)
+        if meta.get('rare_class'):
+            self.vocab.rare_class = meta['rare_class']
+        src_map = self.vocab.src.load_arrays(arrays['src_vocab'], arrays['src_vocab_offsets'])
+        trg_map = self.vocab.trg.load_arrays(arrays['trg_vocab'], arrays['trg_vocab_offsets'])
+        len_src = len(self.vocab.src)
+        len_trg = len(self.vocab.trg)
+        unchanged = (len_src == len(src_map) and len_trg == len(trg_map)
+                     and np.array_equal(src_map, np.arange(len_src)) and np.array_equal(trg_map, np.arange(len_trg)))
+        if 'trans_keys' in arrays:
+            shape = tuple(meta['trans_shape'])
+            if unchanged:
+                self.trans_dist = SparseMatrix(shape, arrays['trans_keys'], arrays['trans_data'], default_value=meta.get('trans_default', 0))
+            else:
+                rows = arrays['trans_keys'] // shape[1]
+                cols = arrays['trans_keys'] % shape[1]
+                keys = src_map[rows] * len_trg + trg_map[cols]
+                order = np.argsort(keys)
+                self.trans_dist = SparseMatrix((len_src, len_trg), keys[order], arrays['trans_data'][order], default_value=meta.get('trans_default', 0))
+        elif unchanged:
+            self.trans_dist = arrays['trans_dist']
+        else:
+            # pairs of unknown words are regarded as uniform, as in loading text files
+            self.trans_dist = np.full([len_src, len_trg], 1.0 / len_trg, arrays['trans_dist'].dtype)
+            self.trans_dist[np.ix_(src_map, trg_map)] = arrays['trans_dist']
+        if 'align_dist' in arrays:
+            if self.vocab.max_len_src > 0:
+                # keeping the distributions of the lengths not appearing in the given corpus
+                self.vocab.max_len_src = max(self.vocab.max_len_src, np.shape(arrays['align_dist'])[0] + 1)
+                self.vocab.max_len_trg = max(self.vocab.max_len_trg, np.shape(arrays['align_dist'])[1])
+            self.align_dist = fit_align_dist(arrays['align_dist'], self.vocab.max_len_src, self.vocab.max_len_trg)
+        if 'jump_dist' in arrays:
+            self.jump_dist = arrays['jump_dist']
+        return meta
 
     cdef void save_trans_dist(self, out_path, threshold, nbest):
-        #cdef tuple indices
-        cdef int src, trg
-        cdef float prob
-        cdef str record
-        cdef list src_indices = list(range(len(self.vocab.src)))
-        cdef list trg_indices = list(range(len(self.vocab.trg)))
         with files.open(out_path, 'wt') as fobj:
             logger.info("storing translation probabilities into file (threshold=%s): %s" % (threshold,out_path))
-            for src in progress.view(src_indices, 'storing'):
-                sorted_trg_prob = sorted(enumerate(self.trans_dist[src]), key = lambda r: -r[1])
-                #if nbest is not None:
-                #    nbest = min(nbest, len(self.vocab.trg))
-                #    trg_indices = list(np.argpartition(-self.trans_dist[src], nbest)[:nbest])
-                #for trg in trg_indices:
-                #    prob = self.trans_dist[src,trg]
-                for trg, prob in sorted_trg_prob[:nbest]:
-                    if prob > threshold:
-                        record = "%s\t%s\t%s\n" % (self.vocab.src.id2str(src), self.vocab.trg.id2str(trg), prob)
-                        fobj.write(record)
+            write_trans_dist(fobj, self, None, 0, threshold, nbest)
 
 cdef class Trainer:
     # imported from "ibm_model1.pxd"
@@ -230,6 +1080,30 @@ cdef class Trainer:
             self.src_path = conf.data.src_path
             self.trg_path = conf.data.trg_path
         self.character_based = conf.get('character', False)
+        self.sparse = conf.get('sparse', False)
+        self.workers = conf.get('workers', 1)
+        self.threads = conf.get('threads', 1)
+        self.shards = conf.get('shards', 1)
+        self.dtype = np.dtype(conf.get('dtype', DTYPE))
+        self.prune_threshold = conf.get('prune_threshold', 0)
+        self.prune_nbest = conf.get('prune_nbest', 0)
+        self.min_count = conf.get('min_count', 0)
+        self.vocab_limit = conf.get('vocab_limit', 0)
+        self.rare_class = conf.get('rare_class', None) or RARE_CLASS
+        self.corpus_cache = conf.get('corpus_cache', None)
+        self.init_model = conf.get('init_model', None)
+        self.checkpoint = conf.get('checkpoint', None)
+        self.resume = conf.get('resume', False)
+        self.batch_size = conf.get('batch_size', BATCH_SIZE)
+        self.step_decay = conf.get('step_decay', STEP_DECAY)
+        self.step_offset = conf.get('step_offset', STEP_OFFSET)
+        if conf.get('stream', False):
+            self.chunk_size = conf.get('chunk_size', CHUNK_SIZE)
+        else:
+            self.chunk_size = 0
+        self.model.distortion = conf.get('distortion', DISTORTION)
+        self.model.tension = conf.get('tension', DIAGONAL_TENSION)
+        self.model.null_prob = conf.get('null_prob', NULL_PROB)
     cdef void init(self) except *:
         raise NotImplementedError()
 
@@ -246,61 +1120,217 @@ cdef class Trainer:
         raise NotImplementedError()
 
     cdef void save_align_dist(self, out_path, threshold) except *:
-        cdef tuple indices
-        cdef int len_src, len_trg
-        cdef int src, trg
-        cdef float prob
-        cdef str record
-        cdef Model model = self.model
-        cdef ndarray[float64_t, ndim=3] max_prob = model.align_dist.max(axis=3)
-        cdef ndarray[float64_t, ndim=3] min_prob = model.align_dist.min(axis=3)
-        cdef ndarray trained = (max_prob != min_prob)
-        with files.open(out_path, 'wt') as fobj:
-            logger.info("storing alignment probabilities into file: %s" % (out_path,))
-            indices = np.where(np.broadcast_to(trained[:,:,:,None], model.align_dist[:].shape))
-            for len_src, len_trg, trg, src in progress.view(zip(*indices), 'storing', max_count=len(indices[0])):
-                prob = model.align_dist[len_src, len_trg, trg, src]
-                count = self.count_align_trg2src[len_src, len_trg, trg, src]
-                if prob > threshold:
-                    record = "%s\t%s\t%s\t%s\t%.8f\t%.2f\n" % (len_src+1, len_trg+1, trg+1, src, prob, count)
-                    fobj.write(record)
+        self.model.save_align_dist(out_path, threshold, self.count_align_trg2src)
 
     cdef void save_trans_dist(self, out_path, threshold, nbest) except *:
-        cdef int src, trg
-        cdef float prob
-        cdef str record
-        cdef Model model = self.model
-        cdef list src_indices = list(range(len(model.vocab.src)))
-        cdef list trg_indices = list(range(len(model.vocab.trg)))
         with files.open(out_path, 'wt') as fobj:
             logger.info("storing translation probabilities into file (threshold=%s): %s" % (threshold,out_path))
-            for src in progress.view(src_indices, 'storing'):
-                sorted_trg_prob = sorted(enumerate(model.trans_dist[src]), key = lambda r: -r[1])
-                #if nbest is not None:
-                #    nbest = min(nbest, len(model.vocab.trg))
-                #    trg_indices = list(np.argpartition(- model.trans_dist[src], nbest)[:nbest])
-                #for trg in trg_indices:
-                #    prob = model.trans_dist[src,trg]
-                for trg, prob in sorted_trg_prob[:nbest]:
-                    if prob > threshold:
-                        count = self.count_cooc_src2trg[src,trg]
-                        record = "%s\t%s\t%.8f\t%.2f\n" % (model.vocab.src.id2str(src), model.vocab.trg.id2str(trg), prob, count)
-                        fobj.write(record)
+            # rows of the distribution start from the first source word owned by this process
+            write_trans_dist(fobj, self.model, self.count_cooc_src2trg, self.owned_range()[0], threshold, nbest)
+
+    cdef tuple owned_range(self):
+        '''range of source word ids [begin, end) held in the translation distribution'''
+        if self.shard is None:
+            return 0, len(self.model.vocab.src)
+        return self.shard.begin, self.shard.end
+
+    cdef void load_corpus(self) except *:
+        cdef str cache_path = self.corpus_cache
+        if self.sent_pairs is None:
+            if self.chunk_size > 0:
+                logger.info("streaming mode: processing {:,d} sentence pairs at once".format(self.chunk_size))
+                if not cache_path:
+                    # temporary packed corpus, removed just after mapped into memory
+                    fd, cache_path = tempfile.mkstemp(prefix='lpu-corpus-', suffix='.bin')
+                    os.close(fd)
+                    os.remove(cache_path)
+            self.sent_pairs = self.model.vocab.load_cached_sent_pairs(self.src_path, self.trg_path, self.character_based, cache_path, self.chunk_size)
+            if cache_path != self.corpus_cache:
+                os.remove(cache_path)
+            if self.min_count > 1 or self.vocab_limit > 0:
+                self.sent_pairs = self.model.vocab.replace_words(
+                    self.sent_pairs,
+                    frequent_words(self.sent_pairs.src_tokens, len(self.model.vocab.src), self.min_count, self.vocab_limit, 1),
+                    frequent_words(self.sent_pairs.trg_tokens, len(self.model.vocab.trg), self.min_count, self.vocab_limit, 0),
+                    self.rare_class,
+                )
+
+    cdef void replace_unknown_words(self, src_buf, src_offsets, trg_buf, trg_offsets, str method) except *:
+        '''replace the words of the corpus not registered in the model vocabularies
+        (stored by StringEnumerator.to_arrays) with their rare word classes'''
+        cdef Vocab vocab = self.model.vocab
+        self.sent_pairs = vocab.replace_words(
+            self.sent_pairs,
+            known_words(vocab.src, src_buf, src_offsets),
+            known_words(vocab.trg, trg_buf, trg_offsets),
+            method,
+        )
+
+    cdef dict load_init_model(self, str path):
+        '''start training from the model saved by save_model, extended for the words of the corpus,
+        returns the meta data of the model'''
+        cdef Model model = self.model
+        cdef dict meta = model.load_model(path)
+        # distributions are updated in place, so the mapped tables are copied
+        if isinstance(model.trans_dist, SparseMatrix):
+            Model1Trainer.init_sparse_trans_dist(<Model1Trainer>self)
+        else:
+            model.trans_dist = np.require(model.trans_dist, requirements=['W'])
+        if model.align_dist is not None:
+            model.align_dist = np.require(model.align_dist, requirements=['W'])
+        if model.jump_dist is not None:
+            model.jump_dist = np.require(model.jump_dist, requirements=['W'])
+        return meta
 
     cdef void setup(self) except *:
         if self.sent_pairs is None:
             logger.info("----")
             logger.info("setting up to train/score IBM Models")
             #logger.debug("self => %r"%self)
-            self.sent_pairs = self.model.vocab.load_sent_pairs(self.src_path, self.trg_path, self.character_based)
+            self.load_corpus()
             logger.info("source vocabulary size: {:,d}".format(len(self.model.vocab.src)))
             logger.info("target vocabulary size: {:,d}".format(len(self.model.vocab.trg)))
             logger.info("max source length: {:,d}".format(self.model.vocab.max_len_src))
             logger.info("max target length: {:,d}".format(self.model.vocab.max_len_trg))
+        if self.model.trans_dist is None:
+            if self.resume and self.checkpoint and os.path.exists(self.checkpoint):
+                logger.info("resuming training from checkpoint: %s" % (self.checkpoint,))
+                self.resumed = self.load_init_model(self.checkpoint).get('state', None)
+            elif self.init_model:
+                self.load_init_model(self.init_model)
 
     cdef void train(self, int iteration_limit) except *:
         raise NotImplementedError()
 
+    cdef tuple resume_state(self, str phase, int iteration_limit):
+        '''(first step, entropy of the last step) to continue given training phase from the checkpoint'''
+        cdef dict state = self.resumed
+        if not state:
+            return 0, np.inf
+        if state['phase'] == phase:
+            logger.info("resuming {} from step: {}".format(phase, state['step'] + 1))
+            return state['step'], state['entropy']
+        if TRAIN_PHASES[state['phase']] > TRAIN_PHASES[phase]:
+            # already finished
+            return iteration_limit, np.inf
+        return 0, np.inf
+
+    cdef void prune_step(self) except *:
+        '''drop the pairs of translation distribution below the threshold or outside the top-n of each source word,
+        turning the distribution into sparse matrix having PRUNED_PROB for the dropped pairs'''
+        cdef Model model = self.model
+        cdef object trans_dist = model.trans_dist
+        cdef SparseMatrix sparse
+        cdef ndarray data, keep, rows, order, ranks
+        cdef long num_entries
+        if self.prune_threshold <= 0 and self.prune_nbest <= 0:
+            return
+        if isinstance(trans_dist, SparseMatrix):
+            sparse = trans_dist
+        else:
+            sparse = SparseMatrix(np.shape(trans_dist), np.arange(np.size(trans_dist)), trans_dist.reshape(-1), dtype=trans_dist.dtype)
+        data = sparse.data
+        num_entries = len(data)
+        keep = np.ones(len(data), np.bool_)
+        if self.prune_threshold > 0:
+            keep &= (data >= self.prune_threshold)
+        if self.prune_nbest > 0:
+            rows = sparse.row_ids()
+            # ranks of the entries in descending order of probability within each row
+            order = np.lexsort((-data, rows))
+            ranks = np.empty(len(data), np.int64)
+            ranks[order] = np.arange(len(data)) - sparse.indptr[rows[order]]
+            keep &= (ranks < self.prune_nbest)
+        model.trans_dist = SparseMatrix(sparse.shape, sparse.keys[keep], data[keep], dtype=data.dtype, default_value=PRUNED_PROB)
+        logger.info("pruned translation distribution: {:,d} -> {:,d} [pairs]".format(num_entries, int(keep.sum())))
+
+    cdef object restrict_stats(self, object stats):
+        '''statistics of the pairs stored in current translation distribution'''
+        cdef object restricted = zeros_like(self.model.trans_dist)
+        cdef SparseMatrix sparse
+        if stats is None or not isinstance(restricted, SparseMatrix):
+            return stats
+        sparse = restricted
+        sparse.data[:] = lookup_entries(stats, sparse.row_ids(), sparse.col_ids())
+        return restricted
+
+    cdef void save_checkpoint(self, dict state) except *:
+        '''store the model with the state of training, to resume from the next step'''
+        if self.checkpoint:
+            self.model.save_model(self.checkpoint, state)
+
+    cdef void train_online(self, int iteration_limit) except *:
+        '''stepwise EM (Liang and Klein, 2009) over mini-batches of sentence pairs
+
+        expected counts of each mini-batch (per sentence pair) are interpolated into
+        running statistics with decaying step size, and the distributions are
+        re-estimated from the statistics after every mini-batch
+        '''
+        cdef ParallelCorpus sent_pairs
+        cdef object stats_cooc = None
+        cdef ndarray stats_align = None
+        cdef object align_params
+        cdef int align_axis = 0
+        cdef long begin, end
+        cdef long num_updates = 0
+        cdef int first_step
+        cdef double rate, total_entropy
+        self.setup()
+        sent_pairs = self.sent_pairs
+        first_step = self.resume_state('online', iteration_limit)[0]
+        if self.resumed and self.resumed['phase'] == 'online':
+            # running statistics are seeded again from the resumed distributions
+            num_updates = self.resumed['updates']
+        if self.length_counts is None:
+            self.length_counts = sent_pairs.length_counts()
+        logger.info("----")
+        logger.info("start online training (batch size: {:,d}, step decay: {}, step offset: {})".format(self.batch_size, self.step_decay, self.step_offset))
+        try:
+            for step in range(first_step, iteration_limit):
+                logger.info("--")
+                logger.info("pass: {} / {}".format(step+1, iteration_limit))
+                total_entropy = 0
+                for begin, end in sent_pairs.chunk_bounds(0, len(sent_pairs), self.batch_size):
+                    self.sent_pairs = sent_pairs.slice(begin, end)
+                    self.length_buckets = None
+                    self.expect_step()
+                    total_entropy += self.entropy * (end - begin)
+                    rate = (num_updates + self.step_offset) ** -self.step_decay
+                    logger.info("mini-batch: [{:,d}, {:,d}) / {:,d}, entropy: {}, step size: {}".format(begin, end, len(sent_pairs), self.entropy, rate))
+                    flat_data(self.count_cooc_src2trg)[:] /= (end - begin)
+                    stats_cooc = interpolate_stats(stats_cooc, self.count_cooc_src2trg, self.model.trans_dist, 1, rate)
+                    self.count_cooc_src2trg = stats_cooc
+                    if self.count_align_trg2src is not None:
+                        if self.model.distortion == 'hmm':
+                            align_params, align_axis = self.model.jump_dist, 0
+                        elif self.model.distortion == 'absolute':
+                            align_params, align_axis = self.model.align_dist, 3
+                        else:
+                            # sufficient statistics of diagonal tension
+                            align_params = None
+                        self.count_align_trg2src /= (end - begin)
+                        stats_align = interpolate_stats(stats_align, self.count_align_trg2src, align_params, align_axis, rate)
+                        self.count_align_trg2src = stats_align
+                    self.maximize_step()
+                    num_updates += 1
+                # entropies are measured just before updating by each mini-batch
+                self.entropy = total_entropy / len(sent_pairs)
+                logger.info("average entropy of pass: {}".format(self.entropy))
+                if self.prune_threshold > 0 or self.prune_nbest > 0:
+                    self.prune_step()
+                    # running statistics follow the pairs left in the distribution
+                    stats_cooc = self.restrict_stats(stats_cooc)
+                self.save_checkpoint(dict(phase='online', step=step+1, entropy=self.entropy, updates=num_updates))
+        finally:
+            self.sent_pairs = sent_pairs
+            self.length_buckets = None
+        # statistics are scaled into expected counts of the whole corpus, to be stored with the distributions
+        if stats_cooc is not None:
+            self.count_cooc_src2trg = zeros_like(stats_cooc)
+            flat_data(self.count_cooc_src2trg)[:] = flat_data(stats_cooc) * len(sent_pairs)
+        if stats_align is not None:
+            self.count_align_trg2src = stats_align * len(sent_pairs)
+
     cdef void train_step(self) except *:
         if len(self.model.trans_dist) == 0:
             self.setup()
@@ -316,6 +1346,20 @@ def check_train_config(conf):
     #if not any [save_trans_path, save_align_path]:
     #    logger.error("At least one of arguments is necessary: --save-trans-path/--save_align_path")
     #    return False
+    if conf.get('shards', 1) > 1:
+        # each shard process trains IBM Model 1/2 from scratch by batch EM in single thread
+        conflicts = [option for option, given in [
+            ('--workers', conf.get('workers', 1) > 1),
+            ('--threads', conf.get('threads', 1) > 1),
+            ('--online', conf.get('online', False)),
+            ('--init-model', conf.get('init_model', None)),
+            ('--checkpoint', conf.get('checkpoint', None)),
+            ('--bidirectional', conf.get('bidirectional', False) or conf.get('save_symmetrized', None)),
+            ('--distortion hmm', conf.get('distortion', DISTORTION) == 'hmm'),
+        ] if given]
+        if conflicts:
+            logger.error("--shards cannot be combined with: {}".format(str.join(', ', conflicts)))
+            return False
     return True
 
 def check_test_config(conf):
@@ -329,23 +1373,30 @@ def check_test_config(conf):
         return False
     return True
 
-cdef HMMTrainer(Trainer):
-    pass
+cdef Trainer create_trainer(conf):
+    distortion = conf.get('distortion', DISTORTION)
+    if conf.get('init_model', None):
+        distortion = detect_distortion(conf.data.init_model, None)
+    if distortion == 'hmm':
+        return HMMTrainer(conf)
+    return Model2Trainer(conf)
 
-def train_ibm_models(conf, **others):
-    conf = Config(conf)
-    conf.update(others)
-    if not check_train_config(conf):
-        return False
-    #trainer = Trainer(conf, **others)
-    #trainer = Model1Trainer(conf, **others)
-    trainer = Model2Trainer(conf, **others)
+cdef void train_and_save(Trainer trainer, conf, str suffix) except *:
+    '''train the models and store the outputs given in conf, adding suffix to their paths'''
     character_based = conf.get('character_based', False)
     try:
         #with np.errstate(all='raise'):
         #    trainer.train(conf.data.iteration_limit)
-        Model1Trainer.train(trainer, conf.data.iteration_limit)
-        Model2Trainer.train(trainer, conf.data.iteration_limit)
+        if conf.get('online', False):
+            trainer.train_online(conf.data.iteration_limit)
+        else:
+            if not trainer.init_model:
+                # Model 1 is used only to initialize the translation distribution
+                Model1Trainer.train(<Model1Trainer>trainer, conf.data.iteration_limit)
+            if isinstance(trainer, HMMTrainer):
+                HMMTrainer.train(<HMMTrainer>trainer, conf.data.iteration_limit)
+            else:
+                Model2Trainer.train(<Model2Trainer>trainer, conf.data.iteration_limit)
     except KeyboardInterrupt as k:
         logger.warning('interuppted by keyboard')
         logger.info("forcing to dump alignments and scores")
@@ -353,27 +1404,253 @@ def train_ibm_models(conf, **others):
         logger.exception(e)
     logger.info("----")
     #trainer.model.save_trans_dist(conf.data.save_trans_path, conf.data.threshold, conf.data.nbest)
-    trainer.save_trans_dist(conf.data.save_trans_path, conf.data.threshold, conf.data.nbest)
+    trainer.save_trans_dist(conf.data.save_trans_path + suffix, conf.data.threshold, conf.data.nbest)
     if conf.data.save_align_path:
         #trainer.model.save_align_dist(conf.data.save_align_path, conf.data.threshold)
-        trainer.save_align_dist(conf.data.save_align_path, conf.data.threshold)
+        trainer.save_align_dist(conf.data.save_align_path + suffix, conf.data.threshold)
+    if conf.get('save_model', None):
+        trainer.model.save_model(conf.data.save_model + suffix)
     if conf.data.save_scores:
-        trainer.model.calc_and_save_scores(conf.data.save_scores, trainer.sent_pairs, character_based)
+        trainer.model.calc_and_save_scores(conf.data.save_scores + suffix, trainer.sent_pairs, character_based, trainer.workers)
     if conf.data.decode_align:
-        trainer.model.decode_and_save_align(conf.data.decode_align, trainer.sent_pairs, character_based)
+        trainer.model.decode_and_save_align(conf.data.decode_align + suffix, trainer.sent_pairs, character_based)
     logger.info("----")
+
+cdef void decode_into(Model model, ParallelCorpus sent_pairs, ndarray aligned) except *:
+    '''store Viterbi alignment of all the sentence pairs into flat array (as given by Model.decode)'''
+    cdef long begin, end
+    for begin, end in sent_pairs.chunk_bounds(0, len(sent_pairs), CHUNK_SIZE):
+        aligned[sent_pairs.trg_offsets[begin]:sent_pairs.trg_offsets[end]] = model.decode(sent_pairs, begin, end)
+
+def _train_reverse(Trainer trainer, conf, ndarray aligned):
+    # running in forked process, sharing the corpus loaded by the parent
+    train_and_save(trainer, conf, REVERSE_SUFFIX)
+    decode_into(trainer.model, trainer.sent_pairs, aligned)
+
+cdef bool train_bidirectional(Trainer trainer, conf) except *:
+    '''train both directions concurrently in two processes over the corpus loaded once,
+    and symmetrize the Viterbi alignments of them'''
+    cdef Trainer reverse_trainer = create_trainer(conf)
+    cdef ParallelCorpus sent_pairs
+    cdef ndarray src_map, trg_map, src_lengths, trg_lengths
+    cdef ndarray forward_align, reverse_align
+    cdef str method = conf.get('symmetrize', SYMMETRIZE_METHOD)
+    cdef AlignPoints points
+    trainer.setup()
+    sent_pairs = trainer.sent_pairs
+    reverse_trainer.model.vocab, src_map, trg_map = trainer.model.vocab.reverse()
+    # reversed corpus is held in memory even in streaming mode
+    reverse_trainer.sent_pairs = reverse_sent_pairs(sent_pairs, src_map, trg_map)
+    reverse_trainer.model.vocab.set_max_lengths(reverse_trainer.sent_pairs)
+    if reverse_trainer.init_model:
+        # reverse model saved by bidirectional training
+        reverse_trainer.init_model += REVERSE_SUFFIX
+    if reverse_trainer.checkpoint:
+        reverse_trainer.checkpoint += REVERSE_SUFFIX
+    reverse_align = shared_zeros_like(np.zeros(len(reverse_trainer.sent_pairs.trg_tokens), np.int32))
+    logger.info("training reverse direction in another process, storing outputs with suffix: %s" % (REVERSE_SUFFIX,))
+    context = multiprocessing.get_context('fork')
+    proc = context.Process(target=_train_reverse, args=(reverse_trainer, conf, reverse_align))
+    proc.start()
+    try:
+        train_and_save(trainer, conf, '')
+        if conf.get('save_symmetrized', None):
+            forward_align = np.zeros(len(sent_pairs.trg_tokens), np.int32)
+            decode_into(trainer.model, sent_pairs, forward_align)
+    finally:
+        proc.join()
+    if proc.exitcode != 0:
+        raise RuntimeError("training process of reverse direction failed")
+    if conf.get('save_symmetrized', None):
+        logger.info("symmetrizing alignments (%s) into file: %s" % (method, conf.data.save_symmetrized))
+        src_lengths = sent_pairs.src_lengths() - 1
+        trg_lengths = sent_pairs.trg_lengths()
+        points = AlignPoints(src_lengths, trg_lengths)
+        keys = symmetrize(src_lengths, trg_lengths, forward_align, reverse_align, method, points)
+        with files.open(conf.data.save_symmetrized, 'wt') as fobj:
+            for line in points.format_lines(keys):
+                fobj.write(line + '\n')
+    return True
+
+cdef ndarray source_weights(Trainer trainer):
+    '''weight of each source word to balance the shards: number of the co-occurring word pairs
+    (upper bound of the pairs held in sparse distribution), or 1 for dense distribution'''
+    cdef ParallelCorpus sent_pairs = trainer.sent_pairs
+    cdef long len_src = len(trainer.model.vocab.src)
+    cdef ndarray weights = np.zeros(len_src, np.float64)
+    cdef long begin, end
+    if not trainer.sparse:
+        return np.ones(len_src, np.float64)
+    for begin, end in sent_pairs.chunk_bounds(0, len(sent_pairs), SCAN_CHUNK):
+        tokens = sent_pairs.src_tokens[sent_pairs.src_offsets[begin]:sent_pairs.src_offsets[end]]
+        weights += np.bincount(tokens, np.repeat(sent_pairs.trg_lengths()[begin:end], sent_pairs.src_lengths()[begin:end]), minlength=len_src)
+    return weights
+
+def _train_shard(Trainer trainer, conf, Shard shard, str work_dir):
+    # running in forked process, sharing the corpus loaded by the parent
+    cdef str part_path = os.path.join(work_dir, str(shard.rank))
+    cdef long len_trg = len(trainer.model.vocab.trg)
+    cdef object trans_dist
+    cdef dict arrays, meta
+    trainer.shard = shard
+    if shard.rank > 0:
+        # the first shard shows the progress on behalf of all
+        os.environ['QUIET'] = '1'
+        logging.disable(logging.INFO)
+    try:
+        Model1Trainer.train(<Model1Trainer>trainer, conf.data.iteration_limit)
+        Model2Trainer.train(<Model2Trainer>trainer, conf.data.iteration_limit)
+    except BaseException:
+        shard.abort()
+        raise
+    trainer.save_trans_dist(part_path + '.trans', conf.data.threshold, conf.data.nbest)
+    trans_dist = trainer.model.trans_dist
+    if isinstance(trans_dist, SparseMatrix):
+        # keys of the rows in the whole vocabulary
+        ((<SparseMatrix>trans_dist).keys + shard.begin * len_trg).tofile(part_path + '.keys')
+        (<SparseMatrix>trans_dist).data.tofile(part_path + '.data')
+    else:
+        np.ascontiguousarray(trans_dist).tofile(part_path + '.dist')
+    if shard.rank == 0:
+        # distributions other than translation are the same in all the shards
+        if conf.data.save_align_path:
+            trainer.save_align_dist(conf.data.save_align_path, conf.data.threshold)
+        arrays, meta = trainer.model.to_arrays()
+        for name in ['trans_dist', 'trans_keys', 'trans_data']:
+            arrays.pop(name, None)
+        archives.save_arrays(os.path.join(work_dir, 'common.bin'), arrays, meta)
+
+cdef bool train_sharded(Trainer trainer, conf) except *:
+    '''train IBM Model 1 and 2 with the source vocabulary sharded into processes (model parallelism)
+
+    each process holds only the rows of translation distribution (and expected counts) of its
+    source words, exchanging the partial normalizers of target tokens in the expectation steps,
+    and the rows are merged into the outputs after the training
+    '''
+    cdef ParallelCorpus sent_pairs
+    cdef ndarray bounds
+    cdef list shards, procs, part_paths
+    cdef str work_dir, model_path
+    cdef dict arrays, meta
+    cdef Model model
+    cdef long len_src, len_trg
+    character_based = conf.get('character_based', False)
+    # the options not supported by the shards are rejected by check_train_config
+    Trainer.setup(trainer)
+    sent_pairs = trainer.sent_pairs
+    len_src = len(trainer.model.vocab.src)
+    len_trg = len(trainer.model.vocab.trg)
+    bounds = vocab_bounds(source_weights(trainer), trainer.shards)
+    logger.info("sharding source vocabulary into {} processes: {}".format(trainer.shards, bounds.tolist()))
+    if trainer.chunk_size <= 0:
+        # grouped before forking, to share them between the processes
+        logger.info('grouping sentence pairs by their lengths')
+        trainer.length_buckets = length_buckets(sent_pairs)
+    shards = create_shards(bounds)
+    work_dir = tempfile.mkdtemp(prefix='lpu-shards-')
+    try:
+        context = multiprocessing.get_context('fork')
+        procs = [context.Process(target=_train_shard, args=(trainer, conf, shard, work_dir)) for shard in shards]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        if any([proc.exitcode != 0 for proc in procs]):
+            raise RuntimeError("training process of vocabulary shard failed")
+        logger.info("----")
+        part_paths = [os.path.join(work_dir, str(rank)) for rank in range(len(shards))]
+        with files.open(conf.data.save_trans_path, 'wt') as fobj:
+            logger.info("merging translation probabilities of the shards into file: %s" % (conf.data.save_trans_path,))
+            for part_path in part_paths:
+                with open(part_path + '.trans', 'rt') as part_fobj:
+                    shutil.copyfileobj(part_fobj, fobj)
+        arrays, meta = archives.load_arrays(os.path.join(work_dir, 'common.bin'))
+        if 'trans_shape' in meta:
+            meta['trans_shape'] = [len_src, len_trg]
+            arrays['trans_keys'] = archives.RawArrayFile([path + '.keys' for path in part_paths], np.int64)
+            arrays['trans_data'] = archives.RawArrayFile([path + '.data' for path in part_paths], trainer.dtype)
+        else:
+            arrays['trans_dist'] = archives.RawArrayFile([path + '.dist' for path in part_paths], trainer.dtype, (len_src, len_trg))
+        model_path = conf.get('save_model', None) or os.path.join(work_dir, 'model.bin')
+        logger.info("merging model of the shards into binary file: %s" % (model_path,))
+        archives.save_arrays(model_path, arrays, meta)
+        if conf.data.save_scores or conf.data.decode_align:
+            model = load_model_file(model_path)
+            if conf.data.save_scores:
+                model.calc_and_save_scores(conf.data.save_scores, sent_pairs, character_based)
+            if conf.data.decode_align:
+                model.decode_and_save_align(conf.data.decode_align, sent_pairs, character_based)
+        logger.info("----")
+    finally:
+        shutil.rmtree(work_dir)
+    return True
+
+def train_ibm_models(conf, **others):
+    cdef Trainer trainer
+    conf = Config(conf)
+    conf.update(others)
+    if not check_train_config(conf):
+        return False
+    #trainer = Trainer(conf, **others)
+    #trainer = Model1Trainer(conf, **others)
+    trainer = create_trainer(conf)
+    if trainer.shards > 1:
+        return train_sharded(trainer, conf)
+    if conf.get('bidirectional', False) or conf.get('save_symmetrized', None):
+        return train_bidirectional(trainer, conf)
+    train_and_save(trainer, conf, '')
     return True
 
+def detect_distortion(trans_path, align_path):
+    '''distortion type of the model to load, written in binary model or alignment distribution file'''
+    if archives.is_archive(trans_path):
+        return archives.load_arrays(trans_path)[1].get('distortion', DISTORTION)
+    if align_path is not None:
+        return read_distortion_params(align_path).get('distortion', DISTORTION)
+    return DISTORTION
+
 def score_ibm_model(conf, **others):
+    cdef Trainer trainer
     conf = Config(conf)
     conf.update(others)
     if not check_test_config(conf):
         return False
     #trainer = Trainer(conf, **others)
-    trainer = Model2Trainer(conf, **others)
+    if detect_distortion(conf.data.trans_path, conf.data.align_path) == 'hmm':
+        trainer = HMMTrainer(conf, **others)
+    else:
+        trainer = Model2Trainer(conf, **others)
     character_based = conf.get('character', False)
     try:
-        sent_pairs = trainer.model.vocab.load_sent_pairs(conf.data.src_path, conf.data.trg_path, character_based)
+        trainer.load_corpus()
+        sent_pairs = trainer.sent_pairs
+        if archives.is_archive(conf.data.trans_path):
+            # binary model containing both of the distributions
+            arrays, meta = archives.load_arrays(conf.data.trans_path)
+            if meta.get('rare_class'):
+                trainer.replace_unknown_words(arrays['src_vocab'], arrays['src_vocab_offsets'], arrays['trg_vocab'], arrays['trg_vocab_offsets'], meta['rare_class'])
+                sent_pairs = trainer.sent_pairs
+            trainer.model.load_model(conf.data.trans_path)
+            trainer.setup()
+            if conf.data.save_scores:
+                trainer.model.calc_and_save_scores(conf.data.save_scores, sent_pairs, character_based, trainer.workers)
+            if conf.data.decode_align:
+                trainer.model.decode_and_save_align(conf.data.decode_align, sent_pairs, character_based)
+            return True
+        if conf.get('rare_class', None):
+            # words of the model are given by the text file of translation distribution
+            src_known, trg_known = StringEnumerator(), StringEnumerator()
+            src_known.append(NULL_SYMBOL)
+            with open(conf.data.trans_path) as fobj:
+                for line in fobj:
+                    fields = line.strip().split('\t')
+                    if len(fields) in (3, 4):
+                        src_known.append(fields[0])
+                        trg_known.append(fields[1])
+            src_buf, src_offsets = src_known.to_arrays()
+            trg_buf, trg_offsets = trg_known.to_arrays()
+            trainer.replace_unknown_words(src_buf, src_offsets, trg_buf, trg_offsets, conf.data.rare_class)
+            sent_pairs = trainer.sent_pairs
         with open(conf.data.trans_path) as fobj:
             for line in fobj:
                 fields = line.strip().split('\t')
@@ -385,35 +1662,42 @@ def score_ibm_model(conf, **others):
                     src, trg, prob, count = fields
                     trainer.model.vocab.src.str2id(src)
                     trainer.model.vocab.trg.str2id(trg)
+        if conf.data.align_path is not None:
+            params = read_distortion_params(conf.data.align_path)
+            if params:
+                trainer.model.distortion = params.get('distortion', DISTORTION)
+                trainer.model.tension = float(params.get('tension', DIAGONAL_TENSION))
+                trainer.model.null_prob = float(params.get('null_prob', NULL_PROB))
         #trainer.model.trans_dist = trainer.init_trans_dist()
         trainer.setup()
         logger.info("loading word translation distribution file: {}".format(conf.data.trans_path))
+        src_ids, trg_ids, probs = [], [], []
         with progress.view(conf.data.trans_path) as fobj:
             for line in fobj:
                 fields = line.strip().split('\t')
-                if len(fields) == 3:
-                    src, trg, prob = fields
-                    src = trainer.model.vocab.src.str2id(src)
-                    trg = trainer.model.vocab.trg.str2id(trg)
-                    prob = float(prob)
-                    trainer.model.trans_dist[src,trg] = prob
-                elif len(fields) == 4:
-                    src, trg, prob, count = fields
-                    src = trainer.model.vocab.src.str2id(src)
-                    trg = trainer.model.vocab.trg.str2id(trg)
-                    prob = float(prob)
-                    trainer.model.trans_dist[src,trg] = prob
-        if conf.data.align_path is not None:
+                if len(fields) in (3, 4):
+                    src, trg, prob = fields[0:3]
+                    src_ids.append(trainer.model.vocab.src.str2id(src))
+                    trg_ids.append(trainer.model.vocab.trg.str2id(trg))
+                    probs.append(float(prob))
+        set_entries(trainer.model.trans_dist, src_ids, trg_ids, probs)
+        if conf.data.align_path is not None and trainer.model.distortion == 'absolute':
             logger.info("loading alignment distribution file: {}".format(conf.data.align_path))
             with progress.view(conf.data.align_path) as fobj:
                 for line in fobj:
                     fields = line.strip().split('\t')
-                    if len(fields) == 5:
+                    if len(fields) in (5, 6):
                         len_src, len_trg, pos_trg, pos_src = [int(index) for index in fields[0:4]]
                         prob = float(fields[4])
+                        if len_src-1 >= np.shape(trainer.model.align_dist)[0] or len_trg > np.shape(trainer.model.align_dist)[1]:
+                            # lengths not appearing in the given corpus
+                            continue
                         trainer.model.align_dist[len_src-1,len_trg-1,pos_trg-1,pos_src] = prob
+        if conf.data.align_path is not None and trainer.model.distortion == 'hmm':
+            logger.info("loading jump width distribution file: {}".format(conf.data.align_path))
+            read_jump_dist(conf.data.align_path, trainer.model.jump_dist)
         if conf.data.save_scores:
-            trainer.model.calc_and_save_scores(conf.data.save_scores, sent_pairs, character_based)
+            trainer.model.calc_and_save_scores(conf.data.save_scores, sent_pairs, character_based, trainer.workers)
         if conf.data.decode_align:
             trainer.model.decode_and_save_align(conf.data.decode_align, sent_pairs, character_based)
     except KeyboardInterrupt as k:
@@ -422,6 +1706,132 @@ def score_ibm_model(conf, **others):
         logger.exception(e)
     return True
 
+cpdef Model load_model_file(str path):
+    '''load binary model saved by --save-model to align given sentence pairs in memory'''
+    cdef Model model
+    if detect_distortion(path, None) == 'hmm':
+        model = HMMModel()
+    else:
+        model = Model2()
+    model.load_model(path)
+    if model.align_dist is not None:
+        model.vocab.max_len_src = np.shape(model.align_dist)[0] + 1
+        model.vocab.max_len_trg = np.shape(model.align_dist)[1]
+    model.add_unknown_word()
+    return model
+
+cdef list process_lines(Model model, list lines, str output, bool character_based, object lock):
+    '''output lines of the service for given lines of "src<TAB>trg"'''
+    cdef list src_lines = []
+    cdef list trg_lines = []
+    cdef list scores = None
+    cdef list aligns = None
+    cdef ParallelCorpus sent_pairs
+    for line in lines:
+        fields = line.split('\t', 1)
+        src_lines.append(fields[0])
+        trg_lines.append(fields[1] if len(fields) > 1 else '')
+    # words are looked up without registering them, so the vocabularies are only read
+    sent_pairs = model.vocab.encode_sent_pairs(src_lines, trg_lines, character_based)
+    with lock:
+        # extending alignment distribution is the only change of the shared model,
+        # replacing it with larger one keeping the entries read by the other threads
+        model.fit_lengths(sent_pairs)
+    if output != 'align':
+        scores = model.calc_scores(sent_pairs, 0, len(sent_pairs)).tolist()
+    if output != 'score':
+        aligns = format_alignment(sent_pairs.trg_offsets, model.decode(sent_pairs, 0, len(sent_pairs)))
+    if output == 'score':
+        return ['{}'.format(entropy) for entropy in scores]
+    elif output == 'align':
+        return aligns
+    return ['{}\t{}'.format(entropy, align) for entropy, align in zip(scores, aligns)]
+
+cpdef void serve_stream(Model model, object reader, object writer, str output, bool character_based, long batch_size, object lock) except *:
+    '''line protocol of the service: each line "src<TAB>trg" is answered by a line of the score and/or the alignment,
+    in the same order and in batches of at most batch_size lines; an empty line ends a request,
+    answered by an empty line after the results of the pending lines'''
+    cdef list lines = []
+    cdef str line
+    for line in reader:
+        line = line.rstrip('\n')
+        if line:
+            lines.append(line)
+            if len(lines) < batch_size:
+                continue
+        if lines:
+            writer.write(str.join('', [result + '\n' for result in process_lines(model, lines, output, character_based, lock)]))
+            lines = []
+        if not line:
+            writer.write('\n')
+        writer.flush()
+    if lines:
+        writer.write(str.join('', [result + '\n' for result in process_lines(model, lines, output, character_based, lock)]))
+        writer.flush()
+
+class AlignRequestHandler(socketserver.StreamRequestHandler):
+    '''handler of a client connected to the service, talking the line protocol of serve_stream'''
+    def handle(self):
+        reader = io.TextIOWrapper(self.rfile, encoding='utf-8')
+        writer = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+        server = self.server
+        serve_stream(server.model, reader, writer, server.output, server.character_based, server.batch_size, server.lock)
+
+def serve_ibm_model(conf, **others):
+    '''resident service loading the model once and aligning sentence pairs given by stdin or socket connections'''
+    cdef Model model
+    conf = Config(conf)
+    conf.update(others)
+    output = conf.get('output', SERVE_OUTPUT)
+    character_based = conf.get('character', False)
+    batch_size = conf.get('batch_size', SERVE_BATCH)
+    listen = conf.get('listen', None)
+    model = load_model_file(conf.data.model_path)
+    lock = threading.Lock()
+    if not listen:
+        logger.info("serving on stdin/stdout")
+        serve_stream(model, sys.stdin, sys.stdout, output, character_based, batch_size, lock)
+        return True
+    if ':' in listen:
+        host, port = listen.rsplit(':', 1)
+        server = socketserver.ThreadingTCPServer((host, int(port)), AlignRequestHandler, bind_and_activate=False)
+        server.allow_reuse_address = True
+        server.server_bind()
+        server.server_activate()
+    else:
+        if os.path.exists(listen):
+            # socket file left by the service killed before
+            os.remove(listen)
+        server = socketserver.ThreadingUnixStreamServer(listen, AlignRequestHandler)
+    server.daemon_threads = True
+    server.model, server.output, server.character_based, server.batch_size, server.lock = model, output, character_based, batch_size, lock
+    logger.info("serving on socket: %s" % (listen,))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt as k:
+        logger.info("stopped by keyboard")
+    finally:
+        server.server_close()
+        if ':' not in listen and os.path.exists(listen):
+            os.remove(listen)
+    return True
+
+def export_ibm_model(conf, **others):
+    '''export binary model into text files of translation and alignment distributions'''
+    cdef Model model = Model2()
+    conf = Config(conf)
+    conf.update(others)
+    try:
+        model.load_model(conf.data.model_path)
+        model.save_trans_dist(conf.data.trans_path, conf.data.threshold, conf.data.nbest)
+        if conf.data.align_path:
+            model.save_align_dist(conf.data.align_path, conf.data.threshold)
+    except KeyboardInterrupt as k:
+        logger.exception(k)
+    except Exception as e:
+        logger.exception(e)
+    return True
+
 def create_train_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('src_path', metavar='src_path (in)', help='file containing source-side lines of parallel text', type=str)
@@ -433,10 +1843,37 @@ def create_train_parser():
     #parser.add_argument('--save-align-path', help='output file to save alignment probabilities', type=str)
     parser.add_argument('--save-scores', '--scores', '-s', help='output file to save entropy of each alignment', type=str, default=None)
     parser.add_argument('--decode-align', '--decode', '-d', help='output file to save decoded alignment each alignment', type=str, default=None)
+    parser.add_argument('--save-model', '-m', help='output file to save whole model in binary form (loadable by lpu-word-align-score in place of trans_path)', type=str, default=None)
+    parser.add_argument('--bidirectional', '-b', help='train the reverse direction as well in another process, storing its outputs with suffix "%s"' % (REVERSE_SUFFIX,), action='store_true')
+    parser.add_argument('--save-symmetrized', '--symmetrized', help='output file to save alignment symmetrized from both directions (implies --bidirectional)', type=str, default=None)
+    parser.add_argument('--symmetrize', help='heuristic to symmetrize alignments (default: %(default)s)', choices=SYMMETRIZE_METHODS, default=SYMMETRIZE_METHOD)
+    parser.add_argument('--init-model', help='binary model saved by --save-model to start training from (instead of uniform distributions)', type=str, default=None)
+    parser.add_argument('--checkpoint', help='binary file to store the model and the state of training after each EM step (or each pass in online mode)', type=str, default=None)
+    parser.add_argument('--resume', help='resume training from the checkpoint file if it exists', action='store_true')
+    parser.add_argument('--online', help='online (stepwise) EM mode, updating the distributions after each mini-batch (iteration limit is the number of passes)', action='store_true')
+    parser.add_argument('--batch-size', help='number of sentence pairs of each mini-batch in online mode (default: %(default)s)', type=int, default=BATCH_SIZE)
+    parser.add_argument('--step-decay', help='decay rate of step size in online mode, in range (0.5, 1] (default: %(default)s)', type=float, default=STEP_DECAY)
+    parser.add_argument('--step-offset', help='offset of update count giving step size (k + offset) ** -decay in online mode (default: %(default)s)', type=float, default=STEP_OFFSET)
     parser.add_argument('--iteration-limit', '-I', help='maximum iteration number of EM algorithm (default: %(default)s)', type=int, default=ITERATION_LIMIT)
     parser.add_argument('--threshold', '-t', help='threshold of translation distribution to save', type=float, default=THRESHOLD)
     parser.add_argument('--nbest', '-n', help='limit number of records to save, taking top-n of "p(trg|src)"', type=int, default=NBEST)
+    parser.add_argument('--workers', '-w', help='number of processes to compute expectation step (default: %(default)s)', type=int, default=1)
+    parser.add_argument('--threads', help='number of threads to compute expectation step of IBM Model 1/2 in each process (default: %(default)s)', type=int, default=1)
+    parser.add_argument('--shards', help='number of processes holding the translation distribution split by source words, to train models larger than memory of single process (default: %(default)s)', type=int, default=1)
+    parser.add_argument('--prune-threshold', help='drop word pairs of translation distribution below the threshold after each EM step (default: not pruned)', type=float, default=0)
+    parser.add_argument('--prune-nbest', help='keep only top-n target words for each source word after each EM step (default: not pruned)', type=int, default=0)
+    parser.add_argument('--min-count', help='replace the words appearing less than given times with their rare word classes (default: not replaced)', type=int, default=0)
+    parser.add_argument('--vocab-limit', help='replace the words outside the top-n frequent ones with their rare word classes (default: not replaced)', type=int, default=0)
+    parser.add_argument('--rare-class', help='classes replacing the rare words (default: %(default)s)', choices=RARE_CLASSES, default=RARE_CLASS)
+    parser.add_argument('--dtype', help='floating point type of the distributions, float32 halves the memory (default: %(default)s)', choices=DTYPES, default=DTYPE)
+    parser.add_argument('--distortion', help='parameterization of alignment distribution (default: %(default)s)', choices=DISTORTION_TYPES, default=DISTORTION)
+    parser.add_argument('--tension', help='initial tension of diagonal distortion (default: %(default)s)', type=float, default=DIAGONAL_TENSION)
+    parser.add_argument('--null-prob', help='probability of NULL alignment in diagonal distortion (default: %(default)s)', type=float, default=NULL_PROB)
     parser.add_argument('--character', '-c', help='chacacter based alignment mode', action='store_true')
+    parser.add_argument('--sparse', help='store translation distribution only for co-occurring word pairs', action='store_true')
+    parser.add_argument('--corpus-cache', help='binary file to cache (or load cached) packed corpus and vocabularies', type=str, default=None)
+    parser.add_argument('--stream', help='streaming mode, processing memory-mapped corpus chunk by chunk instead of holding it in memory', action='store_true')
+    parser.add_argument('--chunk-size', help='number of sentence pairs processed at once in streaming mode (default: %(default)s)', type=int, default=CHUNK_SIZE)
     parser.add_argument('--debug', '-D', help='debug mode', action='store_true')
     parser.add_argument('--quiet', '-q', help='not showing staging log', action='store_true')
     return parser
@@ -445,12 +1882,39 @@ def create_score_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('src_path', metavar='src_path (in)', help='file containing source-side lines of parallel text', type=str)
     parser.add_argument('trg_path', help='file containing target-side lines of parallel text', type=str)
-    parser.add_argument('trans_path', help='path to load trained translation probabilities', type=str)
+    parser.add_argument('trans_path', help='path to load trained translation probabilities (or binary model saved by --save-model)', type=str)
     parser.add_argument('align_path', help='path to load trained alignment probabilities', type=str, nargs='?')
     #parser.add_argument('score_path', help='output file to save entropy of each each alignment', type=str)
     parser.add_argument('--save-scores', '--scores', '-s', help='output file to save entropy of each alignment', type=str, default=None)
     parser.add_argument('--decode-align', '--decode', '-d', help='output file to save decoded alignment each alignment', type=str, default=None)
     parser.add_argument('--character', '-c', help='chacacter based alignment mode', action='store_true')
+    parser.add_argument('--sparse', help='store translation distribution only for co-occurring word pairs', action='store_true')
+    parser.add_argument('--workers', '-w', help='number of processes to calculate scores (default: %(default)s)', type=int, default=1)
+    parser.add_argument('--rare-class', help='classes replacing the words unknown to the text model trained with --min-count or --vocab-limit (given by binary model)', choices=RARE_CLASSES, default=None)
+    parser.add_argument('--corpus-cache', help='binary file to cache (or load cached) packed corpus and vocabularies', type=str, default=None)
+    parser.add_argument('--stream', help='streaming mode, processing memory-mapped corpus chunk by chunk instead of holding it in memory', action='store_true')
+    parser.add_argument('--debug', '-D', help='debug mode', action='store_true')
+    parser.add_argument('--quiet', '-q', help='not showing staging log', action='store_true')
+    return parser
+
+def create_export_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_path', help='binary model file saved by lpu-word-align-train --save-model', type=str)
+    parser.add_argument('trans_path', help='output file to save translation probabilities', type=str)
+    parser.add_argument('align_path', help='output file to save alignment probabilities', type=str, nargs='?')
+    parser.add_argument('--threshold', '-t', help='threshold of translation distribution to save', type=float, default=THRESHOLD)
+    parser.add_argument('--nbest', '-n', help='limit number of records to save, taking top-n of "p(trg|src)"', type=int, default=NBEST)
+    parser.add_argument('--debug', '-D', help='debug mode', action='store_true')
+    parser.add_argument('--quiet', '-q', help='not showing staging log', action='store_true')
+    return parser
+
+def create_serve_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_path', help='binary model file saved by lpu-word-align-train --save-model', type=str)
+    parser.add_argument('--listen', '-l', help='address to listen, "host:port" for TCP or path of Unix domain socket (default: stdin/stdout)', type=str, default=None)
+    parser.add_argument('--output', '-o', help='output for each sentence pair (default: %(default)s)', choices=SERVE_OUTPUTS, default=SERVE_OUTPUT)
+    parser.add_argument('--batch-size', help='maximum number of lines processed at once (default: %(default)s)', type=int, default=SERVE_BATCH)
+    parser.add_argument('--character', '-c', help='chacacter based alignment mode', action='store_true')
     parser.add_argument('--debug', '-D', help='debug mode', action='store_true')
     parser.add_argument('--quiet', '-q', help='not showing staging log', action='store_true')
     return parser
@@ -492,6 +1956,12 @@ def main_train():
 def main_score():
     return score_model(create_score_parser(), score_ibm_model)
 
+def main_export():
+    return score_model(create_export_parser(), export_ibm_model)
+
+def main_serve():
+    return score_model(create_serve_parser(), serve_ibm_model)
+
 if __name__ == '__main__':
     main_train()
 
@@ -0,0 +1,13 @@
+
+# C++ set-up
+from libcpp cimport bool
+
+# 3-rd party library
+cimport numpy as np
+from numpy cimport ndarray
+
+# local
+from . ibm_models cimport Trainer
+
+cdef void expect_model1_threads(Trainer trainer, long begin, long end, ndarray count_cooc, ndarray count_align, ndarray entropy, bool verbose) except *
+cdef void expect_model2_threads(Trainer trainer, long begin, long end, ndarray count_cooc, ndarray count_align, ndarray entropy, bool verbose) except *
@@ -0,0 +1,464 @@
+# distutils: language=c++
+# cython: boundscheck=False, wraparound=False, cdivision=True
+# distutils: extra_compile_args=-fopenmp
+# distutils: extra_link_args=-fopenmp
+# -*- coding: utf-8 -*-
+
+'''expectation kernels of IBM Model 1 and 2 running in threads without GIL (OpenMP)
+
+sentence pairs are split between the threads, writing the expected counts of their word pairs
+into a scratch of the batch (bounded by BATCH_PAIRS, not by the size of the distribution),
+and the scratch is added into the counts by the threads each owning a range of the positions,
+so neither the distributions nor the counts are copied for the threads
+'''
+
+# C++ set-up
+from libcpp cimport bool
+from libcpp.algorithm cimport sort
+from libcpp.utility cimport pair
+
+# 3-rd party library
+import numpy as np
+cimport numpy as np
+from numpy cimport ndarray
+from numpy cimport int64_t
+from cython.parallel cimport prange
+from cython.parallel cimport threadid
+from libc.math cimport exp
+from libc.math cimport fabs
+from libc.math cimport log
+
+# Local libraries
+from lpu.common import progress
+from lpu.common import logging
+
+from . ibm_models cimport Trainer
+from . ibm_models cimport batch_bounds
+from . ibm_models cimport flat_data
+from . corpus cimport ParallelCorpus
+from . sparse cimport SparseMatrix
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+ctypedef fused real:
+    float
+    double
+
+# expected count of a word pair at its position in the flattened storage of the distribution
+# (position -1 for the pairs not to be counted)
+ctypedef pair[int64_t, double] Entry
+ENTRY_DTYPE = np.dtype([('position', np.int64), ('count', np.float64)])
+
+cdef struct Corpus:
+    const int *src_tokens
+    const int64_t *src_offsets
+    const int *trg_tokens
+    const int64_t *trg_offsets
+
+cdef struct Index:
+    # row pointers and sorted keys of sparse matrix (NULL for dense matrix)
+    const int64_t *indptr
+    const int64_t *keys
+    long num_trg
+    double default_value
+
+cdef struct Buffers:
+    int num_threads
+    # expected counts of the word pairs of the current batch, at the offsets of their sentences
+    Entry *entries
+    # the same entries grouped by the threads owning their positions
+    Entry *grouped
+    # numbers of the entries of each (chunk of the scratch, owner thread), and the offsets to write them into the grouped entries
+    int64_t *chunk_counts
+    int64_t *chunk_offsets
+    # offsets of the grouped entries of each owner thread
+    int64_t *owner_offsets
+    # size of the distribution, split into the ranges of the owner threads
+    long size
+    # positions and probabilities of the source words for the current target word
+    long *positions
+    double *probs
+    long max_len_src
+    # alignment probabilities of the current length bucket, and expected counts of each thread
+    double *align
+    double *align_counts
+    long align_size
+    # sufficient statistics of diagonal distortion of each thread
+    double *diagonal
+    double *entropy
+
+cdef inline long find_position(Index index, long src, long trg) nogil:
+    '''position of (src, trg) in the flattened storage, or -1 if not registered in sparse matrix'''
+    cdef int64_t key = src * index.num_trg + trg
+    cdef long lower, upper, middle
+    if index.indptr == NULL:
+        return key
+    lower = index.indptr[src]
+    upper = index.indptr[src+1]
+    while lower < upper:
+        middle = (lower + upper) // 2
+        if index.keys[middle] < key:
+            lower = middle + 1
+        else:
+            upper = middle
+    if lower < index.indptr[src+1] and index.keys[lower] == key:
+        return lower
+    return -1
+
+cdef inline double column_sum(double *local, long size, int num_threads, long pos) nogil:
+    cdef double total = 0
+    cdef int tid
+    for tid in range(num_threads):
+        total += local[tid * size + pos]
+    return total
+
+cdef inline int owner_thread(Buffers buffers, int64_t pos) nogil:
+    return pos * buffers.num_threads // buffers.size
+
+cdef void count_chunk(Buffers buffers, long num_entries, int chunk) nogil:
+    cdef int64_t *chunk_counts = buffers.chunk_counts + chunk * buffers.num_threads
+    cdef long n
+    cdef int owner
+    for owner in range(buffers.num_threads):
+        chunk_counts[owner] = 0
+    for n in range(num_entries * chunk // buffers.num_threads, num_entries * (chunk+1) // buffers.num_threads):
+        if buffers.entries[n].first >= 0:
+            chunk_counts[owner_thread(buffers, buffers.entries[n].first)] += 1
+
+cdef void group_chunk(Buffers buffers, long num_entries, int chunk) nogil:
+    cdef int64_t *chunk_offsets = buffers.chunk_offsets + chunk * buffers.num_threads
+    cdef long n
+    cdef int owner
+    for n in range(num_entries * chunk // buffers.num_threads, num_entries * (chunk+1) // buffers.num_threads):
+        if buffers.entries[n].first >= 0:
+            owner = owner_thread(buffers, buffers.entries[n].first)
+            buffers.grouped[chunk_offsets[owner]] = buffers.entries[n]
+            chunk_offsets[owner] += 1
+
+cdef void add_owned(Buffers buffers, real *counts, int owner) nogil:
+    '''add the grouped entries of the owner thread into the counts, summing up the entries
+    of the same position in double precision (and in the sorted order, not depending on the number of threads)'''
+    cdef Entry *grouped = buffers.grouped
+    cdef long n = buffers.owner_offsets[owner]
+    cdef long end = buffers.owner_offsets[owner+1]
+    cdef int64_t pos
+    cdef double total
+    sort(grouped + n, grouped + end)
+    while n < end:
+        pos = grouped[n].first
+        total = 0
+        while n < end and grouped[n].first == pos:
+            total += grouped[n].second
+            n += 1
+        counts[pos] += total
+
+cdef void flush_entries(Buffers buffers, real *counts, long num_entries) nogil:
+    '''add the entries of the scratch into the counts, grouping them by the threads owning their positions'''
+    cdef int num_threads = buffers.num_threads
+    cdef int chunk, owner
+    cdef int64_t offset = 0
+    for chunk in prange(num_threads, num_threads=num_threads, schedule='static'):
+        count_chunk(buffers, num_entries, chunk)
+    for owner in range(num_threads):
+        buffers.owner_offsets[owner] = offset
+        for chunk in range(num_threads):
+            buffers.chunk_offsets[chunk * num_threads + owner] = offset
+            offset += buffers.chunk_counts[chunk * num_threads + owner]
+    buffers.owner_offsets[num_threads] = offset
+    for chunk in prange(num_threads, num_threads=num_threads, schedule='static'):
+        group_chunk(buffers, num_entries, chunk)
+    for owner in prange(num_threads, num_threads=num_threads, schedule='static'):
+        add_owned(buffers, counts, owner)
+
+cdef void model1_sentence(Corpus corpus, Index index, real *trans_data, Buffers buffers, long k, int64_t base, int tid) nogil:
+    cdef long src_begin = corpus.src_offsets[k]
+    cdef long trg_begin = corpus.trg_offsets[k]
+    cdef long len_src = corpus.src_offsets[k+1] - src_begin
+    cdef long len_trg = corpus.trg_offsets[k+1] - trg_begin
+    cdef long *positions = buffers.positions + tid * buffers.max_len_src
+    cdef double *probs = buffers.probs + tid * buffers.max_len_src
+    cdef Entry *entries = buffers.entries + base
+    cdef double entropy = 0
+    cdef double denom
+    cdef long i, j
+    for j in range(len_trg):
+        denom = 0
+        for i in range(len_src):
+            positions[i] = find_position(index, corpus.src_tokens[src_begin+i], corpus.trg_tokens[trg_begin+j])
+            if positions[i] >= 0:
+                probs[i] = trans_data[positions[i]]
+            else:
+                probs[i] = index.default_value
+            denom += probs[i]
+        entropy += -log(denom / len_src) / len_trg
+        for i in range(len_src):
+            if denom > 0:
+                entries[j * len_src + i].first = positions[i]
+                entries[j * len_src + i].second = probs[i] / denom
+            else:
+                entries[j * len_src + i].first = -1
+    buffers.entropy[tid] += entropy
+
+cdef void model1_range(Corpus corpus, Index index, real *trans_data, Buffers buffers, const int64_t[:] entry_offsets, long begin, long end) nogil:
+    '''process the sentence pairs in range [begin, end), writing the entries of k-th one from entry_offsets[k-begin]'''
+    cdef long k
+    for k in prange(begin, end, num_threads=buffers.num_threads, schedule='dynamic', chunksize=16):
+        model1_sentence(corpus, index, trans_data, buffers, k, entry_offsets[k-begin], threadid())
+
+cdef void bucket_align(real *align_data, long[:] align_shape, bool diagonal, double tension, double null_prob, long len_src, long len_trg, double *align) nogil:
+    '''alignment probabilities p(src index | trg index) of the sentences of given lengths, as (len_src x len_trg) matrix'''
+    cdef long i, j
+    cdef long offset
+    cdef double total
+    if not diagonal:
+        # align_dist[len_src-2, len_trg-1, trg index, src index]
+        offset = ((len_src - 2) * align_shape[1] + (len_trg - 1)) * align_shape[2] * align_shape[3]
+        for i in range(len_src):
+            for j in range(len_trg):
+                align[i * len_trg + j] = align_data[offset + j * align_shape[3] + i]
+        return
+    for j in range(len_trg):
+        align[j] = null_prob
+        total = 0
+        for i in range(1, len_src):
+            align[i * len_trg + j] = exp(-tension * fabs(i / <double>(len_src - 1) - (j + 1) / <double>len_trg))
+            total += align[i * len_trg + j]
+        for i in range(1, len_src):
+            align[i * len_trg + j] *= (1 - null_prob) / total
+
+cdef void model2_sentence(Corpus corpus, Index index, real *trans_data, Buffers buffers, bool diagonal, long len_src, long len_trg, long k, int64_t base, int tid) nogil:
+    cdef long src_begin = corpus.src_offsets[k]
+    cdef long trg_begin = corpus.trg_offsets[k]
+    cdef long *positions = buffers.positions + tid * buffers.max_len_src
+    cdef double *probs = buffers.probs + tid * buffers.max_len_src
+    cdef Entry *entries = buffers.entries + base
+    cdef double *align_counts = buffers.align_counts + tid * buffers.align_size
+    cdef double *diagonal_stats = buffers.diagonal + tid * 3
+    cdef double entropy = 0
+    cdef double denom, posterior
+    cdef long i, j
+    for j in range(len_trg):
+        denom = 0
+        for i in range(len_src):
+            positions[i] = find_position(index, corpus.src_tokens[src_begin+i], corpus.trg_tokens[trg_begin+j])
+            if positions[i] >= 0:
+                probs[i] = trans_data[positions[i]]
+            else:
+                probs[i] = index.default_value
+            probs[i] *= buffers.align[i * len_trg + j]
+            denom += probs[i]
+        entropy += -log(denom)
+        if denom <= 0:
+            for i in range(len_src):
+                entries[j * len_src + i].first = -1
+        else:
+            for i in range(len_src):
+                posterior = probs[i] / denom
+                entries[j * len_src + i].first = positions[i]
+                entries[j * len_src + i].second = posterior
+                if not diagonal:
+                    align_counts[i * len_trg + j] += posterior
+                elif i == 0:
+                    diagonal_stats[1] += posterior
+                else:
+                    diagonal_stats[0] += -posterior * fabs(i / <double>(len_src - 1) - (j + 1) / <double>len_trg)
+    if len_trg > 0:
+        buffers.entropy[tid] += entropy / len_trg
+    diagonal_stats[2] += len_trg
+
+cdef void model2_buckets(Corpus corpus, Index index, real *trans_data, real *align_data, long[:] align_shape, real *count_align, Buffers buffers,
+                         bool diagonal, double tension, double null_prob, const int64_t[:] order, const int64_t[:] bucket_offsets, const int64_t[:] entry_offsets) nogil:
+    '''process the sentence pairs grouped by their lengths (order[bucket_offsets[b]:bucket_offsets[b+1]] for each bucket b),
+    the sentences of each bucket are split between the threads, writing the entries of order[n] from entry_offsets[n-bucket_offsets[0]]'''
+    cdef long b, n, lower, upper, i, j, offset
+    cdef long len_src, len_trg
+    cdef int tid
+    for b in range(bucket_offsets.shape[0] - 1):
+        lower = bucket_offsets[b]
+        upper = bucket_offsets[b+1]
+        len_src = corpus.src_offsets[order[lower]+1] - corpus.src_offsets[order[lower]]
+        len_trg = corpus.trg_offsets[order[lower]+1] - corpus.trg_offsets[order[lower]]
+        bucket_align(align_data, align_shape, diagonal, tension, null_prob, len_src, len_trg, buffers.align)
+        for n in prange(lower, upper, num_threads=buffers.num_threads, schedule='dynamic', chunksize=16):
+            model2_sentence(corpus, index, trans_data, buffers, diagonal, len_src, len_trg, order[n], entry_offsets[n-bucket_offsets[0]], threadid())
+        if diagonal:
+            continue
+        # alignment counts of the bucket are reduced here, the next bucket has another lengths
+        offset = ((len_src - 2) * align_shape[1] + (len_trg - 1)) * align_shape[2] * align_shape[3]
+        for i in range(len_src):
+            for j in range(len_trg):
+                count_align[offset + j * align_shape[3] + i] += column_sum(buffers.align_counts, buffers.align_size, buffers.num_threads, i * len_trg + j)
+        for tid in range(buffers.num_threads):
+            for i in range(len_src * len_trg):
+                buffers.align_counts[tid * buffers.align_size + i] = 0
+
+cdef class KernelState:
+    '''C views of the corpus, the translation distribution, the scratch of the batches and the buffers of the threads'''
+    cdef Corpus corpus
+    cdef Index index
+    cdef Buffers buffers
+    cdef ndarray entropies
+    cdef ndarray diagonal_stats
+    # references of the arrays pointed by the views
+    cdef list arrays
+
+    def __init__(self, Trainer trainer, long begin, long end, long size, long capacity, bool model2):
+        cdef ParallelCorpus sent_pairs = trainer.sent_pairs
+        cdef object trans_dist = trainer.model.trans_dist
+        cdef int num_threads = trainer.threads
+        cdef long max_len_src = max(np.diff(sent_pairs.src_offsets[begin:end+1]).max(initial=0), 1)
+        cdef long max_len_trg = max(np.diff(sent_pairs.trg_offsets[begin:end+1]).max(initial=0), 1)
+        cdef long align_size = max_len_src * max_len_trg if model2 else 1
+        cdef ndarray entries = np.zeros(capacity, ENTRY_DTYPE)
+        cdef ndarray grouped = np.zeros(capacity, ENTRY_DTYPE)
+        cdef ndarray chunk_counts = np.zeros([num_threads, num_threads], np.int64)
+        cdef ndarray chunk_offsets = np.zeros([num_threads, num_threads], np.int64)
+        cdef ndarray owner_offsets = np.zeros(num_threads + 1, np.int64)
+        cdef ndarray positions = np.zeros([num_threads, max_len_src], np.int_)
+        cdef ndarray probs = np.zeros([num_threads, max_len_src], np.float64)
+        cdef ndarray align = np.zeros(align_size, np.float64)
+        cdef ndarray align_counts = np.zeros([num_threads, align_size], np.float64)
+        cdef ndarray src_tokens = np.ascontiguousarray(sent_pairs.src_tokens, np.int32)
+        cdef ndarray trg_tokens = np.ascontiguousarray(sent_pairs.trg_tokens, np.int32)
+        cdef ndarray src_offsets = np.ascontiguousarray(sent_pairs.src_offsets, np.int64)
+        cdef ndarray trg_offsets = np.ascontiguousarray(sent_pairs.trg_offsets, np.int64)
+        cdef ndarray indptr, keys
+        self.entropies = np.zeros(num_threads, np.float64)
+        self.diagonal_stats = np.zeros([num_threads, 3], np.float64)
+        self.arrays = [entries, grouped, chunk_counts, chunk_offsets, owner_offsets, positions, probs, align, align_counts, src_tokens, trg_tokens, src_offsets, trg_offsets]
+        self.corpus.src_tokens = <const int*>np.PyArray_DATA(src_tokens)
+        self.corpus.src_offsets = <const int64_t*>np.PyArray_DATA(src_offsets)
+        self.corpus.trg_tokens = <const int*>np.PyArray_DATA(trg_tokens)
+        self.corpus.trg_offsets = <const int64_t*>np.PyArray_DATA(trg_offsets)
+        self.index.indptr = NULL
+        self.index.keys = NULL
+        self.index.num_trg = len(trainer.model.vocab.trg)
+        self.index.default_value = 0
+        if isinstance(trans_dist, SparseMatrix):
+            indptr = np.ascontiguousarray((<SparseMatrix>trans_dist).indptr, np.int64)
+            keys = np.ascontiguousarray((<SparseMatrix>trans_dist).keys, np.int64)
+            self.arrays += [indptr, keys]
+            self.index.indptr = <const int64_t*>np.PyArray_DATA(indptr)
+            self.index.keys = <const int64_t*>np.PyArray_DATA(keys)
+            self.index.num_trg = (<SparseMatrix>trans_dist).shape[1]
+            self.index.default_value = (<SparseMatrix>trans_dist).default_value
+        self.buffers.num_threads = num_threads
+        self.buffers.entries = <Entry*>np.PyArray_DATA(entries)
+        self.buffers.grouped = <Entry*>np.PyArray_DATA(grouped)
+        self.buffers.chunk_counts = <int64_t*>np.PyArray_DATA(chunk_counts)
+        self.buffers.chunk_offsets = <int64_t*>np.PyArray_DATA(chunk_offsets)
+        self.buffers.owner_offsets = <int64_t*>np.PyArray_DATA(owner_offsets)
+        self.buffers.size = size
+        self.buffers.positions = <long*>np.PyArray_DATA(positions)
+        self.buffers.probs = <double*>np.PyArray_DATA(probs)
+        self.buffers.max_len_src = max_len_src
+        self.buffers.align = <double*>np.PyArray_DATA(align)
+        self.buffers.align_counts = <double*>np.PyArray_DATA(align_counts)
+        self.buffers.align_size = align_size
+        self.buffers.diagonal = <double*>np.PyArray_DATA(self.diagonal_stats)
+        self.buffers.entropy = <double*>np.PyArray_DATA(self.entropies)
+        msg = "scratch of expected counts: {:,d} [word pairs] x 2 x {} [bytes] = {:,d} [bytes], shared by {} threads"
+        logger.info(msg.format(capacity, ENTRY_DTYPE.itemsize, 2 * entries.nbytes, num_threads))
+
+cdef void run_model1(KernelState state, real[::1] trans_data, const int64_t[:] entry_offsets, long begin, long end) except *:
+    with nogil:
+        model1_range(state.corpus, state.index, &trans_data[0], state.buffers, entry_offsets, begin, end)
+
+cdef void run_model2(KernelState state, real[::1] trans_data, real[::1] align_data, long[:] align_shape, real[::1] count_align,
+                     const int64_t[:] order, const int64_t[:] bucket_offsets, const int64_t[:] entry_offsets, bool diagonal, double tension, double null_prob) except *:
+    with nogil:
+        model2_buckets(state.corpus, state.index, &trans_data[0], &align_data[0], align_shape, &count_align[0], state.buffers,
+                       diagonal, tension, null_prob, order, bucket_offsets, entry_offsets)
+
+cdef void run_flush(KernelState state, real[::1] count_cooc, long num_entries) except *:
+    if len(count_cooc) > 0:
+        with nogil:
+            flush_entries(state.buffers, &count_cooc[0], num_entries)
+
+cdef ndarray entry_offsets(ndarray costs):
+    '''offsets of the entries of the sentences having given numbers of word pairs in the scratch, followed by the total'''
+    return np.concatenate([[0], np.cumsum(costs)]).astype(np.int64)
+
+cdef list length_groups(ParallelCorpus sent_pairs, long begin, long end):
+    '''sentence indices in range [begin, end) sorted by (len_src, len_trg), split into groups of
+    length buckets having about BATCH_PAIRS word pairs (larger buckets are split into pieces),
+    returns list of (sorted indices, offsets of the buckets, offsets of their entries in the scratch)'''
+    cdef ndarray src_lens = np.diff(sent_pairs.src_offsets[begin:end+1])
+    cdef ndarray trg_lens = np.diff(sent_pairs.trg_offsets[begin:end+1])
+    cdef ndarray keys = src_lens * (trg_lens.max(initial=0) + 1) + trg_lens
+    cdef ndarray order = np.argsort(keys, kind='stable').astype(np.int64)
+    cdef ndarray sorted_keys, costs, firsts, ranks, starts, bucket_offsets, bucket_costs, group_ids
+    cdef list bounds
+    # imported here, as this module is loaded while initializing ibm_models
+    from . ibm_models import BATCH_PAIRS
+    if end <= begin:
+        return []
+    sorted_keys = keys[order]
+    costs = (src_lens * trg_lens)[order]
+    firsts = np.flatnonzero(np.concatenate([[True], sorted_keys[1:] != sorted_keys[:len(sorted_keys)-1]]))
+    # rank of each sentence in its bucket, starting another piece every BATCH_PAIRS word pairs
+    ranks = np.arange(end - begin) - np.repeat(firsts, np.diff(np.concatenate([firsts, [end - begin]])))
+    starts = np.flatnonzero(ranks % np.maximum(1, BATCH_PAIRS // np.maximum(1, costs)) == 0)
+    bucket_offsets = np.concatenate([starts, [end - begin]]).astype(np.int64)
+    bucket_costs = np.add.reduceat(costs, starts)
+    group_ids = (np.cumsum(bucket_costs) - bucket_costs) // BATCH_PAIRS
+    bounds = [0] + (np.flatnonzero(np.diff(group_ids)) + 1).tolist() + [len(starts)]
+    order += begin
+    return [(order, bucket_offsets[lower:upper+1], entry_offsets(costs[bucket_offsets[lower]:bucket_offsets[upper]]))
+            for lower, upper in zip(bounds[:len(bounds)-1], bounds[1:])]
+
+cdef void expect_model1_threads(Trainer trainer, long begin, long end, ndarray count_cooc, ndarray count_align, ndarray entropy, bool verbose) except *:
+    '''accumulate expected co-occurrence counts of sentence pairs in range [begin, end) in threads'''
+    cdef object trans_data = flat_data(trainer.model.trans_dist)
+    cdef ndarray costs = np.diff(trainer.sent_pairs.src_offsets[begin:end+1]) * np.diff(trainer.sent_pairs.trg_offsets[begin:end+1])
+    cdef object batches = [(batch_begin, batch_end, entry_offsets(costs[batch_begin-begin:batch_end-begin]))
+                           for batch_begin, batch_end in batch_bounds(trainer.sent_pairs, begin, end)]
+    cdef KernelState state = KernelState(trainer, begin, end, len(count_cooc), max([0] + [batch[2][len(batch[2])-1] for batch in batches]), False)
+    cdef long batch_begin, batch_end
+    cdef ndarray batch_offsets
+    if verbose:
+        batches = progress.view(batches, 'processing batches')
+    for batch_begin, batch_end, batch_offsets in batches:
+        if trans_data.dtype == np.float32:
+            run_model1[float](state, trans_data, batch_offsets, batch_begin, batch_end)
+        else:
+            run_model1[double](state, trans_data, batch_offsets, batch_begin, batch_end)
+        if count_cooc.dtype == np.float32:
+            run_flush[float](state, count_cooc, batch_offsets[len(batch_offsets)-1])
+        else:
+            run_flush[double](state, count_cooc, batch_offsets[len(batch_offsets)-1])
+    entropy[0] += state.entropies.sum()
+
+cdef void expect_model2_threads(Trainer trainer, long begin, long end, ndarray count_cooc, ndarray count_align, ndarray entropy, bool verbose) except *:
+    '''accumulate expected co-occurrence and alignment counts of sentence pairs in range [begin, end) in threads,
+    processing the sentence pairs grouped by their lengths'''
+    cdef object trans_data = flat_data(trainer.model.trans_dist)
+    cdef bool diagonal = (trainer.model.distortion == 'diagonal')
+    cdef object groups = length_groups(trainer.sent_pairs, begin, end)
+    cdef KernelState state = KernelState(trainer, begin, end, len(count_cooc), max([0] + [group[2][len(group[2])-1] for group in groups]), True)
+    cdef ndarray align_data, align_shape, count_align_data
+    cdef ndarray order, bucket_offsets, group_offsets
+    if diagonal:
+        # alignment probabilities are computed from the tension, and the statistics are summed up separately
+        align_data = np.zeros(1, trans_data.dtype)
+        align_shape = np.zeros(4, np.int_)
+        count_align_data = np.zeros(1, trans_data.dtype)
+    else:
+        align_data = np.ascontiguousarray(trainer.model.align_dist, trans_data.dtype).reshape(-1)
+        align_shape = np.array(np.shape(trainer.model.align_dist), np.int_)
+        count_align_data = count_align
+    if verbose:
+        groups = progress.view(groups, 'processing length buckets')
+    for order, bucket_offsets, group_offsets in groups:
+        if trans_data.dtype == np.float32:
+            run_model2[float](state, trans_data, align_data, align_shape, count_align_data, order, bucket_offsets, group_offsets, diagonal, trainer.model.tension, trainer.model.null_prob)
+        else:
+            run_model2[double](state, trans_data, align_data, align_shape, count_align_data, order, bucket_offsets, group_offsets, diagonal, trainer.model.tension, trainer.model.null_prob)
+        if count_cooc.dtype == np.float32:
+            run_flush[float](state, count_cooc, group_offsets[len(group_offsets)-1])
+        else:
+            run_flush[double](state, count_cooc, group_offsets[len(group_offsets)-1])
+    entropy[0] += state.entropies.sum()
+    if diagonal:
+        count_align += state.diagonal_stats.sum(axis=0)
@@ -0,0 +1,20 @@
+
+# 3-rd party library
+cimport numpy as np
+from numpy cimport ndarray
+
+cdef class Shard:
+    cdef readonly int rank
+    cdef readonly int num_shards
+    cdef readonly long begin
+    cdef readonly long end
+    cdef ndarray buffer
+    cdef object barrier
+
+    cpdef ndarray owns(self, ndarray src_ids)
+    cpdef ndarray allreduce(self, ndarray partial)
+    cpdef wait(self)
+    cpdef abort(self)
+
+cpdef ndarray vocab_bounds(ndarray weights, int num_shards)
+cpdef list create_shards(ndarray bounds)
@@ -0,0 +1,91 @@
+# distutils: language=c++
+# -*- coding: utf-8 -*-
+
+'''source vocabulary sharded into the training processes (model parallelism)
+
+each process owns contiguous range of source word ids, holding only its rows of the
+translation distribution, and the partial normalizers of target tokens are summed up
+through the buffer on shared memory
+'''
+
+# Standard libraries
+import mmap
+import multiprocessing
+
+# 3-rd party library
+import numpy as np
+cimport numpy as np
+from numpy cimport ndarray
+
+# Local libraries
+from lpu.common import logging
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+# number of values exchanged at once between the processes
+EXCHANGE_SIZE = 2 ** 20
+
+cdef class Shard:
+    '''source word ids [begin, end) owned by the rank-th process of the group'''
+    # defined in shards.pxd
+    #cdef readonly int rank
+    #cdef readonly int num_shards
+    #cdef readonly long begin
+    #cdef readonly long end
+    #cdef ndarray buffer
+    #cdef object barrier
+
+    def __init__(self, int rank, ndarray bounds, ndarray buffer, object barrier):
+        self.rank = rank
+        self.num_shards = len(bounds) - 1
+        self.begin = bounds[rank]
+        self.end = bounds[rank+1]
+        self.buffer = buffer
+        self.barrier = barrier
+
+    def __repr__(self):
+        return "Shard(rank={}, num_shards={}, begin={:,d}, end={:,d})".format(self.rank, self.num_shards, self.begin, self.end)
+
+    cpdef ndarray owns(self, ndarray src_ids):
+        return (src_ids >= self.begin) & (src_ids < self.end)
+
+    cpdef ndarray allreduce(self, ndarray partial):
+        '''sum of the partial arrays given by all the processes of the group
+
+        every process should call it in the same order with the arrays of the same shape,
+        and gets the same result (summed in the order of the ranks)
+        '''
+        cdef ndarray flat = np.ascontiguousarray(partial, np.float64).reshape(-1)
+        cdef ndarray total = np.empty_like(flat)
+        cdef long lower, upper
+        for lower in range(0, len(flat), EXCHANGE_SIZE):
+            upper = min(lower + EXCHANGE_SIZE, len(flat))
+            self.buffer[self.rank,:upper-lower] = flat[lower:upper]
+            self.barrier.wait()
+            total[lower:upper] = self.buffer[:,:upper-lower].sum(axis=0)
+            # not to overwrite the buffer until all the processes read it
+            self.barrier.wait()
+        return total.reshape(np.shape(partial))
+
+    cpdef wait(self):
+        self.barrier.wait()
+
+    cpdef abort(self):
+        '''break the barrier not to leave the other processes waiting forever'''
+        self.barrier.abort()
+
+cpdef ndarray vocab_bounds(ndarray weights, int num_shards):
+    '''split word ids into num_shards contiguous ranges with balanced weights, as their boundaries'''
+    cdef ndarray cumsum = np.cumsum(weights, dtype=np.float64)
+    cdef ndarray targets = cumsum[-1] * np.arange(1, num_shards) / float(num_shards)
+    cdef ndarray inner = np.searchsorted(cumsum, targets, side='right')
+    return np.concatenate([[0], inner, [len(weights)]]).astype(np.int64)
+
+cpdef list create_shards(ndarray bounds):
+    '''shards of the group sharing the exchange buffer and the barrier (to be passed to forked processes)'''
+    cdef int num_shards = len(bounds) - 1
+    cdef object buf = mmap.mmap(-1, num_shards * EXCHANGE_SIZE * 8)
+    cdef ndarray buffer = np.frombuffer(buf, np.float64).reshape(num_shards, EXCHANGE_SIZE)
+    cdef object barrier = multiprocessing.get_context('fork').Barrier(num_shards)
+    return [Shard(rank, bounds, buffer, barrier) for rank in range(num_shards)]
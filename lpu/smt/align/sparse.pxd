@@ -0,0 +1,35 @@
+
+# 3-rd party library
+cimport numpy as np
+from numpy cimport ndarray
+
+cdef class SparseMatrix:
+    cdef readonly tuple shape
+    cdef readonly ndarray keys
+    cdef readonly ndarray indptr
+    cdef public ndarray data
+    cdef public double default_value
+
+    cpdef ndarray make_keys(self, rows, cols)
+    cpdef tuple find(self, rows, cols)
+    cpdef ndarray positions(self, rows, cols)
+    cpdef ndarray lookup(self, rows, cols)
+    cpdef int assign(self, rows, cols, values) except -1
+    cpdef tuple row(self, long index)
+    cpdef ndarray row_ids(self)
+    cpdef ndarray col_ids(self)
+    cpdef ndarray sum(self, int axis)
+    cpdef SparseMatrix zeros_like(self)
+    cpdef SparseMatrix copy(self)
+    cpdef ndarray toarray(self)
+
+cdef class KeyCollector:
+    cdef readonly tuple shape
+    cdef ndarray merged
+    cdef list buffer
+    cdef long buffer_size
+
+    cpdef add_grid(self, rows, cols)
+    cpdef add_keys(self, keys)
+    cpdef merge(self)
+    cpdef SparseMatrix build(self, fill_value=*, dtype=*)
@@ -0,0 +1,187 @@
+# distutils: language=c++
+# -*- coding: utf-8 -*-
+
+'''sparse probability/count tables holding only registered (row, col) pairs'''
+
+# 3-rd party library
+import numpy as np
+cimport numpy as np
+from numpy cimport ndarray
+from numpy cimport float64_t
+from numpy cimport int64_t
+
+# Local libraries
+from lpu.common import logging
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+# number of keys to buffer before merging them into the sorted key set
+MERGE_BUFFER_SIZE = 2 ** 22
+
+cdef class SparseMatrix:
+    '''2-d matrix storing values only for the registered (row, col) pairs
+
+    entries are kept in CSR order as sorted int64 keys (row * num_cols + col)
+    with the parallel float array "data", so a batch of lookups becomes
+    one vectorized binary search over "keys"
+    '''
+    # defined in sparse.pxd
+    #cdef readonly tuple shape
+    #cdef readonly ndarray keys
+    #cdef readonly ndarray indptr
+    #cdef public ndarray data
+    #cdef public double default_value
+
+    def __init__(self, shape, keys, data=None, dtype=None, default_value=0):
+        self.shape = (int(shape[0]), int(shape[1]))
+        # value of the unregistered pairs
+        self.default_value = default_value
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.indptr = np.searchsorted(self.keys, np.arange(self.shape[0]+1, dtype=np.int64) * self.shape[1])
+        if data is None:
+            self.data = np.zeros(len(self.keys), dtype or np.float64)
+        else:
+            self.data = np.asarray(data, dtype=dtype)
+            if self.data.dtype.kind != 'f':
+                self.data = self.data.astype(np.float64)
+
+    property nnz:
+        def __get__(self):
+            return len(self.keys)
+
+    property nbytes:
+        def __get__(self):
+            return self.keys.nbytes + self.indptr.nbytes + self.data.nbytes
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return "SparseMatrix(shape={}, nnz={:,d}, default={})".format(self.shape, self.nnz, self.default_value)
+
+    cpdef ndarray make_keys(self, rows, cols):
+        return np.asarray(np.asarray(rows, dtype=np.int64) * self.shape[1] + np.asarray(cols, dtype=np.int64))
+
+    cpdef tuple find(self, rows, cols):
+        '''return positions in "data" for given (rows, cols) and the mask of registered pairs'''
+        cdef ndarray query = self.make_keys(rows, cols)
+        cdef ndarray positions = np.searchsorted(self.keys, query)
+        cdef ndarray found
+        np.minimum(positions, max(len(self.keys)-1, 0), out=positions)
+        if len(self.keys) > 0:
+            found = (self.keys[positions] == query)
+        else:
+            found = np.zeros_like(query, np.bool_)
+        return positions, found
+
+    cpdef ndarray positions(self, rows, cols):
+        '''return positions in "data" for given (rows, cols), which must be registered'''
+        cdef ndarray positions, found
+        positions, found = self.find(rows, cols)
+        if not found.all():
+            raise KeyError("given pairs contain unregistered entries of sparse matrix")
+        return positions
+
+    cpdef ndarray lookup(self, rows, cols):
+        '''return values for given (rows, cols), unregistered pairs are regarded as the default value'''
+        cdef ndarray positions, found
+        positions, found = self.find(rows, cols)
+        return np.where(found, self.data[positions], self.data.dtype.type(self.default_value))
+
+    cpdef int assign(self, rows, cols, values) except -1:
+        '''set values for the registered pairs among given (rows, cols), returns the number of assigned entries'''
+        cdef ndarray positions, found
+        positions, found = self.find(rows, cols)
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64), np.shape(found))
+        self.data[positions[found]] = values[found]
+        return int(found.sum())
+
+    cpdef tuple row(self, long index):
+        '''return (col ids, values) of given row'''
+        cdef long begin = self.indptr[index]
+        cdef long end = self.indptr[index+1]
+        return self.keys[begin:end] - index * self.shape[1], self.data[begin:end]
+
+    cpdef ndarray row_ids(self):
+        '''return the row id of every stored entry'''
+        return np.repeat(np.arange(self.shape[0], dtype=np.int64), np.diff(self.indptr))
+
+    cpdef ndarray col_ids(self):
+        '''return the col id of every stored entry'''
+        return self.keys % self.shape[1]
+
+    cpdef ndarray sum(self, int axis):
+        cdef ndarray cumsum
+        # summing in double precision even for single precision data
+        if axis == 1:
+            cumsum = np.concatenate([[0], np.cumsum(self.data, dtype=np.float64)])
+            return cumsum[self.indptr[1:]] - cumsum[self.indptr[:-1]]
+        elif axis == 0:
+            return np.bincount(self.col_ids(), self.data, minlength=self.shape[1])
+        else:
+            raise ValueError("axis should be 0 or 1, but given: {}".format(axis))
+
+    cpdef SparseMatrix zeros_like(self):
+        '''return new matrix sharing the same keys with values of zeros'''
+        cdef SparseMatrix matrix = SparseMatrix.__new__(SparseMatrix)
+        matrix.shape = self.shape
+        matrix.keys = self.keys
+        matrix.indptr = self.indptr
+        matrix.data = np.zeros(len(self.keys), self.data.dtype)
+        matrix.default_value = 0
+        return matrix
+
+    cpdef SparseMatrix copy(self):
+        cdef SparseMatrix matrix = self.zeros_like()
+        matrix.data[:] = self.data
+        matrix.default_value = self.default_value
+        return matrix
+
+    cpdef ndarray toarray(self):
+        cdef ndarray dense = np.full(self.shape, self.default_value, self.data.dtype)
+        dense.reshape(-1)[self.keys] = self.data
+        return dense
+
+cdef class KeyCollector:
+    '''collector of unique (row, col) keys to build SparseMatrix incrementally'''
+    # defined in sparse.pxd
+    #cdef readonly tuple shape
+    #cdef ndarray merged
+    #cdef list buffer
+    #cdef long buffer_size
+
+    def __init__(self, shape):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.merged = np.zeros(0, np.int64)
+        self.buffer = []
+        self.buffer_size = 0
+
+    cpdef add_grid(self, rows, cols):
+        '''register all the pairs of the cartesian product of rows and cols'''
+        cdef ndarray keys
+        keys = np.asarray(rows, dtype=np.int64)[:,None] * self.shape[1] + np.asarray(cols, dtype=np.int64)[None,:]
+        self.buffer.append(keys.reshape(-1))
+        self.buffer_size += keys.size
+        if self.buffer_size >= MERGE_BUFFER_SIZE:
+            self.merge()
+
+    cpdef add_keys(self, keys):
+        self.buffer.append(np.asarray(keys, dtype=np.int64).reshape(-1))
+        self.buffer_size += len(self.buffer[-1])
+        if self.buffer_size >= MERGE_BUFFER_SIZE:
+            self.merge()
+
+    cpdef merge(self):
+        if self.buffer:
+            self.merged = np.union1d(self.merged, np.concatenate(self.buffer))
+            self.buffer = []
+            self.buffer_size = 0
+
+    cpdef SparseMatrix build(self, fill_value=0, dtype=np.float64):
+        cdef SparseMatrix matrix
+        self.merge()
+        matrix = SparseMatrix(self.shape, self.merged, dtype=dtype)
+        if fill_value:
+            matrix.data[:] = fill_value
+        return matrix
@@ -0,0 +1,18 @@
+
+# 3-rd party library
+cimport numpy as np
+from numpy cimport ndarray
+
+cdef class AlignPoints:
+    cdef readonly long stride
+    cdef readonly long num_sents
+
+    cpdef ndarray from_trg_align(self, ndarray trg_lengths, ndarray aligned)
+    cpdef ndarray from_src_align(self, ndarray src_lengths, ndarray aligned)
+    cpdef ndarray src_words(self, ndarray keys)
+    cpdef ndarray trg_words(self, ndarray keys)
+    cdef ndarray grow_diag(self, ndarray current, ndarray union)
+    cpdef ndarray grow_diag_final_and(self, ndarray forward, ndarray backward)
+    cpdef list format_lines(self, ndarray keys)
+
+cpdef ndarray symmetrize(ndarray src_lengths, ndarray trg_lengths, ndarray trg_align, ndarray src_align, str method, AlignPoints points=*)
@@ -0,0 +1,175 @@
+# distutils: language=c++
+# -*- coding: utf-8 -*-
+
+'''symmetrization of word alignments decoded in both directions
+
+alignment points of the whole corpus are encoded into sorted int64 keys
+(sentence index, source position, target position), so that the heuristics
+are computed with set operations over all the sentence pairs at once
+'''
+
+# 3-rd party library
+import numpy as np
+cimport numpy as np
+from numpy cimport ndarray
+from numpy cimport int64_t
+from numpy cimport uint8_t
+
+# Local libraries
+from lpu.common import logging
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+SYMMETRIZE_METHODS = ['intersection', 'union', 'grow-diag-final-and']
+SYMMETRIZE_METHOD = 'grow-diag-final-and'
+
+# neighbors of the points (source shift, target shift) in the order of checking them (Koehn et al., 2003)
+NEIGHBORS = [(-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+cdef class AlignPoints:
+    '''alignment points of sentence pairs encoded as keys (index * stride + src) * stride + trg,
+    with 1-origin source/target positions not including NULL'''
+    # defined in symmetrize.pxd
+    #cdef readonly long stride
+    #cdef readonly long num_sents
+
+    def __init__(self, ndarray src_lengths, ndarray trg_lengths):
+        self.num_sents = len(src_lengths)
+        # leaving margins not to wrap around at the edges when looking up neighbors
+        self.stride = max(src_lengths.max(initial=0), trg_lengths.max(initial=0)) + 2
+
+    cpdef ndarray from_trg_align(self, ndarray trg_lengths, ndarray aligned):
+        '''keys of alignment points from source index (0 for NULL) of each target token'''
+        cdef ndarray sents = np.repeat(np.arange(self.num_sents), trg_lengths)
+        cdef ndarray trg = np.arange(len(aligned)) - np.repeat(np.cumsum(trg_lengths) - trg_lengths, trg_lengths) + 1
+        cdef ndarray found = aligned > 0
+        return np.unique((sents[found] * self.stride + aligned[found]) * self.stride + trg[found])
+
+    cpdef ndarray from_src_align(self, ndarray src_lengths, ndarray aligned):
+        '''keys of alignment points from target index (0 for NULL) of each source token'''
+        cdef ndarray sents = np.repeat(np.arange(self.num_sents), src_lengths)
+        cdef ndarray src = np.arange(len(aligned)) - np.repeat(np.cumsum(src_lengths) - src_lengths, src_lengths) + 1
+        cdef ndarray found = aligned > 0
+        return np.unique((sents[found] * self.stride + src[found]) * self.stride + aligned[found])
+
+    cpdef ndarray src_words(self, ndarray keys):
+        '''keys of source words (sentence index, source position) of given points'''
+        return keys // self.stride
+
+    cpdef ndarray trg_words(self, ndarray keys):
+        '''keys of target words (sentence index, target position) of given points'''
+        return keys // (self.stride * self.stride) * self.stride + keys % self.stride
+
+    cdef ndarray grow_diag(self, ndarray current, ndarray union):
+        '''growing step, adding the points of the union adjacent to the current points one by one:
+        the current points of each sentence pair are scanned in order of (source, target) positions,
+        checking their neighbors in order of NEIGHBORS, until no points are added in a scan'''
+        cdef long square = self.stride * self.stride
+        cdef const int64_t[:] keys = np.ascontiguousarray(union, np.int64)
+        cdef ndarray selected = np.isin(union, current).astype(np.uint8)
+        cdef uint8_t[:] aligned = selected
+        cdef const int64_t[:] bounds = np.searchsorted(union // square, np.arange(self.num_sents + 1)).astype(np.int64)
+        # indices of the points of the union in the current sentence pair (plus 1, 0 for no point) on the grid
+        cdef int64_t[:] grid = np.zeros(square, np.int64)
+        cdef uint8_t[:] src_aligned = np.zeros(self.stride, np.uint8)
+        cdef uint8_t[:] trg_aligned = np.zeros(self.stride, np.uint8)
+        cdef long src_shifts[8]
+        cdef long trg_shifts[8]
+        cdef long s, n, m, k, src, trg, max_src, max_trg, new_src, new_trg
+        cdef bint pending, changed
+        src_shifts[:] = [shift[0] for shift in NEIGHBORS]
+        trg_shifts[:] = [shift[1] for shift in NEIGHBORS]
+        for s in range(self.num_sents):
+            pending = False
+            for n in range(bounds[s], bounds[s+1]):
+                pending = pending or not aligned[n]
+            if not pending:
+                continue
+            max_src = max_trg = 0
+            for n in range(bounds[s], bounds[s+1]):
+                src = keys[n] // self.stride % self.stride
+                trg = keys[n] % self.stride
+                grid[src * self.stride + trg] = n + 1
+                if aligned[n]:
+                    src_aligned[src] = trg_aligned[trg] = 1
+                max_src = max(max_src, src)
+                max_trg = max(max_trg, trg)
+            changed = True
+            while changed:
+                changed = False
+                for src in range(1, max_src + 1):
+                    for trg in range(1, max_trg + 1):
+                        n = grid[src * self.stride + trg] - 1
+                        if n < 0 or not aligned[n]:
+                            continue
+                        for k in range(8):
+                            new_src = src + src_shifts[k]
+                            new_trg = trg + trg_shifts[k]
+                            m = grid[new_src * self.stride + new_trg] - 1
+                            if m >= 0 and not aligned[m] and not (src_aligned[new_src] and trg_aligned[new_trg]):
+                                aligned[m] = src_aligned[new_src] = trg_aligned[new_trg] = 1
+                                changed = True
+            for n in range(bounds[s], bounds[s+1]):
+                src = keys[n] // self.stride % self.stride
+                trg = keys[n] % self.stride
+                grid[src * self.stride + trg] = 0
+                src_aligned[src] = trg_aligned[trg] = 0
+        return union[selected.astype(bool)]
+
+    cpdef ndarray grow_diag_final_and(self, ndarray forward, ndarray backward):
+        '''grow-diag-final-and heuristic (Koehn et al., 2003)
+
+        growing step adds the neighbors one by one (see grow_diag),
+        and final step gives the same points as adding them one by one in order of the keys
+        '''
+        cdef ndarray current = np.intersect1d(forward, backward)
+        cdef ndarray union = np.union1d(forward, backward)
+        cdef ndarray candidates, free
+        cdef ndarray first_src, first_trg
+        cdef ndarray links
+        current = self.grow_diag(current, union)
+        for links in [forward, backward]:
+            candidates = np.setdiff1d(links, current, assume_unique=True)
+            while True:
+                free = ~np.isin(self.src_words(candidates), self.src_words(current))
+                free &= ~np.isin(self.trg_words(candidates), self.trg_words(current))
+                candidates = candidates[free]
+                if len(candidates) == 0:
+                    break
+                # the points first (in order of the keys) for both of their words are added as they are
+                # by adding the points one by one, and the rest are checked again after adding them
+                first_src = np.zeros(len(candidates), bool)
+                first_src[np.unique(self.src_words(candidates), return_index=True)[1]] = True
+                first_trg = np.zeros(len(candidates), bool)
+                first_trg[np.unique(self.trg_words(candidates), return_index=True)[1]] = True
+                current = np.union1d(current, candidates[first_src & first_trg])
+        return current
+
+    cpdef list format_lines(self, ndarray keys):
+        '''alignment points of each sentence pair formatted as "trg_index-src_index" (the same as decoded alignment)'''
+        cdef ndarray sents = keys // (self.stride * self.stride)
+        cdef ndarray src = keys // self.stride % self.stride
+        cdef ndarray trg = keys % self.stride
+        cdef ndarray order = np.lexsort((src, trg, sents))
+        cdef list records = np.char.add(np.char.add(trg[order].astype(str), '-'), src[order].astype(str)).tolist()
+        cdef list bounds = np.searchsorted(sents[order], np.arange(self.num_sents + 1)).tolist()
+        return [str.join(' ', records[bounds[i]:bounds[i+1]]) for i in range(self.num_sents)]
+
+cpdef ndarray symmetrize(ndarray src_lengths, ndarray trg_lengths, ndarray trg_align, ndarray src_align, str method, AlignPoints points=None):
+    '''symmetrize alignments of both directions, returning the keys of alignment points
+
+    trg_align is the source index (0 for NULL) of each target token decoded in source-to-target direction,
+    and src_align is the target index (0 for NULL) of each source token decoded in the reverse direction
+    '''
+    if points is None:
+        points = AlignPoints(src_lengths, trg_lengths)
+    forward = points.from_trg_align(trg_lengths, trg_align)
+    backward = points.from_src_align(src_lengths, src_align)
+    if method == 'intersection':
+        return np.intersect1d(forward, backward, assume_unique=True)
+    elif method == 'union':
+        return np.union1d(forward, backward)
+    elif method == 'grow-diag-final-and':
+        return points.grow_diag_final_and(forward, backward)
+    raise ValueError("unknown symmetrization method: {}".format(method))
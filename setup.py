@@ -159,6 +159,8 @@ setup(
             'lpu-wait-files= lpu.commands.wait_files:main',
             'lpu-word-align-train= lpu.smt.align.ibm_models:main_train',
             'lpu-word-align-score= lpu.smt.align.ibm_models:main_score',
+            'lpu-word-align-export= lpu.smt.align.ibm_models:main_export',
+            'lpu-word-align-serve= lpu.smt.align.ibm_models:main_serve',
         ],
     },
 )
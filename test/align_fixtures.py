@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  common fixtures of the tests of lpu.smt.align: toy corpus, training and reading the outputs
+"""
+
+import os
+
+import numpy as np
+
+from lpu.common import archives
+from lpu.smt.align import ibm_models
+
+SRC_LINES = [
+    'das haus ist klein',
+    'das haus ist gross',
+    'das buch ist klein',
+    'das buch ist gross',
+    'ein haus',
+    'ein buch',
+    'klein ist das haus',
+    'das ist ein kleines buch',
+    'ich lese das buch',
+    'ich sehe das haus',
+]
+TRG_LINES = [
+    'the house is small',
+    'the house is big',
+    'the book is small',
+    'the book is big',
+    'a house',
+    'a book',
+    'the house is small',
+    'that is a small book',
+    'i read the book',
+    'i see the house',
+]
+
+def write_corpus(work_dir, src_lines=SRC_LINES, trg_lines=TRG_LINES):
+    '''write the parallel corpus into src.txt and trg.txt of work_dir'''
+    with open(os.path.join(work_dir, 'src.txt'), 'w') as fobj:
+        fobj.write(str.join('', [line + '\n' for line in src_lines]))
+    with open(os.path.join(work_dir, 'trg.txt'), 'w') as fobj:
+        fobj.write(str.join('', [line + '\n' for line in trg_lines]))
+
+def train_conf(work_dir, name, **options):
+    '''training configuration on the corpus of work_dir, saving the outputs into work_dir/name.*'''
+    conf = dict(
+        src_path = os.path.join(work_dir, 'src.txt'),
+        trg_path = os.path.join(work_dir, 'trg.txt'),
+        save_trans_path = os.path.join(work_dir, name + '.trans'),
+        save_align_path = None,
+        save_scores = None,
+        decode_align = None,
+        save_model = os.path.join(work_dir, name + '.bin'),
+        iteration_limit = 5,
+        threshold = 0,
+        nbest = None,
+    )
+    conf.update(options)
+    return conf
+
+def train(work_dir, name, **options):
+    '''train with given options, returns (arrays, meta data) of the saved binary model'''
+    conf = train_conf(work_dir, name, **options)
+    ibm_models.train_ibm_models(conf)
+    return archives.load_arrays(conf['save_model'])
+
+def read_lines(path):
+    with open(path) as fobj:
+        return fobj.read().splitlines()
+
+def read_trans(path):
+    '''{(src, trg): (prob, count)} of the records saved by --save-trans-path'''
+    records = {}
+    for line in read_lines(path):
+        src, trg, prob, count = line.split('\t')
+        records[src, trg] = (float(prob), float(count))
+    return records
+
+def read_records(path, num_keys):
+    '''{keys: probability} of the records of translation/alignment distribution (ignoring the counts),
+    and {name: value} of the alignment parameters'''
+    records = {}
+    for line in read_lines(path):
+        fields = line.split('\t')
+        if len(fields) == 2:
+            records[fields[0]] = fields[1]
+        else:
+            records[tuple(fields[0:num_keys])] = float(fields[num_keys])
+    return records
+
+def dense_trans_dist(arrays, meta):
+    '''translation distribution of the saved model as dense matrix'''
+    if 'trans_keys' in arrays:
+        trans_dist = np.full(meta['trans_shape'], meta['trans_default'], np.float64)
+        trans_dist.flat[arrays['trans_keys']] = arrays['trans_data']
+        return trans_dist
+    return np.asarray(arrays['trans_dist'])
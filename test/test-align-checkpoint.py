@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (checkpoints of training)
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import archives
+from lpu.common import logging
+
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        for distortion in ['absolute', 'diagonal', 'hmm']:
+            for sparse in [False, True]:
+                # starting from the same model, as Model 1 is not trained with --init-model
+                init_model = os.path.join(work_dir, 'init.bin')
+                train(work_dir, 'init', iteration_limit=1, distortion=distortion, sparse=sparse)
+                options = dict(init_model=init_model, distortion=distortion, sparse=sparse)
+                arrays, meta = train(work_dir, 'full', iteration_limit=4, checkpoint=os.path.join(work_dir, 'full.ckpt'), **options)
+                # interrupted after 2 steps, and then resumed
+                checkpoint = os.path.join(work_dir, 'resumed.ckpt')
+                train(work_dir, 'interrupted', iteration_limit=2, checkpoint=checkpoint, **options)
+                assert archives.load_arrays(checkpoint)[1]['state']['step'] == 2
+                resumed_arrays, resumed_meta = train(work_dir, 'resumed', iteration_limit=4, checkpoint=checkpoint, resume=True, **options)
+                dprint((distortion, sparse))
+                dprint(archives.load_arrays(checkpoint)[1]['state'])
+                assert archives.load_arrays(checkpoint)[1]['state'] == archives.load_arrays(os.path.join(work_dir, 'full.ckpt'))[1]['state']
+                assert arrays.keys() == resumed_arrays.keys()
+                for name in arrays.keys():
+                    assert np.array_equal(arrays[name], resumed_arrays[name]), name
+                assert meta.get('tension') == resumed_meta.get('tension')
+                with open(os.path.join(work_dir, 'full.trans')) as fobj:
+                    records = fobj.read()
+                with open(os.path.join(work_dir, 'resumed.trans')) as fobj:
+                    assert records == fobj.read()
+        logger.info("resumed training gives the same result as uninterrupted one")
+    finally:
+        shutil.rmtree(work_dir)
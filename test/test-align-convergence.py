@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (convergence of EM training)
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import archives
+from lpu.common import logging
+
+from align_fixtures import read_trans
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+ITERATION_LIMIT = 200
+
+def train_until_convergence(work_dir, name, **options):
+    '''train until convergence with given options, returns the meta data of the checkpoint and the records of the translation distribution'''
+    checkpoint = os.path.join(work_dir, name + '.ckpt')
+    train(work_dir, name, checkpoint=checkpoint, iteration_limit=ITERATION_LIMIT, **options)
+    return archives.load_arrays(checkpoint)[1], read_trans(os.path.join(work_dir, name + '.trans'))
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        for distortion in ['absolute', 'diagonal', 'hmm']:
+            meta, records = train_until_convergence(work_dir, distortion, distortion=distortion)
+            dprint(meta['state'])
+            # stopped by the entropy not decreasing
+            assert meta['state']['step'] < ITERATION_LIMIT
+            # saved counts should give the saved probabilities (counts are rounded into 2 decimal places)
+            pairs_of_src = {}
+            for (src, trg), pair in records.items():
+                pairs_of_src.setdefault(src, []).append(pair)
+            for src, pairs in pairs_of_src.items():
+                total = sum([count for prob, count in pairs])
+                for prob, count in pairs:
+                    assert abs(prob * total - count) <= 0.005 + 0.005 * prob * len(pairs) + 1e-6, (src, prob, count, total)
+        logger.info("saved counts give the saved probabilities")
+    finally:
+        shutil.rmtree(work_dir)
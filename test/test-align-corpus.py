@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.corpus
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import logging
+from lpu.common.vocab import StringEnumerator
+from lpu.smt.align import corpus
+
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+# including an empty line
+SRC_LINES = [
+    'das haus ist klein',
+    'das haus ist gross',
+    '',
+    'ein haus',
+    'ich lese das buch',
+]
+TRG_LINES = [
+    'the house is small',
+    'the house is big',
+    'nothing',
+    'a house',
+    'i read the book',
+]
+
+def assert_same_corpus(sent_pairs1, sent_pairs2):
+    assert len(sent_pairs1) == len(sent_pairs2)
+    for name in ['src_tokens', 'src_offsets', 'trg_tokens', 'trg_offsets']:
+        assert np.array_equal(getattr(sent_pairs1, name), getattr(sent_pairs2, name))
+    for pair1, pair2 in zip(sent_pairs1, sent_pairs2):
+        assert list(pair1[0]) == list(pair2[0])
+        assert list(pair1[1]) == list(pair2[1])
+
+def assert_same_vocab(vocab, buf, offsets):
+    loaded = StringEnumerator()
+    assert np.array_equal(loaded.load_arrays(buf, offsets), np.arange(len(vocab)))
+    assert list(loaded) == list(vocab)
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        src_vocab = StringEnumerator()
+        trg_vocab = StringEnumerator()
+        # NULL word
+        src_vocab.str2id('NULL')
+        builder = corpus.CorpusBuilder()
+        writer = corpus.CorpusWriter(2, work_dir)
+        for src_line, trg_line in zip(SRC_LINES, TRG_LINES):
+            src_ids = [0] + src_vocab.encode(src_line.split()).tolist()
+            trg_ids = trg_vocab.encode(trg_line.split()).tolist()
+            builder.append(src_ids, trg_ids)
+            writer.append(src_ids, trg_ids)
+        sent_pairs = builder.build()
+        dprint(sent_pairs)
+        src_buf, src_offsets = src_vocab.to_arrays()
+        trg_buf, trg_offsets = trg_vocab.to_arrays()
+        vocab_arrays = dict(src_vocab=src_buf, src_vocab_offsets=src_offsets, trg_vocab=trg_buf, trg_vocab_offsets=trg_offsets)
+        meta = dict(character=False)
+
+        # packed in memory
+        cache_path = os.path.join(work_dir, 'cache.bin')
+        sent_pairs.save(cache_path, vocab_arrays, meta)
+        loaded, arrays, loaded_meta = corpus.load_corpus(cache_path)
+        dprint(loaded)
+        dprint(loaded_meta)
+        assert loaded_meta['character'] == False
+        assert_same_corpus(sent_pairs, loaded)
+        assert_same_vocab(src_vocab, arrays['src_vocab'], arrays['src_vocab_offsets'])
+        assert_same_vocab(trg_vocab, arrays['trg_vocab'], arrays['trg_vocab_offsets'])
+
+        # packed chunk by chunk through temporary files
+        stream_path = os.path.join(work_dir, 'stream.bin')
+        writer.save(stream_path, vocab_arrays, meta)
+        loaded, arrays, loaded_meta = corpus.load_corpus(stream_path)
+        assert_same_corpus(sent_pairs, loaded)
+        assert_same_vocab(src_vocab, arrays['src_vocab'], arrays['src_vocab_offsets'])
+        assert_same_vocab(trg_vocab, arrays['trg_vocab'], arrays['trg_vocab_offsets'])
+
+        # cache files written and then loaded by training
+        write_corpus(work_dir, SRC_LINES, TRG_LINES)
+        model = train(work_dir, 'text', iteration_limit=3)[0]
+        for stream in [False, True]:
+            options = dict(corpus_cache=os.path.join(work_dir, 'train-{}.bin'.format(stream)), stream=stream, chunk_size=2)
+            for name in ['written', 'loaded']:
+                cached_model = train(work_dir, name, iteration_limit=3, **options)[0]
+                assert os.path.exists(options['corpus_cache'])
+                assert model.keys() == cached_model.keys()
+                for key in model.keys():
+                    assert np.array_equal(model[key], cached_model[key])
+        logger.info("cached corpus gives the same ids")
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the modules: lpu.smt.align.hmm_model, lpu.smt.align.aligner (posterior probabilities of alignments)
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import logging
+from lpu.smt.align.aligner import Aligner
+
+from align_fixtures import SRC_LINES
+from align_fixtures import TRG_LINES
+from align_fixtures import read_trans
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        for distortion in ['hmm', 'absolute']:
+            train(work_dir, distortion, distortion=distortion)
+            counts = [count for prob, count in read_trans(os.path.join(work_dir, distortion + '.trans')).values()]
+            # expected counts of the last step sum up to the number of target words (counts are rounded into 2 decimal places)
+            assert abs(sum(counts) - sum([len(line.split()) for line in TRG_LINES])) <= 0.005 * len(counts)
+            aligner = Aligner(os.path.join(work_dir, distortion + '.bin'))
+            # including unknown words and lengths
+            src_lines = SRC_LINES + ['das kleine haus ist nicht gross', 'haus']
+            trg_lines = TRG_LINES + ['the small house is not big', 'the house']
+            entropies, alignments, posteriors = aligner.align(src_lines, trg_lines, posteriors=True, threshold=0)
+            assert len(posteriors) == len(src_lines)
+            for src_line, trg_line, posterior, alignment in zip(src_lines, trg_lines, posteriors, alignments):
+                len_src = len(src_line.split()) + 1
+                len_trg = len(trg_line.split())
+                probs = posterior.toarray()
+                dprint((distortion, src_line, trg_line))
+                dprint(probs)
+                assert probs.shape == (len_src, len_trg)
+                assert (probs >= 0).all()
+                # posterior probabilities of the source positions (with NULL) of each target word sum to 1
+                assert np.allclose(probs.sum(axis=0), 1)
+                assert len(alignment) == len_trg
+            assert np.isfinite(entropies).all()
+        logger.info("posterior probabilities sum to 1")
+    finally:
+        shutil.rmtree(work_dir)
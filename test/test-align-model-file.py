@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the modules: lpu.common.archives, lpu.smt.align.ibm_models (binary model file)
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import archives
+from lpu.common import logging
+from lpu.smt.align import ibm_models
+
+from align_fixtures import read_lines
+from align_fixtures import read_records
+from align_fixtures import train_conf
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+def test_archive(work_dir):
+    path = os.path.join(work_dir, 'arrays.bin')
+    transposed = np.arange(12, dtype=np.float32).reshape(3, 4).T
+    arrays = dict(
+        ints = np.arange(5, dtype=np.int64),
+        transposed = transposed,
+        empty = np.zeros(0, np.uint8),
+        matrix = np.random.rand(2, 3),
+    )
+    archives.save_arrays(path, arrays, dict(name='test'))
+    # given dict is not modified
+    assert arrays['transposed'] is transposed
+    assert archives.is_archive(path)
+    for use_mmap in [True, False]:
+        loaded, meta = archives.load_arrays(path, use_mmap)
+        dprint(meta)
+        assert meta == dict(name='test')
+        assert loaded.keys() == arrays.keys()
+        for name, array in arrays.items():
+            assert loaded[name].dtype == array.dtype
+            assert np.array_equal(loaded[name], array)
+            assert not loaded[name].flags.writeable
+    # compressed archives cannot be mapped
+    with open(path, 'rb') as src_fobj, gzip.open(path + '.gz', 'wb') as gz_fobj:
+        shutil.copyfileobj(src_fobj, gz_fobj)
+    assert archives.is_archive(path + '.gz')
+    for use_mmap in [True, False]:
+        try:
+            archives.load_arrays(path + '.gz', use_mmap)
+            assert False
+        except ValueError:
+            pass
+    try:
+        archives.save_arrays(os.path.join(work_dir, 'saved.bin.gz'), arrays)
+        assert False
+    except ValueError:
+        pass
+    assert not os.path.exists(os.path.join(work_dir, 'saved.bin.gz.tmp'))
+
+def test_model(work_dir, name, **options):
+    '''outputs of the trained model and of the model loaded from the binary file should be the same'''
+    conf = train_conf(work_dir, name, iteration_limit=3,
+                      save_align_path=os.path.join(work_dir, name + '.align'),
+                      save_scores=os.path.join(work_dir, name + '.scores'),
+                      decode_align=os.path.join(work_dir, name + '.decoded'),
+                      **options)
+    ibm_models.train_ibm_models(conf)
+    ibm_models.score_ibm_model(dict(
+        src_path = conf['src_path'],
+        trg_path = conf['trg_path'],
+        trans_path = conf['save_model'],
+        align_path = None,
+        save_scores = conf['save_scores'] + '.loaded',
+        decode_align = conf['decode_align'] + '.loaded',
+    ))
+    ibm_models.export_ibm_model(dict(
+        model_path = conf['save_model'],
+        trans_path = conf['save_trans_path'] + '.exported',
+        align_path = conf['save_align_path'] + '.exported',
+        threshold = 0,
+        nbest = None,
+    ))
+    dprint(name)
+    assert read_lines(conf['save_scores']) == read_lines(conf['save_scores'] + '.loaded')
+    assert read_lines(conf['decode_align']) == read_lines(conf['decode_align'] + '.loaded')
+    align_keys = 4 if conf.get('distortion', 'absolute') == 'absolute' else 2
+    for path, num_keys in [(conf['save_trans_path'], 2), (conf['save_align_path'], align_keys)]:
+        records = read_records(path, num_keys)
+        exported = read_records(path + '.exported', num_keys)
+        assert len(records) > 0
+        assert records.keys() == exported.keys()
+        for key, value in records.items():
+            if isinstance(value, float):
+                assert np.isclose(value, exported[key], rtol=0, atol=1e-8)
+            else:
+                assert value == exported[key]
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        test_archive(work_dir)
+        write_corpus(work_dir)
+        test_model(work_dir, 'absolute')
+        test_model(work_dir, 'sparse', sparse=True)
+        test_model(work_dir, 'float32', dtype='float32')
+        test_model(work_dir, 'diagonal', distortion='diagonal')
+        test_model(work_dir, 'hmm', distortion='hmm')
+        logger.info("models loaded from binary files are the same as the trained ones")
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (online stepwise EM)
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import logging
+
+from align_fixtures import SRC_LINES
+from align_fixtures import dense_trans_dist
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        # online training starts from the model given by --init-model
+        init_model = os.path.join(work_dir, 'init.bin')
+        train(work_dir, 'init', iteration_limit=1)
+
+        # whole corpus as single mini-batch with step size 1 is the same as batch EM
+        batch, batch_meta = train(work_dir, 'batch', init_model=init_model, iteration_limit=3)
+        online, online_meta = train(work_dir, 'online', init_model=init_model, iteration_limit=3,
+                                    online=True, batch_size=len(SRC_LINES), step_decay=0, step_offset=1)
+        dprint(np.abs(dense_trans_dist(batch, batch_meta) - dense_trans_dist(online, online_meta)).max())
+        assert np.allclose(dense_trans_dist(batch, batch_meta), dense_trans_dist(online, online_meta), rtol=0, atol=1e-10)
+        assert np.allclose(batch['align_dist'], online['align_dist'], rtol=0, atol=1e-10)
+
+        # stepwise EM over mini-batches reaches the batch EM result
+        batch, batch_meta = train(work_dir, 'batch', init_model=init_model, iteration_limit=300)
+        online, online_meta = train(work_dir, 'online', init_model=init_model, iteration_limit=300,
+                                    online=True, batch_size=len(SRC_LINES) // 2, step_decay=0.51)
+        dprint(np.abs(dense_trans_dist(batch, batch_meta) - dense_trans_dist(online, online_meta)).max())
+        dprint(np.abs(batch['align_dist'] - online['align_dist']).max())
+        assert np.allclose(dense_trans_dist(batch, batch_meta), dense_trans_dist(online, online_meta), rtol=0, atol=0.05)
+        assert np.allclose(batch['align_dist'], online['align_dist'], rtol=0, atol=0.05)
+        logger.info("stepwise EM reaches the batch EM result")
+    finally:
+        shutil.rmtree(work_dir)
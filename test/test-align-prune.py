@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (pruning translation distribution during training)
+"""
+
+import collections
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import archives
+from lpu.common import logging
+from lpu.smt.align import ibm_models
+
+from align_fixtures import SRC_LINES
+from align_fixtures import TRG_LINES
+from align_fixtures import read_trans
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+ITERATION_LIMIT = 200
+
+def train_until_convergence(work_dir, name, **options):
+    '''train until convergence (or given iteration limit) with given options, returns (arrays, meta data) of the saved binary model,
+    the meta data of the checkpoint and the records of the translation distribution'''
+    checkpoint = os.path.join(work_dir, name + '.ckpt')
+    options.setdefault('iteration_limit', ITERATION_LIMIT)
+    arrays, meta = train(work_dir, name, checkpoint=checkpoint, **options)
+    return arrays, meta, archives.load_arrays(checkpoint)[1], read_trans(os.path.join(work_dir, name + '.trans'))
+
+def count_pairs():
+    '''number of the word pairs (including NULL) co-occurring in the sentence pairs, stored without pruning'''
+    pairs = set()
+    for src_line, trg_line in zip(SRC_LINES, TRG_LINES):
+        for src in [ibm_models.NULL_SYMBOL] + src_line.split():
+            pairs.update([(src, trg) for trg in trg_line.split()])
+    return len(pairs)
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        for distortion in ['absolute', 'hmm']:
+            for sparse in [False, True]:
+                options = dict(distortion=distortion, sparse=sparse)
+                _, _, full_state, _ = train_until_convergence(work_dir, 'full', **options)
+                for threshold, nbest in [(0.05, 0), (0, 3), (0, 5), (0.05, 5)]:
+                    prune_options = dict(prune_threshold=threshold, prune_nbest=nbest, **options)
+                    first_state = train_until_convergence(work_dir, 'first', iteration_limit=1, **prune_options)[2]
+                    arrays, meta, state, records = train_until_convergence(work_dir, 'pruned', **prune_options)
+                    dprint((distortion, sparse, threshold, nbest))
+                    dprint((count_pairs(), len(arrays['trans_keys'])))
+                    dprint((full_state['state'], first_state['state'], state['state']))
+                    # saved model and records keep only the pairs left by pruning
+                    assert 'trans_keys' in arrays
+                    assert len(arrays['trans_keys']) < count_pairs()
+                    assert len(records) <= len(arrays['trans_keys'])
+                    if threshold > 0:
+                        assert (np.asarray(arrays['trans_data']) >= threshold).all()
+                    if nbest > 0:
+                        assert max(collections.Counter(np.asarray(arrays['trans_keys']) // meta['trans_shape'][1]).values()) <= nbest
+                        assert max(collections.Counter([src for src, trg in records.keys()]).values()) <= nbest
+                    # entropy still decreases, close to the one without pruning unless the pruning drops the likely pairs
+                    assert np.isfinite(state['state']['entropy'])
+                    assert state['state']['entropy'] < first_state['state']['entropy']
+                    if nbest == 0 or nbest >= 5:
+                        assert abs(state['state']['entropy'] - full_state['state']['entropy']) < 0.05
+        logger.info("pruning shrinks translation distribution, and training still converges")
+    finally:
+        shutil.rmtree(work_dir)
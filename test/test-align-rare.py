@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (rare word classes)
+"""
+
+import collections
+import os
+import shutil
+import tempfile
+import zlib
+
+import numpy as np
+
+from lpu.common import archives
+from lpu.common import logging
+from lpu.common.vocab import StringEnumerator
+from lpu.smt.align import ibm_models
+from lpu.smt.align.aligner import Aligner
+
+from align_fixtures import SRC_LINES
+from align_fixtures import TRG_LINES
+from align_fixtures import read_lines
+from align_fixtures import train_conf
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+def load_vocab(arrays, name):
+    vocab = StringEnumerator()
+    vocab.load_arrays(arrays[name + '_vocab'], arrays[name + '_vocab_offsets'])
+    return list(vocab)
+
+def expected_vocab(lines, method, min_count, limit):
+    '''frequent words in the order of appearance, followed by the classes of the others'''
+    counts = collections.Counter(str.join(' ', lines).split())
+    words = list(collections.OrderedDict.fromkeys(str.join(' ', lines).split()))
+    frequent = set(sorted(words, key=lambda word: -counts[word])[:limit] if limit > 0 else words)
+    keep = [word for word in words if word in frequent and counts[word] >= min_count]
+    rare = [word for word in words if word not in keep]
+    classes = list(collections.OrderedDict.fromkeys([ibm_models.rare_word_class(word, method) for word in rare]))
+    return keep + classes, rare
+
+def test_classes():
+    assert ibm_models.rare_word_class('Tokyo2020', 'shape') == '__RARE_Aa0__'
+    assert ibm_models.rare_word_class('3.14', 'shape') == '__RARE_0.0__'
+    assert ibm_models.rare_word_class('kleines', 'shape') == '__RARE_a__'
+    assert ibm_models.rare_word_class('kleines', 'prefix') == '__RARE_kle__'
+    assert ibm_models.rare_word_class('ab', 'prefix') == '__RARE_ab__'
+    buckets = set([ibm_models.rare_word_class('word%d' % i, 'hash') for i in range(1000)])
+    assert len(buckets) == ibm_models.RARE_HASH_BUCKETS
+    assert buckets == set(['__RARE_%d__' % i for i in range(ibm_models.RARE_HASH_BUCKETS)])
+    # the same class at every call (not depending on the hash seed of the process)
+    assert ibm_models.rare_word_class('kleines', 'hash') == '__RARE_%d__' % (zlib.crc32(b'kleines') % ibm_models.RARE_HASH_BUCKETS)
+    try:
+        ibm_models.rare_word_class('kleines', 'suffix')
+        assert False
+    except ValueError:
+        pass
+
+def test_training(work_dir, method, min_count, vocab_limit):
+    '''rare words should be replaced with their classes in training, and in scoring and aligning with the model'''
+    name = method
+    conf = train_conf(work_dir, name, iteration_limit=3,
+                      save_align_path=os.path.join(work_dir, name + '.align'),
+                      save_scores=os.path.join(work_dir, name + '.scores'),
+                      decode_align=os.path.join(work_dir, name + '.decoded'),
+                      min_count=min_count, vocab_limit=vocab_limit, rare_class=method)
+    ibm_models.train_ibm_models(conf)
+    arrays, meta = archives.load_arrays(conf['save_model'])
+    assert meta['rare_class'] == method
+    src_vocab, src_rare = expected_vocab(SRC_LINES, method, min_count, vocab_limit)
+    trg_vocab, trg_rare = expected_vocab(TRG_LINES, method, min_count, vocab_limit)
+    dprint((method, load_vocab(arrays, 'src'), load_vocab(arrays, 'trg')))
+    assert load_vocab(arrays, 'src') == [ibm_models.NULL_SYMBOL] + src_vocab
+    assert load_vocab(arrays, 'trg') == trg_vocab
+    assert len(src_rare) > 0 and len(trg_rare) > 0
+    # the words of the corpus are mapped in the same way by the loaded model
+    ibm_models.score_ibm_model(dict(
+        src_path = conf['src_path'],
+        trg_path = conf['trg_path'],
+        trans_path = conf['save_model'],
+        align_path = None,
+        save_scores = conf['save_scores'] + '.loaded',
+        decode_align = conf['decode_align'] + '.loaded',
+    ))
+    assert read_lines(conf['save_scores']) == read_lines(conf['save_scores'] + '.loaded')
+    assert read_lines(conf['decode_align']) == read_lines(conf['decode_align'] + '.loaded')
+    # and by the text model given the class
+    ibm_models.score_ibm_model(dict(
+        src_path = conf['src_path'],
+        trg_path = conf['trg_path'],
+        trans_path = conf['save_trans_path'],
+        align_path = conf['save_align_path'],
+        save_scores = conf['save_scores'] + '.text',
+        decode_align = conf['decode_align'] + '.text',
+        rare_class = method,
+    ))
+    assert read_lines(conf['decode_align']) == read_lines(conf['decode_align'] + '.text')
+    scores = [float(line.split('\t')[-1]) for line in read_lines(conf['save_scores'])]
+    text_scores = [float(line.split('\t')[-1]) for line in read_lines(conf['save_scores'] + '.text')]
+    assert np.allclose(scores, text_scores, rtol=1e-6, atol=1e-6)
+    # rare words given to the aligner are the same as their classes
+    aligner = Aligner(conf['save_model'])
+    src_lines = [line for line in SRC_LINES if set(line.split()) & set(src_rare)]
+    trg_lines = [line for line in TRG_LINES if set(line.split()) & set(trg_rare)]
+    num_pairs = min(len(src_lines), len(trg_lines))
+    src_lines, trg_lines = src_lines[:num_pairs], trg_lines[:num_pairs]
+    replaced_src = [[ibm_models.rare_word_class(word, method) if word in src_rare else word for word in line.split()] for line in src_lines]
+    replaced_trg = [[ibm_models.rare_word_class(word, method) if word in trg_rare else word for word in line.split()] for line in trg_lines]
+    entropies, alignments, posteriors = aligner.align(src_lines, trg_lines, posteriors=True, threshold=0)
+    replaced_entropies, replaced_alignments, replaced_posteriors = aligner.align(replaced_src, replaced_trg, posteriors=True, threshold=0)
+    assert np.array_equal(entropies, replaced_entropies)
+    assert [list(alignment) for alignment in alignments] == [list(alignment) for alignment in replaced_alignments]
+    for posterior, replaced_posterior in zip(posteriors, replaced_posteriors):
+        assert np.array_equal(posterior.toarray(), replaced_posterior.toarray())
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        test_classes()
+        write_corpus(work_dir)
+        test_training(work_dir, 'shape', 2, 0)
+        test_training(work_dir, 'prefix', 2, 0)
+        test_training(work_dir, 'hash', 0, 6)
+        logger.info("rare words are replaced with their classes")
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (scoring in worker processes)
+"""
+
+import os
+import shutil
+import tempfile
+
+from lpu.common import logging
+from lpu.smt.align import ibm_models
+
+from align_fixtures import SRC_LINES
+from align_fixtures import read_lines
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+def score(work_dir, name, model_path, workers):
+    '''scores of the corpus given by the model, as lines of the saved file'''
+    save_scores = os.path.join(work_dir, name + '.scores')
+    ibm_models.score_ibm_model(dict(
+        src_path = os.path.join(work_dir, 'src.txt'),
+        trg_path = os.path.join(work_dir, 'trg.txt'),
+        trans_path = model_path,
+        align_path = None,
+        save_scores = save_scores,
+        decode_align = None,
+        workers = workers,
+    ))
+    return read_lines(save_scores)
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        default_batch = ibm_models.SCORE_BATCH
+        for distortion in ['absolute', 'hmm']:
+            train(work_dir, distortion, distortion=distortion, iteration_limit=3)
+            model_path = os.path.join(work_dir, distortion + '.bin')
+            ibm_models.SCORE_BATCH = default_batch
+            single = score(work_dir, 'single', model_path, 1)
+            assert len(single) == len(SRC_LINES)
+            # splitting into several batches, scored in the pool of processes
+            for score_batch in [default_batch, 3, 1]:
+                ibm_models.SCORE_BATCH = score_batch
+                for workers in [1, 2, 3]:
+                    scores = score(work_dir, 'workers', model_path, workers)
+                    dprint((distortion, score_batch, workers))
+                    assert scores == single
+        logger.info("scores of worker processes are the same as single process, in the same order")
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (line protocol of the alignment service)
+"""
+
+import io
+import math
+import os
+import shutil
+import tempfile
+import threading
+
+from lpu.common import logging
+from lpu.smt.align import ibm_models
+
+from align_fixtures import SRC_LINES
+from align_fixtures import TRG_LINES
+from align_fixtures import read_lines
+from align_fixtures import train_conf
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+# unknown words, lengths longer than trained ones and a line without target sentence
+EXTRA_LINES = [
+    'das kleine haus ist nicht gross\tthe small house is not big',
+    'ich lese das buch und sehe das kleine haus\ti read the book and see the small house',
+    'haus',
+]
+
+class RecordingWriter(io.StringIO):
+    '''StringIO keeping the chunks written between the flushes'''
+    def __init__(self):
+        io.StringIO.__init__(self)
+        self.chunks = []
+        self.flushed = 0
+    def flush(self):
+        self.chunks.append(self.getvalue()[self.flushed:])
+        self.flushed = len(self.getvalue())
+
+def serve(model, lines, output, batch_size, lock=None):
+    '''chunks of the output lines written by the service for given input lines'''
+    writer = RecordingWriter()
+    reader = io.StringIO(str.join('', [line + '\n' for line in lines]))
+    ibm_models.serve_stream(model, reader, writer, output, False, batch_size, lock or threading.Lock())
+    return [chunk.splitlines() for chunk in writer.chunks if chunk]
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        pair_lines = ['{}\t{}'.format(src, trg) for src, trg in zip(SRC_LINES, TRG_LINES)]
+        for distortion in ['absolute', 'diagonal', 'hmm']:
+            conf = train_conf(work_dir, distortion, distortion=distortion, iteration_limit=3,
+                              save_scores=os.path.join(work_dir, distortion + '.scores'),
+                              decode_align=os.path.join(work_dir, distortion + '.decoded'))
+            ibm_models.train_ibm_models(conf)
+            model = ibm_models.load_model_file(conf['save_model'])
+            # the same results as scored and decoded by training
+            scores = read_lines(conf['save_scores'])
+            aligns = read_lines(conf['decode_align'])
+            assert serve(model, pair_lines, 'score', 100) == [scores]
+            assert serve(model, pair_lines, 'align', 100) == [aligns]
+            both = ['{}\t{}'.format(score, align) for score, align in zip(scores, aligns)]
+            assert serve(model, pair_lines, 'both', 100) == [both]
+            # answered in batches of at most batch_size lines
+            assert serve(model, pair_lines, 'both', 3) == [both[0:3], both[3:6], both[6:9], both[9:10]]
+            assert serve(model, pair_lines, 'both', 1) == [[line] for line in both]
+            # empty lines end the requests, answered after the pending lines
+            chunks = serve(model, pair_lines[:4] + [''] + pair_lines[4:] + ['', ''], 'both', 3)
+            dprint((distortion, chunks))
+            assert chunks == [both[0:3], both[3:4] + [''], both[4:7], both[7:10], [''], ['']]
+            # unknown words and unseen lengths
+            extra = serve(model, EXTRA_LINES, 'both', 100)[0]
+            assert len(extra) == len(EXTRA_LINES)
+            for line, result in zip(EXTRA_LINES[:2], extra):
+                score, align = result.split('\t')
+                assert not math.isnan(float(score))
+                assert len(align.split()) == len(line.split('\t')[1].split())
+            # missing target sentence is taken as empty one
+            assert extra[2:] == serve(model, [EXTRA_LINES[2] + '\t'], 'both', 100)[0]
+            # threads sharing the model give the same results as single one
+            requests = [pair_lines + EXTRA_LINES, EXTRA_LINES + pair_lines, list(reversed(pair_lines + EXTRA_LINES))] * 2
+            model = ibm_models.load_model_file(conf['save_model'])
+            # each request served by fresh model, extended only for its own lengths
+            expected = [serve(ibm_models.load_model_file(conf['save_model']), lines, 'both', 2) for lines in requests]
+            results = [None] * len(requests)
+            lock = threading.Lock()
+            def run(i):
+                results[i] = serve(model, requests[i], 'both', 2, lock)
+            threads = [threading.Thread(target=run, args=(i,)) for i in range(len(requests))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert results == expected
+        logger.info("service answers the lines with the scores and the alignments in the same order")
+    finally:
+        shutil.rmtree(work_dir)
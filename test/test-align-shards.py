@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (source vocabulary sharded into processes)
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import logging
+from lpu.smt.align import ibm_models
+
+from align_fixtures import dense_trans_dist
+from align_fixtures import read_lines
+from align_fixtures import read_records
+from align_fixtures import read_trans
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+def train_outputs(work_dir, name, **options):
+    '''train with given options, returns (arrays, meta data) of the saved binary model and the paths of the text outputs'''
+    paths = dict([(key, os.path.join(work_dir, name + ext)) for key, ext in [('save_align_path', '.align'), ('save_scores', '.scores'), ('decode_align', '.decoded')]])
+    arrays, meta = train(work_dir, name, iteration_limit=4, **dict(paths, **options))
+    return arrays, meta, dict(paths, save_trans_path=os.path.join(work_dir, name + '.trans'))
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        for distortion in ['absolute', 'diagonal']:
+            for sparse in [False, True]:
+                arrays, meta, paths = train_outputs(work_dir, 'single', distortion=distortion, sparse=sparse)
+                shard_arrays, shard_meta, shard_paths = train_outputs(work_dir, 'shards', distortion=distortion, sparse=sparse, shards=3)
+                dprint((distortion, sparse))
+                dprint(np.abs(dense_trans_dist(arrays, meta) - dense_trans_dist(shard_arrays, shard_meta)).max())
+                # the rows of the shards are merged into the same model
+                assert arrays.keys() == shard_arrays.keys()
+                assert np.allclose(dense_trans_dist(arrays, meta), dense_trans_dist(shard_arrays, shard_meta), rtol=0, atol=1e-10)
+                if distortion == 'absolute':
+                    assert np.allclose(arrays['align_dist'], shard_arrays['align_dist'], rtol=0, atol=1e-10)
+                else:
+                    assert np.isclose(meta['tension'], shard_meta['tension'], rtol=0, atol=1e-10)
+                records = read_trans(paths['save_trans_path'])
+                shard_records = read_trans(shard_paths['save_trans_path'])
+                assert len(records) > 0
+                assert records.keys() == shard_records.keys()
+                for key, (prob, count) in records.items():
+                    assert np.isclose(prob, shard_records[key][0], rtol=0, atol=2e-8)
+                    assert np.isclose(count, shard_records[key][1], rtol=0, atol=0.011)
+                align_keys = 4 if distortion == 'absolute' else 2
+                align_records = read_records(paths['save_align_path'], align_keys)
+                shard_align_records = read_records(shard_paths['save_align_path'], align_keys)
+                assert align_records.keys() == shard_align_records.keys()
+                for key, value in align_records.items():
+                    if isinstance(value, float):
+                        assert np.isclose(value, shard_align_records[key], rtol=0, atol=2e-8)
+                    else:
+                        assert value == shard_align_records[key]
+                assert read_lines(paths['decode_align']) == read_lines(shard_paths['decode_align'])
+                assert np.allclose(np.loadtxt(paths['save_scores']), np.loadtxt(shard_paths['save_scores']), rtol=0, atol=1e-10)
+        # not combined with the options needing whole distribution in each process
+        assert ibm_models.train_ibm_models(dict(src_path=os.path.join(work_dir, 'src.txt'), trg_path=os.path.join(work_dir, 'trg.txt'), shards=3, distortion='hmm')) == False
+        logger.info("sharded training gives the same outputs as single process")
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (sparse translation distribution)
+"""
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import logging
+
+from align_fixtures import dense_trans_dist
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        for distortion in ['absolute', 'diagonal']:
+            dense_arrays, dense_meta = train(work_dir, 'dense', distortion=distortion)
+            sparse_arrays, sparse_meta = train(work_dir, 'sparse', distortion=distortion, sparse=True)
+            assert 'trans_dist' in dense_arrays
+            assert 'trans_keys' in sparse_arrays
+            dense = dense_trans_dist(dense_arrays, dense_meta)
+            sparse = dense_trans_dist(sparse_arrays, sparse_meta)
+            dprint(distortion)
+            dprint(np.abs(dense - sparse).max())
+            assert dense.shape == sparse.shape
+            assert np.allclose(dense, sparse, rtol=0, atol=1e-10)
+            if distortion == 'absolute':
+                assert np.allclose(dense_arrays['align_dist'], sparse_arrays['align_dist'], rtol=0, atol=1e-10)
+            else:
+                assert np.isclose(dense_meta['tension'], sparse_meta['tension'])
+        logger.info("dense and sparse translation distributions are the same")
+    finally:
+        shutil.rmtree(work_dir)
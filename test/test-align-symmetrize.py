@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.symmetrize
+"""
+
+import numpy as np
+
+from lpu.common import logging
+from lpu.smt.align import symmetrize
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+# neighbors in the order of checking them, as in the pseudo code of Koehn et al. (2003)
+NEIGHBORING = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+
+def reference_grow_diag_final_and(forward, backward):
+    '''grow-diag-final-and of the sets of (src, trg) points of single sentence pair,
+    following the sequential pseudo code of Moses (scanning the alignment matrix, adding the points one by one)'''
+    union = forward | backward
+    alignment = set(forward & backward)
+    len_src = max([src for src, trg in union] + [0])
+    len_trg = max([trg for src, trg in union] + [0])
+    def src_aligned(src):
+        return any([(src, trg) in alignment for trg in range(1, len_trg + 1)])
+    def trg_aligned(trg):
+        return any([(src, trg) in alignment for src in range(1, len_src + 1)])
+    # grow-diag
+    while True:
+        added = False
+        for src in range(1, len_src + 1):
+            for trg in range(1, len_trg + 1):
+                if (src, trg) not in alignment:
+                    continue
+                for ds, dt in NEIGHBORING:
+                    new = (src + ds, trg + dt)
+                    if new in union and new not in alignment:
+                        if not src_aligned(new[0]) or not trg_aligned(new[1]):
+                            alignment.add(new)
+                            added = True
+        if not added:
+            break
+    # final-and
+    for links in [forward, backward]:
+        for src in range(1, len_src + 1):
+            for trg in range(1, len_trg + 1):
+                if (src, trg) in links and not src_aligned(src) and not trg_aligned(trg):
+                    alignment.add( (src, trg) )
+    return alignment
+
+def encode(points, sent_points):
+    return np.array(sorted([(i * points.stride + src) * points.stride + trg for i, pairs in enumerate(sent_points) for src, trg in pairs]), np.int64)
+
+def decode(points, keys, num_sents):
+    sent_points = [set() for i in range(num_sents)]
+    for key in keys.tolist():
+        sent_points[key // (points.stride * points.stride)].add( (key // points.stride % points.stride, key % points.stride) )
+    return sent_points
+
+def random_links(rand, len_src, len_trg, rate):
+    return set([(src, trg) for src in range(1, len_src + 1) for trg in range(1, len_trg + 1) if rand.rand() < rate])
+
+if __name__ == '__main__':
+    # points (1,1), (1,2) and (2,2) are left for the final step, (2,2) is still free after (1,1) is added
+    points = symmetrize.AlignPoints(np.array([2]), np.array([2]))
+    forward = encode(points, [[(1, 1), (1, 2), (2, 2)]])
+    backward = encode(points, [[]])
+    dprint(decode(points, points.grow_diag_final_and(forward, backward), 1))
+    assert decode(points, points.grow_diag_final_and(forward, backward), 1) == [set([(1, 1), (2, 2)])]
+    # (2,2) is not grown, as both of its words are aligned after adding (2,1) and (1,2)
+    forward = encode(points, [[(1, 1), (2, 1), (1, 2)]])
+    backward = encode(points, [[(1, 1), (2, 2)]])
+    dprint(decode(points, points.grow_diag_final_and(forward, backward), 1))
+    assert decode(points, points.grow_diag_final_and(forward, backward), 1) == [set([(1, 1), (1, 2), (2, 1)])]
+
+    rand = np.random.RandomState(0)
+    # many-to-many links
+    num_sents = 200
+    src_lengths = rand.randint(1, 8, num_sents)
+    trg_lengths = rand.randint(1, 8, num_sents)
+    points = symmetrize.AlignPoints(src_lengths, trg_lengths)
+    forward_links = [random_links(rand, src_lengths[i], trg_lengths[i], 0.3) for i in range(num_sents)]
+    backward_links = [random_links(rand, src_lengths[i], trg_lengths[i], 0.3) for i in range(num_sents)]
+    result = decode(points, points.grow_diag_final_and(encode(points, forward_links), encode(points, backward_links)), num_sents)
+    for i in range(num_sents):
+        assert result[i] == reference_grow_diag_final_and(forward_links[i], backward_links[i]), i
+
+    # alignments decoded in both directions (with NULL alignments)
+    trg_align = np.concatenate([rand.randint(0, src_lengths[i] + 1, trg_lengths[i]) for i in range(num_sents)])
+    src_align = np.concatenate([rand.randint(0, trg_lengths[i] + 1, src_lengths[i]) for i in range(num_sents)])
+    trg_offsets = np.concatenate([[0], np.cumsum(trg_lengths)])
+    src_offsets = np.concatenate([[0], np.cumsum(src_lengths)])
+    forward_links = [set([(src, j + 1) for j, src in enumerate(trg_align[trg_offsets[i]:trg_offsets[i+1]]) if src > 0]) for i in range(num_sents)]
+    backward_links = [set([(i + 1, trg) for i, trg in enumerate(src_align[src_offsets[k]:src_offsets[k+1]]) if trg > 0]) for k in range(num_sents)]
+    for method in symmetrize.SYMMETRIZE_METHODS:
+        keys = symmetrize.symmetrize(src_lengths, trg_lengths, trg_align, src_align, method, points)
+        result = decode(points, keys, num_sents)
+        for i in range(num_sents):
+            if method == 'intersection':
+                assert result[i] == forward_links[i] & backward_links[i]
+            elif method == 'union':
+                assert result[i] == forward_links[i] | backward_links[i]
+            else:
+                assert result[i] == reference_grow_diag_final_and(forward_links[i], backward_links[i]), i
+        lines = points.format_lines(keys)
+        assert len(lines) == num_sents
+        for i in range(num_sents):
+            assert set(lines[i].split()) == set(['{}-{}'.format(trg, src) for src, trg in result[i]])
+    logger.info("symmetrized alignments are the same as the reference")
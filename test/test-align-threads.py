@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (expectation kernels running in threads)
+"""
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import logging
+from lpu.smt.align import ibm_models
+
+from align_fixtures import dense_trans_dist
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        # splitting into many batches and length buckets, flushing the scratch for each of them
+        for batch_pairs in [ibm_models.BATCH_PAIRS, 7]:
+            ibm_models.BATCH_PAIRS = batch_pairs
+            for options in [dict(), dict(sparse=True), dict(dtype='float32'), dict(distortion='diagonal'), dict(distortion='diagonal', sparse=True)]:
+                single_arrays, single_meta = train(work_dir, 'single', iteration_limit=3, **options)
+                tolerance = 1e-6 if options.get('dtype') == 'float32' else 1e-12
+                for threads in [2, 3]:
+                    arrays, meta = train(work_dir, 'threads', iteration_limit=3, threads=threads, **options)
+                    dprint((batch_pairs, options, threads))
+                    dprint(np.abs(dense_trans_dist(single_arrays, single_meta) - dense_trans_dist(arrays, meta)).max())
+                    assert single_arrays.keys() == arrays.keys()
+                    assert np.allclose(dense_trans_dist(single_arrays, single_meta), dense_trans_dist(arrays, meta), rtol=0, atol=tolerance)
+                    if 'align_dist' in arrays:
+                        assert np.allclose(single_arrays['align_dist'], arrays['align_dist'], rtol=0, atol=tolerance)
+                    else:
+                        assert np.isclose(single_meta['tension'], meta['tension'], rtol=0, atol=tolerance)
+        logger.info("expectation kernels give the same distributions in threads")
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.smt.align.ibm_models (expectation step in worker processes)
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import archives
+from lpu.common import logging
+
+from align_fixtures import read_trans
+from align_fixtures import train
+from align_fixtures import write_corpus
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+def train_with_checkpoint(work_dir, name, **options):
+    '''train with given options, returns (arrays, meta data) of the checkpoint and the records of the translation distribution'''
+    checkpoint = os.path.join(work_dir, name + '.ckpt')
+    train(work_dir, name, checkpoint=checkpoint, iteration_limit=4, **options)
+    return archives.load_arrays(checkpoint), read_trans(os.path.join(work_dir, name + '.trans'))
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_corpus(work_dir)
+        for sparse in [False, True]:
+            (arrays, meta), records = train_with_checkpoint(work_dir, 'single', sparse=sparse)
+            for workers in [2, 3]:
+                (worker_arrays, worker_meta), worker_records = train_with_checkpoint(work_dir, 'workers', sparse=sparse, workers=workers)
+                dprint((sparse, workers))
+                dprint(meta['state'])
+                dprint(worker_meta['state'])
+                # entropy and counts accumulated by the workers
+                assert meta['state']['step'] == worker_meta['state']['step']
+                assert np.isclose(meta['state']['entropy'], worker_meta['state']['entropy'], rtol=1e-12, atol=0)
+                assert records.keys() == worker_records.keys()
+                for key, (prob, count) in records.items():
+                    assert np.isclose(prob, worker_records[key][0], rtol=0, atol=2e-8)
+                    assert np.isclose(count, worker_records[key][1], rtol=0, atol=0.011)
+                for name in ['trans_dist', 'trans_data', 'align_dist']:
+                    if name in arrays:
+                        assert np.allclose(arrays[name], worker_arrays[name], rtol=0, atol=1e-10)
+        logger.info("expected counts and entropies of worker processes are the same as single process")
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  test the module: lpu.common.vocab
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+from lpu.common import archives
+from lpu.common import logging
+from lpu.common import vocab
+from lpu.common.vocab import PhraseEnumerator
+from lpu.common.vocab import StringEnumerator
+
+logger = logging.getColorLogger(__name__)
+dprint = logger.debug_print
+
+# enough strings to grow the hash table from TABLE_SIZE slots many times
+STRINGS = ['', 'a', 'b', 'ab', 'ba', '日本語', 'ｶﾀｶﾅ', 'naïve'] + ['word%d' % i for i in range(3000)]
+
+def check_strings(enumerator, strings):
+    '''every string should be mapped to its index, and back'''
+    assert len(enumerator) == len(strings)
+    assert list(enumerator) == strings
+    for i, string in enumerate(strings):
+        assert enumerator.find(string) == i, string
+        assert enumerator.str2id(string) == i, string
+        assert enumerator.id2str(i) == string
+    assert enumerator.encode(strings, False).tolist() == list(range(len(strings)))
+    assert enumerator.decode(np.arange(len(strings))) == strings
+    assert len(enumerator) == len(strings)
+
+def test_string_enumerator(work_dir):
+    enumerator = StringEnumerator()
+    # registered one by one
+    for i, string in enumerate(STRINGS[:1000]):
+        assert enumerator.find(string) == -1
+        assert enumerator.str2id(string) == i
+    # registered at once, with duplicates and the strings already registered
+    ids = enumerator.encode(STRINGS[500:] + STRINGS[::-1])
+    assert ids.tolist() == list(range(500, len(STRINGS))) + list(range(len(STRINGS)))[::-1]
+    check_strings(enumerator, STRINGS)
+    assert enumerator.find('unknown') == -1
+    assert enumerator.encode(['a', 'unknown', 'b'], False).tolist() == [1, -1, 2]
+    assert enumerator.encode([], False).tolist() == []
+    assert len(enumerator) == len(STRINGS)
+    # strings having new lines (separator of the joined buffer)
+    lines = ['a\nb', '\n', 'a', 'b', '', '\n']
+    ids = enumerator.encode(lines)
+    assert ids.tolist() == [len(STRINGS), len(STRINGS) + 1, 1, 2, 0, len(STRINGS) + 1]
+    assert enumerator.decode(ids) == lines
+    assert enumerator.str2id('a\nb') == len(STRINGS)
+    enumerator = pickle.loads(pickle.dumps(enumerator))
+    check_strings(enumerator, STRINGS + ['a\nb', '\n'])
+    enumerator = StringEnumerator()
+    enumerator.encode(STRINGS)
+    for invalid in [-1, len(STRINGS)]:
+        try:
+            enumerator.id2str(invalid)
+            assert False
+        except IndexError:
+            pass
+    # copies in another tables
+    check_strings(pickle.loads(pickle.dumps(enumerator)), STRINGS)
+    loaded = StringEnumerator()
+    loaded.str2id('b')
+    assert loaded.load_arrays(*enumerator.to_arrays()).tolist() == [1, 2, 0] + list(range(3, len(STRINGS)))
+    assert loaded.id2str(0) == 'b' and loaded.id2str(1) == ''
+    # saved with the table, and extended after loaded from memory map
+    path = os.path.join(work_dir, 'vocab.bin')
+    enumerator.save(path)
+    arrays, meta = archives.load_arrays(path)
+    dprint(len(arrays['table']))
+    assert len(arrays['table']) >= 2 * len(STRINGS) > vocab.TABLE_SIZE
+    loaded = StringEnumerator().load(path)
+    check_strings(loaded, STRINGS)
+    extra = ['extra%d' % i for i in range(len(STRINGS))]
+    for i, string in enumerate(extra):
+        assert loaded.str2id(string) == len(STRINGS) + i
+    check_strings(loaded, STRINGS + extra)
+    check_strings(StringEnumerator().load(path), STRINGS)
+
+def test_phrase_enumerator(work_dir):
+    phrases = [[], [0], [1], [0, 1], [1, 0], [0, 1, 2], [-1, 2 ** 31 - 1]] + [list(range(i % 7, i % 7 + i % 5 + 1)) + [i] for i in range(2000)]
+    enumerator = PhraseEnumerator()
+    # ids start from 1, registered one by one (lists and arrays of any integer types)
+    for i, phrase in enumerate(phrases[:1000]):
+        assert enumerator.find(phrase) == -1
+        assert enumerator.ids2id(phrase if i % 2 else np.array(phrase, np.int64)) == i + 1
+    assert enumerator.ids2id(np.array(phrases[3], np.int32)) == 4
+    # registered at once, with duplicates and the phrases already registered
+    word_ids = np.array([word for phrase in phrases[500:] + phrases for word in phrase], np.int64)
+    offsets = np.concatenate([[0], np.cumsum([len(phrase) for phrase in phrases[500:] + phrases])])
+    ids = enumerator.encode(word_ids, offsets)
+    assert ids.tolist() == list(range(501, len(phrases) + 1)) + list(range(1, len(phrases) + 1))
+    assert len(enumerator) == len(phrases)
+    for i, phrase in enumerate(phrases):
+        assert enumerator.find(phrase) == i + 1
+        assert enumerator.id2ids(i + 1).tolist() == phrase
+        assert not enumerator.id2ids(i + 1).flags.writeable
+    assert enumerator.find([2, 1, 0]) == -1
+    assert enumerator.encode([0, 1, 2, 1, 0], [0, 2, 5], False).tolist() == [4, -1]
+    for invalid in [0, len(phrases) + 1]:
+        try:
+            enumerator.id2ids(invalid)
+            assert False
+        except IndexError:
+            pass
+        try:
+            enumerator.decode([1, invalid])
+            assert False
+        except IndexError:
+            pass
+    for invalid_offsets in [[0, 2, 6], [0, 3, 2], [-1, 2]]:
+        try:
+            enumerator.encode([0, 1, 2, 1, 0], invalid_offsets)
+            assert False
+        except ValueError:
+            pass
+    decoded, decoded_offsets = enumerator.decode([3, 1, 6, 3])
+    assert decoded.tolist() == [1, 0, 1, 2, 1]
+    assert decoded_offsets.tolist() == [0, 1, 1, 4, 5]
+    # copies in another sets
+    word_ids, offsets = enumerator.to_arrays()
+    loaded = PhraseEnumerator()
+    loaded.ids2id([1])
+    assert loaded.load_arrays(word_ids, offsets).tolist() == [2, 3, 1] + list(range(4, len(phrases) + 1))
+    path = os.path.join(work_dir, 'phrases.bin')
+    enumerator.save(path)
+    loaded = PhraseEnumerator().load(path)
+    assert len(loaded) == len(phrases)
+    for i, phrase in enumerate(phrases):
+        assert loaded.find(phrase) == i + 1
+        assert loaded.id2ids(i + 1).tolist() == phrase
+    assert loaded.ids2id([2, 1, 0]) == len(phrases) + 1
+
+def test_phrases():
+    '''module-level functions of the phrases of words'''
+    phrases = ['the house', 'the', 'house', 'a small house', 'the house']
+    ids = [vocab.phrase2id(phrase) for phrase in phrases]
+    assert ids[0] == ids[4] and len(set(ids)) == 4 and min(ids) >= 1
+    assert [vocab.id2phrase(number) for number in ids] == phrases
+    assert vocab.phrases2ids(phrases + ['a house']).tolist() == ids + [max(ids) + 1]
+    assert vocab.ids2phrases(ids) == phrases
+    assert vocab.idvec2phrase(vocab.phrase2idvec('a small house')) == 'a small house'
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    try:
+        test_string_enumerator(work_dir)
+        test_phrase_enumerator(work_dir)
+        test_phrases()
+        logger.info("strings and phrases are mapped to their ids and back")
+    finally:
+        shutil.rmtree(work_dir)